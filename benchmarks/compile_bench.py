@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""Compile-time benchmark on mechanically generated schemas.
+
+Generates schemas with the requested numbers of type declarations and
+reports parse time, compile time and peak memory for each. Every size runs
+in a fresh process so peak memory figures don't bleed into each other.
+
+    python benchmarks/compile_bench.py [--sizes 10000,100000,1000000]
+"""
+
+import os
+import sys
+import gc
+import time
+import argparse
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import blobc
+from blobc.Driver import paused_gc
+
+def generate_schema(count):
+    """Return schema source with count declarations: a mix of constants,
+    enums and structs that embed, point to and derive from earlier ones."""
+    out = [
+        'defprimitive u8 uint 1;',
+        'defprimitive u32 uint 4;',
+        'defprimitive f32 float 4;',
+        'defprimitive char character 1;',
+    ]
+    structs = []
+    for i in xrange(count):
+        kind = i % 10
+        if kind == 0:
+            out.append('iconst N%d = %d + %d;' % (i, i % 7, i % 3 + 1))
+        elif kind == 1:
+            out.append('enum E%d { A%d = %d, B%d, C%d = A%d + 4, }' % (i, i, i % 5, i, i, i))
+        else:
+            name = 'S%d' % (i)
+            members = ['u32 id;', 'f32[2] pos;']
+            header = 'struct %s' % (name)
+            if structs:
+                prev = structs[-1]
+                if kind == 2:
+                    header += ' : base(%s)' % (prev)
+                    members = ['u8 extra%d;' % (i)]
+                elif kind < 6:
+                    members.append('%s inner;' % (prev))
+                else:
+                    members.append('%s* link;' % (structs[i % len(structs)]))
+                    members.append('char* label;')
+            if kind == 9 and i >= 10:
+                members.append('u8[N%d] data;' % (i - i % 10))
+            out.append('%s { %s }' % (header, ' '.join(members)))
+            structs.append(name)
+    return '\n'.join(out) + '\n'
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on Mac OS X
+    if sys.platform == 'darwin':
+        rss /= 1024
+    return rss / 1024.0
+
+def run_one(count, lazy):
+    src = generate_schema(count)
+    gc.collect()
+    base_rss = peak_rss_mb()
+
+    # as blobc.py runs
+    with paused_gc():
+        t0 = time.time()
+        parse_tree = blobc.parse_string(src)
+        t1 = time.time()
+        tsys = blobc.compile_types(parse_tree, lazy=lazy)
+        t2 = time.time()
+
+    print '%9d decls  parse %7.2fs  compile %7.2fs  peak rss %8.1f MB (+%.1f MB)' % (
+        count, t1 - t0, t2 - t1, peak_rss_mb(), peak_rss_mb() - base_rss)
+    sys.stdout.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark blobc schema compilation')
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma-separated declaration counts')
+    parser.add_argument('--lazy', action='store_true',
+                        help='compile with lazy struct resolution')
+    parser.add_argument('--one', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one is not None:
+        run_one(args.one, args.lazy)
+        return 0
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        cmd = [sys.executable, os.path.abspath(__file__), '--one', str(size)]
+        if args.lazy:
+            cmd.append('--lazy')
+        rc = subprocess.call(cmd)
+        if rc != 0:
+            return rc
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Parse-tree memory benchmark.
+
+Parses a generated schema (see compile_bench.py) and reports how much
+memory the resulting parse tree holds, counting every object reachable
+from it once, and the bytes per struct member.
+
+    python benchmarks/parse_memory_bench.py [--decls 20000]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import blobc
+from blobc.ParseTree import RawStructType
+from compile_bench import generate_schema
+
+def deep_size(root):
+    """Bytes held by root and everything reachable from it, each object
+    counted once. Classes and modules are not followed."""
+    seen = set()
+    total = 0
+    work = [root]
+    while work:
+        o = work.pop()
+        if id(o) in seen or isinstance(o, (type, type(sys))):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            work.extend(o.iterkeys())
+            work.extend(o.itervalues())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            work.extend(o)
+        else:
+            d = getattr(o, '__dict__', None)
+            if d is not None:
+                work.append(d)
+            for cls in type(o).__mro__:
+                for slot in cls.__dict__.get('__slots__', ()):
+                    if hasattr(o, slot):
+                        work.append(getattr(o, slot))
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure blobc parse-tree memory')
+    parser.add_argument('--decls', type=int, default=20000, help='declarations in the schema')
+    args = parser.parse_args()
+
+    data = generate_schema(args.decls)
+    t0 = time.time()
+    parse_tree = blobc.parse_string(data)
+    elapsed = time.time() - t0
+
+    members = sum(len(p.members) for p in parse_tree if isinstance(p, RawStructType))
+    size = deep_size(parse_tree)
+    print '%d declarations, %d struct members, parsed in %.2fs' % (args.decls, members, elapsed)
+    print 'parse tree %.1f MB, %.0f bytes per member' % (size / 1048576.0, float(size) / members)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
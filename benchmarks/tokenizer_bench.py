@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""Tokenizer micro-benchmark.
+
+Tokenizes a generated schema (see compile_bench.py) with the current
+tokenizer and with blobc/Parser.py as of a baseline git revision (by default
+the one before the single-match tokenizer rewrite) and reports tokens per
+second, then times a full parse with each. The garbage collector is paused
+as in blobc.py.
+
+    python benchmarks/tokenizer_bench.py [--decls 20000] [--repeat 3] [--baseline-rev REV]
+"""
+
+import os
+import sys
+import imp
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from blobc.Parser import Tokenizer, ParseContext, StringImportHandler, TOK_EOF
+from blobc.Driver import paused_gc
+from compile_bench import generate_schema
+
+# the parent of the single-match tokenizer rewrite
+BASELINE_REV = '5277bb3'
+
+def load_baseline(rev):
+    """blobc/Parser.py as of git revision rev, loaded as a module of its own"""
+    source = subprocess.check_output(['git', 'show', '%s:blobc/Parser.py' % (rev)], cwd=ROOT)
+    # named inside the blobc package so its 'from ParseTree import *' resolves
+    module = imp.new_module('blobc._baseline_Parser')
+    module.__file__ = '<%s:blobc/Parser.py>' % (rev)
+    exec compile(source, module.__file__, 'exec') in module.__dict__
+    return module
+
+def count_tokens(data):
+    # the way the parser steps through tokens
+    tok = Tokenizer('<bench>', data, False)
+    advance = tok.advance
+    n = 0
+    while tok.t != TOK_EOF:
+        advance()
+        n += 1
+    return n
+
+def count_baseline_tokens(baseline, data):
+    tok = baseline.Tokenizer('<bench>', data, False)
+    n = 0
+    while tok.next()[0] != TOK_EOF:
+        n += 1
+    return n
+
+def parse(data):
+    ctx = ParseContext(False, StringImportHandler(data))
+    return ctx.parse('<string>')
+
+def parse_baseline(baseline, data):
+    return baseline.Parser(baseline.Tokenizer('<string>', data, False)).r_unit()
+
+def best_of(repeat, fn, *args):
+    best = None
+    for i in xrange(repeat):
+        t0 = time.time()
+        result = fn(*args)
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the blobc tokenizer')
+    parser.add_argument('--decls', type=int, default=20000, help='declarations in the schema')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement; the best is reported')
+    parser.add_argument('--baseline-rev', default=BASELINE_REV, help='git revision to compare against')
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline_rev)
+    data = generate_schema(args.decls)
+    print '%d declarations, %d bytes' % (args.decls, len(data))
+    with paused_gc():
+        run(baseline, data, args.repeat)
+    return 0
+
+def run(baseline, data, repeat):
+    elapsed, ntokens = best_of(repeat, count_baseline_tokens, baseline, data)
+    print '%-9s tokenize %6.3fs  %10.0f tokens/s' % ('baseline', elapsed, ntokens / elapsed)
+    elapsed, nodes = best_of(repeat, parse_baseline, baseline, data)
+    print '%-9s parse    %6.3fs  %10.0f decls/s' % ('baseline', elapsed, len(nodes) / elapsed)
+    elapsed, ntokens = best_of(repeat, count_tokens, data)
+    print '%-9s tokenize %6.3fs  %10.0f tokens/s' % ('current', elapsed, ntokens / elapsed)
+    elapsed, nodes = best_of(repeat, parse, data)
+    print '%-9s parse    %6.3fs  %10.0f decls/s' % ('current', elapsed, len(nodes) / elapsed)
+
+if __name__ == '__main__':
+    sys.exit(main())
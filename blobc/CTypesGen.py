@@ -0,0 +1,98 @@
+
+import ctypes
+
+from Typesys import *
+
+_uint_ctypes = { 1: ctypes.c_uint8, 2: ctypes.c_uint16, 4: ctypes.c_uint32, 8: ctypes.c_uint64 }
+_sint_ctypes = { 1: ctypes.c_int8, 2: ctypes.c_int16, 4: ctypes.c_int32, 8: ctypes.c_int64 }
+_float_ctypes = { 4: ctypes.c_float, 8: ctypes.c_double }
+_char_ctypes = { 1: ctypes.c_char, 2: ctypes.c_uint16, 4: ctypes.c_uint32 }
+
+class NativeStructBase(object):
+    """Mixin for generated ctypes mirror classes.
+
+    Instances live in native memory laid out exactly as the target machine
+    would see them, so a struct (or an array of them) can be filled in place
+    and dumped as-is. Pointer members are plain offset-sized integers; the
+    caller is responsible for writing offsets and relocations."""
+
+    def native_bytes(self):
+        return ctypes.string_at(ctypes.addressof(self), ctypes.sizeof(self))
+
+class CTypesMapper(object):
+    def __init__(self, targmach):
+        self.targmach = targmach
+        if targmach.big_endian:
+            self._struct_base = ctypes.BigEndianStructure
+        else:
+            self._struct_base = ctypes.LittleEndianStructure
+        self._ptr_ctype = _uint_ctypes[targmach.pointer_size]
+        self._classes = {}
+
+    def ctype(self, t):
+        if isinstance(t, StructType):
+            return self.struct_class(t)
+        elif isinstance(t, ArrayType):
+            return self.ctype(t.base_type) * t.dim
+        elif isinstance(t, PointerType):
+            return self._ptr_ctype
+        elif isinstance(t, EnumType):
+            return ctypes.c_uint32
+        elif isinstance(t, UnsignedIntType):
+            return _uint_ctypes[t.size]
+        elif isinstance(t, SignedIntType):
+            return _sint_ctypes[t.size]
+        elif isinstance(t, FloatingType):
+            return _float_ctypes[t.size]
+        elif isinstance(t, CharacterType):
+            return _char_ctypes[t.size]
+        else:
+            raise TypeSystemException(None, 'type %s has no ctypes equivalent' % (str(t)))
+
+    def struct_class(self, t):
+        cls = self._classes.get(t)
+        if cls is not None:
+            return cls
+
+        targmach = self.targmach
+        layout = targmach.struct_layout(t)
+
+        # Pad explicitly between members and pack to 1 byte so the ctypes
+        # layout never depends on the host C compiler's alignment rules.
+        fields = []
+        pos = 0
+        for mem, offset, size in zip(t.members, layout.offsets, layout.sizes):
+            if offset > pos:
+                fields.append(('_blobc_pad%d' % (len(fields)), ctypes.c_uint8 * (offset - pos)))
+            fields.append((mem.mname, self.ctype(mem.mtype)))
+            pos = offset + size
+        if layout.size > pos:
+            fields.append(('_blobc_pad%d' % (len(fields)), ctypes.c_uint8 * (layout.size - pos)))
+
+        pyfields = dict(_pack_ = 1, _fields_ = fields, srctype = t, targmach = targmach)
+        cls = type(t.name, (self._struct_base, NativeStructBase), pyfields)
+        self._classes[t] = cls
+        return cls
+
+def validate_ctypes_layout(cls):
+    """Cross-check a ctypes mirror class against the target machine layout"""
+    t, targmach = cls.srctype, cls.targmach
+    layout = targmach.struct_layout(t)
+    if ctypes.sizeof(cls) != layout.size:
+        raise TypeSystemException(t.location, "ctypes size of %s is %d; expected %d" %
+                (t.name, ctypes.sizeof(cls), layout.size))
+    for mem, offset, size in zip(t.members, layout.offsets, layout.sizes):
+        field = getattr(cls, mem.mname)
+        if field.offset != offset or field.size != size:
+            raise TypeSystemException(mem.location,
+                    "ctypes layout of %s.%s is offset %d, size %d; expected offset %d, size %d" %
+                    (t.name, mem.mname, field.offset, field.size, offset, size))
+
+def generate_ctypes_classes(typesys, targmach, global_dict, validate=True):
+    mapper = CTypesMapper(targmach)
+    for t in typesys.itertypes():
+        if isinstance(t, StructType):
+            cls = mapper.struct_class(t)
+            if validate:
+                validate_ctypes_layout(cls)
+            global_dict[t.name] = cls
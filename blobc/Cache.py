@@ -0,0 +1,195 @@
+
+import os
+import errno
+import hashlib
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError: # pragma: no cover
+    import pickle
+
+from Parser import ParseContext, DefaultImportHandler
+from Typesys import compile_types
+
+# Bump whenever the pickled format or the compiler's output changes.
+CACHE_VERSION = 2
+
+class SchemaCache(object):
+    """On-disk cache of compiled schemas.
+
+    Entries are keyed by the main file's name, content and the import
+    setup. Each entry records the content hash of every file that went into
+    it and the file every import statement resolved to, and those are
+    checked again on lookup, so editing any transitively imported file, or
+    adding one that an import now finds first, invalidates the entry."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _key(self, fn, data, key_extra):
+        h = hashlib.sha1()
+        for part in (str(CACHE_VERSION), os.getcwd(), fn, key_extra, hashlib.sha1(data).hexdigest()):
+            h.update(part)
+            h.update('\0')
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.schema')
+
+    def _deps_valid(self, deps, imports, import_handler):
+        for name, fn in imports:
+            if import_handler.find_imported_file(name) != fn:
+                return False
+        for fn, digest in deps:
+            try:
+                data = import_handler.get_import_contents(fn)
+            except (IOError, OSError):
+                return False
+            if hashlib.sha1(data).hexdigest() != digest:
+                return False
+        return True
+
+    def load(self, fn, data, import_handler, key_extra=''):
+        """Return the cached FrozenSchema for fn, or None"""
+        entry = self.load_entry(fn, data, import_handler, key_extra)
+        return entry[1] if entry is not None else None
+
+    def load_entry(self, fn, data, import_handler, key_extra=''):
+        """Return (deps, FrozenSchema) cached for fn, or None. deps lists
+        (filename, content sha1) of every file that went into the schema."""
+        try:
+            with open(self._path(self._key(fn, data, key_extra)), 'rb') as f:
+                deps, imports, schema = pickle.load(f)
+        except Exception:
+            # missing, truncated or from an older version; treat as a miss
+            return None
+
+        if not self._deps_valid(deps, imports, import_handler):
+            return None
+        return deps, schema
+
+    def store(self, fn, data, deps, schema, key_extra='', imports=()):
+        """Cache schema for fn. deps lists (filename, content sha1) of every
+        file that went into it, imports (name, filename) for every import
+        statement, as resolved by the import handler."""
+        _atomic_pickle(self.cache_dir, self._path(self._key(fn, data, key_extra)),
+                       (deps, list(imports), schema))
+
+class ParseCache(object):
+    """On-disk cache of the parse results of single files.
+
+    Entries hold the raw parse nodes of one file, import statements
+    included, keyed by the file's name and content and by whether it was
+    parsed as an import. Different top-level files that import the same
+    files share these entries."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _path(self, fn, digest, is_import):
+        h = hashlib.sha1()
+        for part in (str(CACHE_VERSION), fn, digest, str(bool(is_import))):
+            h.update(part)
+            h.update('\0')
+        return os.path.join(self.cache_dir, h.hexdigest() + '.parse')
+
+    def contains(self, fn, digest, is_import):
+        """True if parse nodes for fn are cached"""
+        return os.path.exists(self._path(fn, digest, is_import))
+
+    def load(self, fn, digest, is_import):
+        """Return the cached parse nodes for fn, or None"""
+        try:
+            with open(self._path(fn, digest, is_import), 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def store(self, fn, digest, is_import, nodes):
+        _atomic_pickle(self.cache_dir, self._path(fn, digest, is_import), nodes)
+
+class _CachingParseContext(ParseContext):
+    def __init__(self, import_handler, parse_cache):
+        ParseContext.__init__(self, True, import_handler)
+        self._parse_cache = parse_cache
+
+    def _parse_is_cached(self, fn, data, is_import):
+        return self._parse_cache.contains(fn, hashlib.sha1(data).hexdigest(), is_import)
+
+    def _parse_one(self, fn, is_import):
+        data = self._load_file(fn)
+        digest = self.files[-1][1]
+        nodes = self._parse_cache.load(fn, digest, is_import)
+        if nodes is None:
+            nodes = self._parse_data(fn, data, is_import)
+            self._parse_cache.store(fn, digest, is_import, nodes)
+        return nodes
+
+def _atomic_pickle(cache_dir, path, obj):
+    try:
+        os.makedirs(cache_dir)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+
+    # write to a temporary file and rename it into place so concurrent
+    # builds never observe a partial entry
+    fd, tmp_fn = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_fn, path)
+    except OSError:
+        # e.g. on Windows, where rename doesn't replace an entry another
+        # build stored first; entries are only a cache
+        os.remove(tmp_fn)
+    except:
+        os.remove(tmp_fn)
+        raise
+
+def compile_file(fn, import_dirs=None, import_handler=None, cache_dir=None, jobs=1, files=None):
+    """Parse fn with its imports and compile it, going through a cache when
+    cache_dir is given.
+
+    Returns (parse_tree, type_system). On a cache hit nothing is parsed; the
+    returned parse tree then only holds the generator configs, which is all
+    the code generators read from it. On a miss, files whose parse results
+    are cached from earlier runs, perhaps of other top-level files, are not
+    parsed again either. With jobs above one, imported files are parsed in
+    that many processes.
+
+    If files is a list, the name of every file that went into the result,
+    fn first, is appended to it."""
+    if import_handler is None:
+        import_dirs = import_dirs or ('.',)
+        import_handler = DefaultImportHandler(import_dirs)
+
+    cache, data = None, None
+    key_extra = '\0'.join(import_dirs or ())
+    if cache_dir is not None:
+        cache = SchemaCache(cache_dir)
+        data = import_handler.get_import_contents(fn)
+        entry = cache.load_entry(fn, data, import_handler, key_extra)
+        if entry is not None:
+            deps, schema = entry
+            if files is not None:
+                files.extend(dep_fn for dep_fn, digest in deps)
+            tsys = schema.thaw()
+            return list(tsys.itergenconfigs()), tsys
+
+    if cache is not None:
+        ctx = _CachingParseContext(import_handler, ParseCache(cache_dir))
+    else:
+        ctx = ParseContext(True, import_handler)
+    ctx.jobs = jobs
+    parse_tree = ctx.parse(fn)
+    tsys = compile_types(parse_tree)
+    if files is not None:
+        files.extend(dep_fn for dep_fn, digest in ctx.files)
+
+    if cache is not None:
+        cache.store(fn, data, ctx.files, tsys.freeze(), key_extra,
+                    sorted(ctx.resolved_imports.iteritems()))
+
+    return parse_tree, tsys
@@ -75,3 +75,66 @@ def generate_classes(typesys, global_dict):
             impl = EnumImpl(t)
             global_dict[t.name] = impl
 
+
+class LazyClasses(object):
+    """A mapping from type names to generated classes that creates each
+    class on first access, resolving the type system as it goes. Items are
+    also reachable as attributes, so the mapping can stand in for a module:
+
+        types = lazy_classes(tsys)
+        obj = types.foo(bar=1)"""
+
+    def __init__(self, typesys):
+        self.__dict__['_typesys'] = typesys
+        self.__dict__['_classes'] = {}
+
+    def _make(self, t):
+        # embedded structs need classes for their default values
+        classes = self._classes
+        work = [t]
+        while work:
+            t = work.pop()
+            if t.name in classes:
+                continue
+            cls = make_class(t, self._typesys)
+            t.set_class_object(cls)
+            classes[t.name] = cls
+            work.extend(self._typesys.value_dependencies(t))
+
+    def __getitem__(self, name):
+        obj = self._classes.get(name)
+        if obj is None:
+            t = self._typesys.lookup(name)
+            if isinstance(t, StructType):
+                self._make(t)
+            elif isinstance(t, EnumType):
+                self._classes[name] = EnumImpl(t)
+            else:
+                raise KeyError(name)
+            obj = self._classes[name]
+        return obj
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('generated classes are read-only')
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+def lazy_classes(typesys):
+    return LazyClasses(typesys)
@@ -0,0 +1,430 @@
+
+import os
+import gc
+import sys
+import signal
+import contextlib
+import argparse
+import multiprocessing
+
+from cStringIO import StringIO
+
+from Parser import ParseError
+from Typesys import TypeSystemException
+from Session import SchemaSession
+from Cache import compile_file
+from codegen import M68kGenerator, CGenerator, CSharpGenerator
+
+languages = {
+    'm68k': M68kGenerator,
+    'c' : CGenerator,
+    'csharp' : CSharpGenerator,
+}
+
+class BatchEntry(object):
+    """One input of a batch compile and the files generated from it"""
+    def __init__(self, input_fn, output_fn, aux_fn=None, depfile=None):
+        self.input_fn = input_fn
+        self.output_fn = output_fn
+        self.aux_fn = aux_fn
+        self.depfile = depfile
+
+def read_manifest(fn):
+    """Read a batch manifest.
+
+    Each line names an input file, its output file and optionally an
+    auxiliary output file, separated by whitespace. Blank lines and lines
+    starting with '#' are ignored."""
+    entries = []
+    with open(fn, 'r') as f:
+        for lineno, line in enumerate(f, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if len(fields) not in (2, 3):
+                raise ParseError(fn, lineno, 'expected <input> <output> [<aux output>]')
+            entries.append(BatchEntry(*fields))
+    return entries
+
+class BatchError(Exception):
+    """Raised when some inputs of a parallel batch compile, or some
+    languages generated in parallel, failed; messages holds their
+    diagnostics, in order"""
+    def __init__(self, messages):
+        Exception.__init__(self, ''.join(messages))
+        self.messages = messages
+
+def format_error(ex):
+    """Diagnostic text for a ParseError or TypeSystemException"""
+    if isinstance(ex, ParseError):
+        return '%s(%d): %s\n' % (ex.filename, ex.lineno, ex.msg)
+    return ex.message + '\n'
+
+def _same_contents(fn, text):
+    try:
+        if os.stat(fn).st_size != len(text):
+            return False
+        with open(fn, 'r') as f:
+            return f.read() == text
+    except (IOError, OSError):
+        return False
+
+def write_output(fn, text):
+    """Replace fn with text atomically, so that a concurrent build never
+    sees a partial file.
+
+    Files that already hold text are left alone, keeping their modification
+    time so that nothing which includes them is rebuilt. Returns whether fn
+    was written."""
+    if _same_contents(fn, text):
+        return False
+
+    tmp_fn = '%s.%d.tmp' % (fn, os.getpid())
+    try:
+        with open(tmp_fn, 'w') as f:
+            f.write(text)
+        if os.name == 'nt' and os.path.exists(fn):
+            # rename doesn't replace existing files on Windows
+            os.remove(fn)
+        os.rename(tmp_fn, fn)
+    except:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+        raise
+    return True
+
+def _make_escape(fn):
+    return fn.replace('$', '$$').replace('#', '\\#').replace(' ', '\\ ')
+
+def write_depfile(fn, targets, deps, phony=False):
+    """Write a Makefile-format dependency file saying that targets depend on
+    deps. With phony, every dependency also gets an empty rule of its own,
+    so that make doesn't fail when one of them is deleted."""
+    lines = ['%s: %s\n' % (' '.join(_make_escape(t) for t in targets),
+                           ' \\\n  '.join(_make_escape(d) for d in deps))]
+    if phony:
+        for dep in deps[1:]:
+            lines.append('\n%s:\n' % (_make_escape(dep)))
+    write_output(fn, ''.join(lines))
+
+def generate(gencls, parse_tree, type_system, input_fn, output_fn=None, aux_fn=None,
+             merge_imports=False, stdout=None):
+    """Run a code generator, writing to output_fn (or stdout) and aux_fn.
+
+    Output files are only written once generation succeeded, and only if
+    their contents changed."""
+    fh = StringIO() if output_fn is not None else stdout or sys.stdout
+    aux_fh = StringIO() if aux_fn is not None else None
+
+    gen = gencls(fh, input_fn, aux_fh, output_fn)
+    gen.generate_code(parse_tree, type_system, merge_imports=merge_imports)
+
+    if output_fn is not None:
+        write_output(output_fn, fh.getvalue())
+    if aux_fn is not None:
+        write_output(aux_fn, aux_fh.getvalue())
+
+# state for the worker function of a _fork_map; set before the worker pool
+# is forked so the workers inherit it without pickling
+_pool_state = None
+
+# Without fork (Windows), workers would start from a fresh interpreter with
+# no state, so _fork_map runs everything in this process instead.
+_can_fork = hasattr(os, 'fork')
+
+def _fork_map(func, items, state, jobs, chunksize=1):
+    global _pool_state
+    _pool_state = state
+    try:
+        if not _can_fork:
+            return map(func, items)
+        pool = multiprocessing.Pool(min(jobs, len(items)))
+        try:
+            results = pool.map(func, items, chunksize)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    finally:
+        _pool_state = None
+    return results
+
+def _compile_in_worker(entry):
+    session, gencls, merge_imports, phony_deps = _pool_state
+    try:
+        compile_batch([entry], gencls, merge_imports=merge_imports, session=session,
+                      phony_deps=phony_deps)
+    except (TypeSystemException, ParseError) as ex:
+        return format_error(ex)
+    return None
+
+# The first input is always compiled in this process (see below); forking
+# only pays off once at least two are left to share out.
+_MIN_PARALLEL_BATCH = 3
+
+def _compile_parallel(entries, gencls, merge_imports, session, jobs, phony_deps):
+    # the first input usually imports what most of the others do; compile
+    # it here so every worker starts with those files parsed and compiled
+    errors = []
+    try:
+        compile_batch(entries[:1], gencls, merge_imports=merge_imports, session=session,
+                      phony_deps=phony_deps)
+    except (TypeSystemException, ParseError) as ex:
+        errors.append(format_error(ex))
+
+    # hand out neighbouring inputs together, they tend to share imports
+    chunksize = max(1, (len(entries) - 1) // (jobs * 4))
+    errors += _fork_map(_compile_in_worker, entries[1:],
+                        (session, gencls, merge_imports, phony_deps), jobs, chunksize)
+
+    errors = [e for e in errors if e is not None]
+    if errors:
+        raise BatchError(errors)
+
+def compile_batch(entries, gencls, import_dirs=None, import_handler=None, merge_imports=False,
+                  session=None, jobs=1, phony_deps=False):
+    """Compile and generate code for every BatchEntry in turn.
+
+    All inputs go through one SchemaSession, so files imported by several
+    inputs are parsed once and the types they define are compiled once.
+    With jobs above one, the inputs after the first are spread over that
+    many forked worker processes, each continuing from the session; all of
+    them are compiled, and failures are raised together as a BatchError.
+    Where processes can't be forked they are compiled the same way in turn.
+    Entries with a depfile get one listing the files their input imports.
+    Returns the session."""
+    if session is None:
+        session = SchemaSession(import_dirs, import_handler)
+    if jobs > 1 and len(entries) >= _MIN_PARALLEL_BATCH:
+        _compile_parallel(entries, gencls, merge_imports, session, jobs, phony_deps)
+        return session
+    for entry in entries:
+        parse_tree, type_system = session.compile(entry.input_fn)
+        generate(gencls, parse_tree, type_system, entry.input_fn, entry.output_fn, entry.aux_fn,
+                 merge_imports)
+        if entry.depfile is not None:
+            targets = [fn for fn in (entry.output_fn, entry.aux_fn) if fn is not None]
+            write_depfile(entry.depfile, targets, session.files, phony_deps)
+    return session
+
+def _generate_in_worker(target):
+    parse_tree, type_system, input_fn, merge_imports = _pool_state
+    lang, output_fn, aux_fn = target
+    try:
+        generate(languages[lang], parse_tree, type_system, input_fn, output_fn, aux_fn,
+                 merge_imports)
+    except (TypeSystemException, ParseError) as ex:
+        return format_error(ex)
+    return None
+
+def generate_languages(targets, parse_tree, type_system, input_fn, merge_imports=False,
+                       stdout=None, jobs=1):
+    """Run the generator of every (language, output_fn, aux_fn) in targets
+    on one compiled schema.
+
+    With jobs above one the generators run in forked worker processes, each
+    with its own copy of the schema, or in turn where processes can't be
+    forked; all of them run, and failures are raised together as a
+    BatchError."""
+    if jobs > 1 and len(targets) > 1:
+        errors = _fork_map(_generate_in_worker, targets,
+                           (parse_tree, type_system, input_fn, merge_imports), jobs)
+        errors = [e for e in errors if e is not None]
+        if errors:
+            raise BatchError(errors)
+        return
+
+    for lang, output_fn, aux_fn in targets:
+        generate(languages[lang], parse_tree, type_system, input_fn, output_fn, aux_fn,
+                 merge_imports, stdout)
+
+class _FollowsLanguage(argparse.Action):
+    """Records an option's value together with the number of -l options
+    before it, so that outputs can be matched to their language"""
+    def __call__(self, parser, namespace, values, option_string=None):
+        items = list(getattr(namespace, self.dest) or ())
+        items.append((len(namespace.langs or ()), values))
+        setattr(namespace, self.dest, items)
+
+def make_arg_parser(parser_class=argparse.ArgumentParser):
+    parser = parser_class(description = 'Generate source code from blob definitions')
+
+    parser.add_argument('input_fn', metavar='<source file>', nargs='?',
+            help='Input source file')
+    parser.add_argument('-I', metavar='<path>', dest='import_paths', action='append',
+            help='Specify import search directories', default=['.'])
+    parser.add_argument('-m', '--merge-imports', dest='merge_imports', action='store_true',
+            help='Merge all imports together and produce stand-alone output suitable for distribution')
+    parser.add_argument('-o', metavar='<file>', dest='output_fns', action=_FollowsLanguage,
+            help='Output source file; with several -l, of the language it follows')
+    parser.add_argument('-a', metavar='<file>', dest='aux_fns', action=_FollowsLanguage,
+            help='Auxiliary output source file; with several -l, of the language it follows')
+    parser.add_argument('-b', '--batch', metavar='<file>', dest='batch', action='append', nargs='+',
+            help='Compile an input to the given output and optional auxiliary output; may be repeated')
+    parser.add_argument('--manifest', metavar='<file>', dest='manifest',
+            help='Compile every input listed in this file, one "<input> <output> [<aux output>]" per line')
+    parser.add_argument('-MD', dest='make_deps', action='store_true',
+            help='Write the files each input imports to a Makefile dependency file, <output>.d')
+    parser.add_argument('-MF', metavar='<file>', dest='depfile',
+            help='Name the dependency file; implies -MD')
+    parser.add_argument('-MP', dest='phony_deps', action='store_true',
+            help='Add an empty rule for each dependency, so that deleting an import does not break make')
+    parser.add_argument('--cache-dir', metavar='<dir>', dest='cache_dir',
+            help='Cache compiled schemas of a single input in this directory (default: $BLOBC_CACHE_DIR)')
+    parser.add_argument('-j', '--jobs', metavar='<n>', dest='jobs', type=int, default=1,
+            help='Compile batch inputs, or generate several languages, in this many processes')
+    parser.add_argument('--parse-jobs', metavar='<n>', dest='parse_jobs', type=int,
+            help='Parse the files a single input imports in this many processes')
+    parser.add_argument('--serve', metavar='<socket>', dest='serve',
+            help='Run a compile server listening on this Unix socket')
+    parser.add_argument('-l', metavar='<language>', dest='langs', action='append',
+            help='Specify language to generate code for (%s); may be repeated' % (
+                ', '.join(sorted(languages))))
+    return parser
+
+def _language_targets(parser, args):
+    langs = args.langs or []
+    if not langs:
+        parser.error('no language given (-l)')
+    for lang in langs:
+        if lang not in languages:
+            parser.error('-l %s: expected one of %s' % (lang, ', '.join(sorted(languages))))
+    if len(set(langs)) != len(langs):
+        parser.error('-l: each language can only be given once')
+
+    targets = [[lang, None, None] for lang in langs]
+    for dest, option, slot in (('output_fns', '-o', 1), ('aux_fns', '-a', 2)):
+        for index, fn in getattr(args, dest) or ():
+            # with a single language, outputs can be given anywhere
+            if len(langs) == 1:
+                index = 1
+            if index == 0:
+                parser.error('%s %s: with several languages, give %s after the -l it belongs to' %
+                             (option, fn, option))
+            if targets[index - 1][slot] is not None:
+                parser.error('%s given twice for -l %s' % (option, langs[index - 1]))
+            targets[index - 1][slot] = fn
+
+    if len(targets) > 1:
+        for lang, output_fn, aux_fn in targets:
+            if output_fn is None:
+                parser.error('-l %s: with several languages, each needs its own -o' % (lang))
+    return [tuple(t) for t in targets]
+
+def _single_input_options(parser, args, context):
+    # batches and compile servers keep parse results in a SchemaSession,
+    # which neither caches on disk nor parses in worker processes
+    for option, value in (('--cache-dir', args.cache_dir), ('--parse-jobs', args.parse_jobs)):
+        if value is not None:
+            parser.error('%s cannot be combined with %s' % (option, context))
+
+def _check_args(parser, args, session_factory=None):
+    args.targets = _language_targets(parser, args)
+    args.lang, args.output_fn, args.aux_fn = args.targets[0]
+
+    if session_factory is not None:
+        _single_input_options(parser, args, 'a compile server')
+
+    if args.batch is not None or args.manifest is not None:
+        if args.input_fn is not None or args.output_fn is not None or args.aux_fn is not None:
+            parser.error('a source file, -o and -a cannot be combined with --batch or --manifest')
+        _single_input_options(parser, args, '--batch or --manifest')
+        for fields in args.batch or ():
+            if len(fields) > 3:
+                parser.error('--batch takes an input, an output and an optional auxiliary output')
+            if len(fields) < 2:
+                parser.error('--batch %s: no output file given' % (fields[0]))
+        if len(args.targets) > 1:
+            parser.error('--batch and --manifest take a single language')
+        if args.depfile is not None:
+            parser.error('-MF cannot be combined with --batch or --manifest; -MD names depfiles after outputs')
+    elif args.input_fn is None:
+        parser.error('no source file given')
+    elif (args.make_deps or args.depfile is not None) and args.output_fn is None:
+        parser.error('-MD and -MF need an output file (-o)')
+
+def run(args, stdout=None, session_factory=None):
+    """Carry out a checked blobc.py command line.
+
+    With a session_factory, inputs are compiled through the SchemaSession it
+    returns for the import directories instead of from scratch."""
+    session = session_factory(args.import_paths) if session_factory is not None else None
+
+    if args.batch is not None or args.manifest is not None:
+        entries = [BatchEntry(*fields) for fields in args.batch or ()]
+        if args.manifest is not None:
+            entries.extend(read_manifest(args.manifest))
+        if args.make_deps:
+            for entry in entries:
+                entry.depfile = entry.output_fn + '.d'
+        compile_batch(entries, languages[args.lang], import_dirs=args.import_paths,
+                      merge_imports=args.merge_imports, session=session, jobs=args.jobs,
+                      phony_deps=args.phony_deps)
+    else:
+        if session is not None:
+            parse_tree, type_system = session.compile(args.input_fn)
+            files = session.files
+        else:
+            files = []
+            cache_dir = args.cache_dir or os.environ.get('BLOBC_CACHE_DIR')
+            parse_tree, type_system = compile_file(args.input_fn, import_dirs=args.import_paths,
+                                                   cache_dir=cache_dir, jobs=args.parse_jobs or 1,
+                                                   files=files)
+        generate_languages(args.targets, parse_tree, type_system, args.input_fn, args.merge_imports,
+                           stdout, args.jobs)
+        if args.make_deps or args.depfile is not None:
+            targets = [fn for lang, output_fn, aux_fn in args.targets
+                       for fn in (output_fn, aux_fn) if fn is not None]
+            write_depfile(args.depfile or args.output_fn + '.d', targets, files, args.phony_deps)
+
+@contextlib.contextmanager
+def paused_gc():
+    """Suspend the cyclic garbage collector for the duration of a with block.
+
+    Parsing and compiling allocate lots of long-lived objects and hardly any
+    garbage, so collection passes over the growing heap are pure overhead on
+    big schemas. This is process-wide, so it's for the command line, not for
+    library code that may run alongside other threads."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def main(argv, stdout=None, stderr=None, parser_class=argparse.ArgumentParser, session_factory=None):
+    """Run blobc.py with the given arguments, returning its exit status"""
+    stderr = stderr or sys.stderr
+    parser = make_arg_parser(parser_class)
+    args = parser.parse_args(argv)
+
+    if args.serve is not None:
+        if session_factory is not None:
+            parser.error('--serve: already running in a compile server')
+        from Server import CompileServer
+        server = CompileServer(args.serve)
+        # clean up the socket on kill, too
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
+
+    _check_args(parser, args, session_factory)
+
+    try:
+        with paused_gc():
+            run(args, stdout, session_factory)
+    except (TypeSystemException, ParseError) as ex:
+        stderr.write(format_error(ex))
+        return 1
+    except BatchError as ex:
+        stderr.write(''.join(ex.messages))
+        return 1
+    return 0
@@ -52,7 +52,7 @@ class Serializer(object):
 
     def _find_type(self, v):
         if isinstance(v, Array):
-            return v.item_type.array_type(len(v.items), None)
+            return v.item_type.array_type(len(v), None)
         elif isinstance(v, StructBase):
             return type(v).srctype
         else:
@@ -1,8 +1,46 @@
 import blobc
 
-class OptionContainer(object):
+# All parse-tree nodes use __slots__; generated schemas can have millions
+# of them.
+
+_slot_names = {}
+
+def _node_slots(cls):
+    names = _slot_names.get(cls)
+    if names is None:
+        names = _slot_names[cls] = tuple(name for c in reversed(cls.__mro__)
+                                         for name in c.__dict__.get('__slots__', ()))
+    return names
+
+def _rebuild_node(cls, state):
+    node = cls.__new__(cls)
+    for name, value in zip(_node_slots(cls), state):
+        setattr(node, name, value)
+    return node
+
+class ParseNode(object):
+    """Base of all parse-tree classes.
+
+    Slotted objects pickle through copy_reg's generic protocol, which looks
+    up the slot names of every object's class again. Trees are pickled to
+    the parse cache and back from parse workers, so nodes pickle as a flat
+    state tuple instead."""
+    __slots__ = ()
+
+    def __reduce__(self):
+        cls = type(self)
+        return (_rebuild_node, (cls, tuple([getattr(self, name) for name in _node_slots(cls)])))
+
+class OptionContainer(ParseNode):
+    __slots__ = ('_options',)
+
     def __init__(self, options):
-        self._options = options
+        # share one empty tuple between all nodes without options
+        self._options = options or ()
+
+    @property
+    def options(self):
+        return self._options
 
     def has_option(self, tag):
         if self._options:
@@ -18,6 +56,8 @@ class OptionContainer(object):
             return []
 
 class RawDefPrimitive(OptionContainer):
+    __slots__ = ('name', 'pclass', 'size', 'location')
+
     def __init__(self, name, pclass, size, options, loc):
         OptionContainer.__init__(self, options)
         self.name = name
@@ -25,11 +65,15 @@ class RawDefPrimitive(OptionContainer):
         self.size = size
         self.location = loc
 
-class RawOptionParam(object):
+class RawOptionParam(ParseNode):
+    __slots__ = ('name', 'value', 'loc')
+
     def __init__(self, name, value, loc):
         self.name, self.value, self.loc = name, value, loc
 
-class RawNamedOption(object):
+class RawNamedOption(ParseNode):
+    __slots__ = ('name', 'location', 'params', 'pos_params', 'kw_params')
+
     def __init__(self, name, params, loc):
         self.name, self.location = name, loc
         self.params = params
@@ -37,7 +81,7 @@ class RawNamedOption(object):
         self.kw_params = dict((p.name, p.value) for p in params if p.name is not None)
 
     def has_kw_param(self, name):
-        return self.kw_params.has_key(name)
+        return name in self.kw_params
 
     def kw_param(self, name, default=None):
         if default is not None:
@@ -45,76 +89,117 @@ class RawNamedOption(object):
         else:
             return self.kw_params[name]
 
-class RawEnumType(object):
+class RawEnumType(ParseNode):
+    __slots__ = ('name', 'members', 'location')
+
     def __init__(self, name, members, loc):
         self.name, self.members, self.location = name, members, loc
 
-class RawEnumMember(object):
+class RawEnumMember(ParseNode):
+    __slots__ = ('name', 'expr', 'location')
+
     def __init__(self, name, expr, loc):
         self.name, self.expr, self.location = name, expr, loc
 
 class RawStructType(OptionContainer):
+    __slots__ = ('name', 'members', 'location')
+
     def __init__(self, name, members, options, loc):
         OptionContainer.__init__(self, options)
         self.name = name
         self.members = members
         self.location = loc
 
-class RawType(object):
+class RawType(ParseNode):
+    __slots__ = ('location',)
+
     def __init__(self, loc):
         self.location = loc
 
 class RawSimpleType(RawType):
+    __slots__ = ('name',)
+
     def __init__(self, name, loc):
         RawType.__init__(self, loc)
         self.name = name
 
 class RawPointerType(RawType):
+    __slots__ = ('is_cstring', 'basetype')
+
     def __init__(self, basetype, loc, is_cstring=False):
         RawType.__init__(self, loc)
         self.is_cstring = is_cstring
         self.basetype = basetype
 
 class RawArrayType(RawType):
+    __slots__ = ('basetype', 'dims')
+
     def __init__(self, basetype, dims, loc):
         RawType.__init__(self, loc)
         self.basetype = basetype
         self.dims = dims
 
 class RawStructMember(OptionContainer):
+    __slots__ = ('type', 'name', 'location')
+
     def __init__(self, type, name, options, loc):
         OptionContainer.__init__(self, options)
         self.type = type
         self.name = name
         self.location = loc
 
-class RawImportStmt(object):
+class RawImportStmt(ParseNode):
+    __slots__ = ('filename', 'location')
+
     def __init__(self, filename, loc):
         self.filename = filename
         self.location = loc
 
 class RawVoidType(RawType):
-    pass
+    __slots__ = ()
+
+    def __reduce__(self):
+        # unpickle to the shared instance
+        return (_void_type, ())
+
+def _void_type():
+    return RawVoidType.instance
+
+class RawConstant(ParseNode):
+    __slots__ = ('name', 'expr', 'location')
 
-class RawConstant(object):
     def __init__(self, name, expr, loc):
         self.name, self.expr, self.location = name, expr, loc
 
 RawVoidType.instance = RawVoidType(None)
 
-class SourceLocation(object):
+class SourceLocation(ParseNode):
+    """A file and line. The parser creates one per line of input, shared by
+    every node on that line."""
+    __slots__ = ('filename', 'lineno', 'is_import')
+
     def __init__(self, filename, lineno, is_import):
         self.filename, self.lineno, self.is_import = filename, lineno, is_import
 
-class GeneratorConfig(object):
+class GeneratorConfig(ParseNode):
+    __slots__ = ('generator_name', 'options', 'location')
+
     def __init__(self, generator_name, options, loc):
         self.generator_name, self.options, self.location = generator_name, options, loc
 
-class RawExpr(object):
+class RawExpr(ParseNode):
+    __slots__ = ('location',)
+
     def __init__(self, loc):
         self.location = loc
 
+    def collect_names(self, out):
+        """Append (name, location) for every named constant referenced"""
+        pass
+
 class RawIntLiteralExpr(RawExpr):
+    __slots__ = ('value',)
+
     def __init__(self, loc, value):
         RawExpr.__init__(self, loc)
         self.value = value
@@ -123,6 +208,8 @@ class RawIntLiteralExpr(RawExpr):
         return self.value
 
 class RawNamedConstantExpr(RawExpr):
+    __slots__ = ('name',)
+
     def __init__(self, loc, name):
         RawExpr.__init__(self, loc)
         self.name = name
@@ -130,7 +217,12 @@ class RawNamedConstantExpr(RawExpr):
     def eval(self, env):
         return env.lookup_value(self.location, self.name)
 
+    def collect_names(self, out):
+        out.append((self.name, self.location))
+
 class RawNegateExpr(RawExpr):
+    __slots__ = ('expr',)
+
     def __init__(self, loc, expr):
         RawExpr.__init__(self, loc)
         self.expr = expr
@@ -138,7 +230,12 @@ class RawNegateExpr(RawExpr):
     def eval(self, env):
         return -self.expr.eval(env)
 
+    def collect_names(self, out):
+        self.expr.collect_names(out)
+
 class RawBinOpExpr(RawExpr):
+    __slots__ = ('lhs', 'rhs')
+
     def __init__(self, loc, l, r):
         RawExpr.__init__(self, loc)
         self.lhs, self.rhs = l, r
@@ -149,12 +246,18 @@ class RawBinOpExpr(RawExpr):
     def eval_r(self, env):
         return self.rhs.eval(env)
 
+    def collect_names(self, out):
+        self.lhs.collect_names(out)
+        self.rhs.collect_names(out)
+
 class RawMulExpr(RawBinOpExpr):
+    __slots__ = ()
     TOKEN = '*'
     def eval(self, env):
         return self.eval_l(env) * self.eval_r(env)
 
 class RawDivExpr(RawBinOpExpr):
+    __slots__ = ()
     TOKEN = '/'
     def eval(self, env):
         l = self.eval_l(env)
@@ -164,21 +267,25 @@ class RawDivExpr(RawBinOpExpr):
         return l / r
 
 class RawAddExpr(RawBinOpExpr):
+    __slots__ = ()
     TOKEN = '+'
     def eval(self, env):
         return self.eval_l(env) + self.eval_r(env)
 
 class RawSubExpr(RawBinOpExpr):
+    __slots__ = ()
     TOKEN = '-'
     def eval(self, env):
         return self.eval_l(env) - self.eval_r(env)
 
 class RawShiftLeftExpr(RawBinOpExpr):
+    __slots__ = ()
     TOKEN = '<<'
     def eval(self, env):
         return self.eval_l(env) << self.eval_r(env)
 
 class RawShiftRightExpr(RawBinOpExpr):
+    __slots__ = ()
     TOKEN = '>>'
     def eval(self, env):
         return self.eval_l(env) >> self.eval_r(env)
@@ -1,21 +1,32 @@
 #! /usr/bin/env python
 
 import re
+import gc
+import array
+import bisect
 import os.path
+import hashlib
+import collections
+import multiprocessing
 from ParseTree import *
 
+# Whitespace and comments are skipped inside the same match as the token
+# that follows them, and the token kind is read off m.lastindex.
 SCANNER = re.compile(r'''
-  (\s+)                             | # whitespace
-  (//)[^\n]*                        | # comments
-  0[xX]([0-9A-Fa-f]+)               | # hexadecimal integer literals
-  (\d+)                             | # integer literals
-  (<<|>>)                           | # multi-char punctuation
-  ([][(){}<>=,;:*+-/])              | # punctuation
-  ([A-Za-z_][A-Za-z0-9_]*)          | # identifiers
-  """(.*?)"""                       | # multi-line string literal
-  "((?:[^"\n\\]|\\.)*)"             | # regular string literal
-  (.)                                 # an error!
-  ''', re.DOTALL | re.VERBOSE);
+  (?:\s+|//[^\n]*)*                 # whitespace and comments
+  (?:
+    0[xX]([0-9A-Fa-f]+)             | # 1: hexadecimal integer literals
+    (\d+)                           | # 2: integer literals
+    (<<|>>)                         | # 3: multi-char punctuation
+    ([][(){}<>=,;:*+-/])            | # 4: punctuation
+    ([A-Za-z_][A-Za-z0-9_]*)        | # 5: identifiers
+    """(.*?)"""                     | # 6: multi-line string literal
+    "((?:[^"\n\\]|\\.)*)"           | # 7: regular string literal
+    (\Z)                            | # 8: end of input
+    (.)                               # 9: an error!
+  )''', re.DOTALL | re.VERBOSE);
+
+_NEWLINE = re.compile(r'\n')
 
 TOK_EOF = -1
 TOK_WORD = 1
@@ -23,6 +34,10 @@ TOK_INT = 2
 TOK_PUNCT = 3
 TOK_STRING = 4
 
+# token type by SCANNER group index
+_GROUP_TOKENS = (None, TOK_INT, TOK_INT, TOK_PUNCT, TOK_PUNCT, TOK_WORD,
+                 TOK_STRING, TOK_STRING, TOK_EOF, None)
+
 class ParseError(Exception):
     def __init__(self, filename, lineno, msg):
         self.filename = filename
@@ -33,66 +48,64 @@ class ParseError(Exception):
         return '%s(%d): %s' % (self.filename, self.lineno, self.msg)
 
 class Tokenizer(object):
+    """Hands out tokens to the parser, always holding the next one in t, v.
+
+    Line numbers are worked out only when asked for, from a table of newline
+    offsets built on first use; lineno is the line of the lookahead token."""
+
     def __init__(self, filename, data, is_import):
         object.__init__(self)
         self.filename = filename
-        self.lineno = 1
         self.is_import = is_import 
-        self.pos = 1
         self.data = data
-        self.titer = re.finditer(SCANNER, self.data)
-        self.cache = None
+        self._newlines = None
+        self._line, self._line_begin, self._line_end = 1, 0, 0
         self._loc = None
+        self._loc_start = -1
+        self._match = SCANNER.match
+        self._end = 0 # offset scanning continues from
+        self.advance()
+
+    def advance(self):
+        """Move on to the next token"""
+        m = self._match(self.data, self._end)
+        i = m.lastindex
+        self._start = m.start(i)
+        self._end = m.end()
+        v = m.group(i)
+        if i == 5:
+            # type and member names repeat a lot; share the strings
+            v = intern(v)
+        elif i <= 2:
+            v = int(v, 16 if i == 1 else 10)
+        elif i >= 8:
+            if i == 9:
+                raise ParseError(self.filename, self.lineno, 'bad token char: "%s"' % (v))
+            v = None
+        self.t, self.v = _GROUP_TOKENS[i], v
 
     def next(self):
-        self._loc = None
-
-        if self.cache is not None:
-            r = self.cache
-            self.cache = None
-            return r
-
-        while True:
-            m = None
-            try:
-                m = self.titer.next()
-            except StopIteration:
-                return TOK_EOF, None
-
-            space, comment, hexint, integer, mpunct, \
-            punct, word, mstringlit, stringlit, badchar \
-                = m.groups()
-
-            if space is not None:
-                self.lineno += space.count('\n')
-                continue
-
-            if word is not None:
-                return TOK_WORD, word
-
-            if integer is not None:
-                return TOK_INT, int(integer)
-
-            if hexint is not None:
-                return TOK_INT, int(hexint, 16)
-
-            if comment is not None:
-                continue
-
-            if mpunct is not None:
-                return TOK_PUNCT, mpunct
-
-            if punct is not None:
-                return TOK_PUNCT, punct
-
-            if stringlit is not None:
-                return TOK_STRING, stringlit
-
-            if mstringlit is not None:
-                self.lineno += mstringlit.count('\n')
-                return TOK_STRING, mstringlit
+        r = self.t, self.v
+        self.advance()
+        return r
 
-            raise ParseError(self.filename, self.lineno, 'bad token char: "%s"' % (badchar))
+    def peek(self):
+        return self.t, self.v
+
+    @property
+    def lineno(self):
+        start = self._start
+        if self._line_begin <= start < self._line_end:
+            return self._line
+        newlines = self._newlines
+        if newlines is None:
+            newlines = self._newlines = array.array('L', (m.start() for m in _NEWLINE.finditer(self.data)))
+        # remember the extent of the line, most lookups hit the same one
+        index = bisect.bisect_right(newlines, start)
+        self._line_begin = newlines[index - 1] if index > 0 else 0
+        self._line_end = newlines[index] if index < len(newlines) else len(self.data) + 1
+        self._line = index + 1
+        return self._line
 
     def describe_here(self):
         t, v = self.peek()
@@ -121,14 +134,13 @@ class Tokenizer(object):
             assert v is not None
             return "'%s'" % (v)
 
-    def peek(self):
-        if self.cache is None:
-            self.cache = self.next()
-        return self.cache
-
     def loc(self):
-        if self._loc is None:
-            self._loc = SourceLocation(self.filename, self.lineno, self.is_import)
+        # tokens on the same line share their location object
+        if self._start != self._loc_start:
+            lineno = self.lineno
+            if self._loc is None or self._loc.lineno != lineno:
+                self._loc = SourceLocation(self.filename, lineno, self.is_import)
+            self._loc_start = self._start
         return self._loc
 
 class Parser(object):
@@ -142,36 +154,46 @@ class Parser(object):
         raise ParseError(self.tokenizer.filename, self.tokenizer.lineno, msg)
 
     def accept(self, tt, tv=None):
-        return self.accept_v(tt, tv)[0]
+        tok = self.tokenizer
+        if tok.t == tt and (tv is None or tv == tok.v):
+            tok.advance()
+            return True
+        return False
 
     def accept_v(self, tt, tv=None):
-        t, v = self.tokenizer.peek()
-        if t == tt and (tv is None or tv == v):
-            self.tokenizer.next()
+        tok = self.tokenizer
+        v = tok.v
+        if tok.t == tt and (tv is None or tv == v):
+            tok.advance()
             return True, v
         else:
             return False, None
 
     def expect(self, tt, tv=None):
-        t, v = self.tokenizer.next()
+        # errors are reported before consuming, at the offending token
+        tok = self.tokenizer
+        t, v = tok.t, tok.v
         if t != tt:
             self.error('expected %s but got %s' %
-                    (self.tokenizer.describe(tt, tv), self.tokenizer.describe(t, v)))
+                    (tok.describe(tt, tv), tok.describe(t, v)))
+        tok.advance()
         return v
 
     def expect_any(self, *tts):
-        t, v = self.tokenizer.next()
+        tok = self.tokenizer
+        t, v = tok.t, tok.v
         if t not in tts:
             self.error('expected %s but got %s' %
-                    (', '.join([self.tokenizer.describe(x, None) for x in tts]),
-                     self.tokenizer.describe(t, v)))
+                    (', '.join([tok.describe(x, None) for x in tts]),
+                     tok.describe(t, v)))
+        tok.advance()
         return t, v
 
     def repeat(self, rule, end_tok, end_val=None):
         result = []
+        tok = self.tokenizer
         while True:
-            t, v = self.tokenizer.peek()
-            if t == end_tok and (end_val is None or end_val == v):
+            if tok.t == end_tok and (end_val is None or end_val == tok.v):
                 return result
             result.append(self.require(rule))
         return result
@@ -221,8 +243,9 @@ class Parser(object):
         else:
             t = RawSimpleType(name, loc)
 
-        while True:
-            loc = self.tokenizer.loc()
+        tok = self.tokenizer
+        while tok.t == TOK_PUNCT:
+            loc = tok.loc()
             if self.accept(TOK_PUNCT, '*'):
                 t = RawPointerType(t, loc)
             elif self.accept(TOK_PUNCT, '['):
@@ -272,7 +295,7 @@ class Parser(object):
             return None
         
     def r_named_option(self):
-        if self.tokenizer.peek()[0] != TOK_WORD:
+        if self.tokenizer.t != TOK_WORD:
             return None
 
         loc = self.tokenizer.loc()
@@ -337,7 +360,7 @@ class Parser(object):
         return RawDefPrimitive(name, pclass, size, options, loc)
 
     def r_enum_member(self):
-        if self.tokenizer.peek()[0] != TOK_WORD:
+        if self.tokenizer.t != TOK_WORD:
             return None
 
         loc = self.tokenizer.loc()
@@ -472,43 +495,217 @@ class Parser(object):
         return self.repeat(self.r_toplevel, TOK_EOF)
 
 class DefaultImportHandler:
+    """Finds imports in a list of directories on disk.
+
+    Each directory is listed once and the listing kept, so resolving an
+    import costs set lookups instead of a stat call per directory. Names
+    that only match a listed file in a different case are checked on disk,
+    so they resolve on case-insensitive file systems as before. Call
+    invalidate() when files may have been added or removed since."""
+
     def __init__(self, dirs):
         self._dirs = dirs
+        self.invalidate()
+
+    def invalidate(self):
+        self._listings = {}
+        self._realdirs = {}
+        self._found = {}
 
     def get_import_contents(self, fn):
         with open(fn, 'r') as f:
             return f.read()
 
+    def _listing(self, d):
+        """(names, lowercased names) of the files in d"""
+        listing = self._listings.get(d)
+        if listing is None:
+            try:
+                names = frozenset(os.listdir(d or '.'))
+            except OSError:
+                names = frozenset()
+            listing = self._listings[d] = (names, frozenset(n.lower() for n in names))
+        return listing
+
     def find_imported_file(self, fn):
+        try:
+            return self._found[fn]
+        except KeyError:
+            pass
+
+        result = None
         for d in self._dirs:
             fpath = os.path.normpath(os.path.join(d, fn))
-            if os.path.exists(fpath):
-                return fpath
-        return None
+            dirname, basename = os.path.split(fpath)
+            names, folded = self._listing(dirname)
+            if basename in names or (basename.lower() in folded and os.path.exists(fpath)):
+                result = fpath
+                break
+        self._found[fn] = result
+        return result
+
+    def file_identity(self, fn):
+        """Return a key that is the same for all paths naming the same file"""
+        dirname, basename = os.path.split(os.path.abspath(fn))
+        realdir = self._realdirs.get(dirname)
+        if realdir is None:
+            realdir = self._realdirs[dirname] = os.path.realpath(dirname)
+        path = os.path.join(realdir, basename)
+        if os.path.islink(path):
+            path = os.path.realpath(path)
+        return path
+
+class ImportGraph(object):
+    """The files each parsed file imports, by resolved file name.
+
+    A ParseContext records into the graph it is given, so a graph shared
+    between parses, such as the compiles of a batch or a session, answers
+    dependency questions without parsing or resolving anything again."""
+
+    def __init__(self):
+        self._imports = {}
+
+    def set_imports(self, fn, imported):
+        self._imports[fn] = list(imported)
 
+    def imports(self, fn):
+        """Files imported directly by fn, or None if fn was never parsed"""
+        return self._imports.get(fn)
+
+    def closure(self, fn):
+        """fn and every file it imports, directly or not, in first-seen order"""
+        result = []
+        seen = set()
+        work = [fn]
+        while work:
+            f = work.pop()
+            if f not in seen:
+                seen.add(f)
+                result.append(f)
+                work.extend(reversed(self._imports.get(f) or ()))
+        return result
+
+# Finds import statements without parsing. Only used to schedule parallel
+# parsing; what the parser finds decides in the end.
+_IMPORT_SCAN = re.compile(r'^[ \t]*import[ \t]+"([^"\n]*)"', re.MULTILINE)
+
+def _parse_worker(args):
+    fn, data, is_import = args
+    gc.disable()
+    try:
+        return Parser(Tokenizer(fn, data, is_import)).r_unit(), None
+    except ParseError as ex:
+        # ParseError doesn't survive pickling; pass on its fields
+        return None, (ex.filename, ex.lineno, ex.msg)
 
 class ParseContext(object):
-    def __init__(self, handle_imports, import_handler):
+    def __init__(self, handle_imports, import_handler, import_graph=None):
         assert import_handler
         self._import_dirs=('.')
         self._import_memo={}
         self._import_handler = import_handler
         self._handle_imports = handle_imports
+        self.import_graph = import_graph if import_graph is not None else ImportGraph()
+        self.files = [] # (filename, content sha1) of every file loaded
+        self.resolved_imports = {} # import name as written -> file found
+        self.jobs = 1 # processes to parse imported files in
+        self._prefetched = None
+
+    def _file_identity(self, fn):
+        # files reached through different import dirs are only parsed once
+        identity = getattr(self._import_handler, 'file_identity', None)
+        return identity(fn) if identity is not None else fn
 
     def _load_file(self, fn):
-        self._import_memo[fn] = True
-        return self._import_handler.get_import_contents(fn)
+        self._import_memo[self._file_identity(fn)] = True
+        entry = self._prefetched.get(fn) if self._prefetched else None
+        if entry is not None:
+            data = entry[0]
+        else:
+            data = self._import_handler.get_import_contents(fn)
+        self.files.append((fn, hashlib.sha1(data).hexdigest()))
+        return data
+
+    def _parse_one(self, fn, is_import):
+        """Parse a single file, leaving its import statements in place"""
+        return self._parse_data(fn, self._load_file(fn), is_import)
+
+    def _parse_is_cached(self, fn, data, is_import):
+        """True if _parse_one() gets fn's parse result without parsing; such
+        files aren't handed to the process pool"""
+        return False
+
+    def _parse_data(self, fn, data, is_import):
+        entry = self._prefetched.pop(fn, None) if self._prefetched else None
+        if entry is not None and entry[0] is data and entry[1] == is_import and \
+                (entry[2] is not None or entry[3] is not None):
+            nodes, error = entry[2], entry[3]
+            if error is not None:
+                raise ParseError(*error)
+            return nodes
 
-    def parse(self, fn, is_import=False):
-        data = self._load_file(fn)
         tokenizer = Tokenizer(fn, data, is_import)
         parser = Parser(tokenizer)
-        result = parser.r_unit()
+        return parser.r_unit()
+
+    def _prefetch(self, fn):
+        """Find the files fn imports by scanning for import statements and
+        parse those without a cached parse result in a process pool. parse()
+        then picks the results up in its usual order instead of parsing
+        serially."""
+        handler = self._import_handler
+        order, contents, seen = [], {}, set()
+        work = collections.deque([(fn, False)])
+        while work:
+            f, is_import = work.popleft()
+            identity = self._file_identity(f)
+            if identity in seen:
+                continue
+            seen.add(identity)
+            try:
+                data = handler.get_import_contents(f)
+            except (IOError, OSError):
+                continue # the serial pass reports it
+            order.append((f, is_import))
+            contents[f] = data
+            for name in _IMPORT_SCAN.findall(data):
+                imported = handler.find_imported_file(name)
+                if imported:
+                    work.append((imported, True))
+
+        # entries without nodes or error only save reading the file again
+        self._prefetched = dict((f, (contents[f], is_import, None, None)) for f, is_import in order)
+        order = [(f, is_import) for f, is_import in order
+                 if not self._parse_is_cached(f, contents[f], is_import)]
+        if len(order) < 2:
+            return
+
+        pool = multiprocessing.Pool(min(self.jobs, len(order)))
+        try:
+            results = pool.map(_parse_worker,
+                               [(f, contents[f], is_import) for f, is_import in order],
+                               chunksize=1)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        for (f, is_import), (nodes, error) in zip(order, results):
+            self._prefetched[f] = (contents[f], is_import, nodes, error)
+
+    def parse(self, fn, is_import=False):
+        if self.jobs > 1 and self._handle_imports and self._prefetched is None:
+            self._prefetch(fn)
+
+        result = self._parse_one(fn, is_import)
 
         if not self._handle_imports:
             return result
 
         iresult = []
+        imported = []
         for r in result:
             if isinstance(r, RawImportStmt):
                 imported_fn = self._import_handler.find_imported_file(r.filename)
@@ -518,11 +715,13 @@ class ParseContext(object):
                             r.location.lineno,
                             "couldn't find '%s' in any of [%s]" %
                                 (r.filename, ', '.join(self._import_dirs)))
-                if not self._import_memo.has_key(imported_fn):
-                    # todo: should make an effort of using real absolute names here
+                imported.append(imported_fn)
+                self.resolved_imports[r.filename] = imported_fn
+                if self._file_identity(imported_fn) not in self._import_memo:
                     iresult.extend(self.parse(imported_fn, is_import=True))
             else:
                 iresult.append(r)
+        self.import_graph.set_imports(fn, imported)
         return iresult
 
 class StringImportHandler:
@@ -542,10 +741,11 @@ def parse_string(string):
     ctx = ParseContext(False, import_handler)
     return ctx.parse('<string>')
 
-def parse_file(fn, handle_imports=True, import_handler=None, import_dirs=None):
+def parse_file(fn, handle_imports=True, import_handler=None, import_dirs=None, jobs=1):
     if import_handler is None:
         import_handler = DefaultImportHandler(import_dirs or ('.',))
     ctx = ParseContext(handle_imports, import_handler)
+    ctx.jobs = jobs
     return ctx.parse(fn)
 
 if __name__ == '__main__':
@@ -0,0 +1,182 @@
+
+from Typesys import *
+
+_pclass_names = (
+    (UnsignedIntType, 'uint'),
+    (SignedIntType, 'sint'),
+    (FloatingType, 'float'),
+    (CharacterType, 'character'),
+)
+
+class FrozenSchema(object):
+    """An immutable, compact snapshot of a compiled TypeSystem.
+
+    Everything is stored as nested tuples of strings and integers, with
+    source locations shared through a single table, so a schema pickles
+    quickly and can be shipped to other processes. thaw() rebuilds an
+    equivalent TypeSystem without parsing or compiling anything; classes and
+    target layouts are then created from it as usual."""
+
+    __slots__ = ('locations', 'types', 'constants', 'configs')
+
+    def __init__(self, locations, types, constants, configs):
+        object.__setattr__(self, 'locations', locations)
+        object.__setattr__(self, 'types', types)
+        object.__setattr__(self, 'constants', constants)
+        object.__setattr__(self, 'configs', configs)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('FrozenSchema is immutable')
+
+    def __reduce__(self):
+        return (FrozenSchema, (self.locations, self.types, self.constants, self.configs))
+
+    def __eq__(self, other):
+        return isinstance(other, FrozenSchema) and self.__reduce__() == other.__reduce__()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.__reduce__()[1])
+
+    def thaw(self):
+        return _Thawer(self).run()
+
+class _Freezer(object):
+    def __init__(self):
+        self._locations = []
+        self._location_index = {}
+
+    def loc(self, loc):
+        if loc is None:
+            return -1
+        key = (loc.filename, loc.lineno, loc.is_import)
+        index = self._location_index.get(key)
+        if index is None:
+            index = self._location_index[key] = len(self._locations)
+            self._locations.append(key)
+        return index
+
+    def typeref(self, t):
+        if isinstance(t, CStringType):
+            return ('s', self.typeref(t.base_type))
+        elif isinstance(t, PointerType):
+            return ('*', self.typeref(t.base_type))
+        elif isinstance(t, ArrayType):
+            return ('[', self.typeref(t.base_type), t.dim)
+        elif t is VoidType.instance:
+            return None
+        else:
+            return t.name
+
+    def options(self, options):
+        if not options:
+            return ()
+        return tuple((o.name,
+                      tuple((p.name, p.value, self.loc(p.loc)) for p in o.params),
+                      self.loc(o.location)) for o in options)
+
+    def type_entry(self, t):
+        if isinstance(t, PrimitiveType):
+            for cls, pclass in _pclass_names:
+                if isinstance(t, cls):
+                    return ('prim', t.name, pclass, t.size, self.loc(t.location))
+            assert False
+        elif isinstance(t, EnumType):
+            members = tuple((m.name, m.value, self.loc(m.location)) for m in t.members)
+            return ('enum', t.name, self.loc(t.location), members)
+        elif isinstance(t, StructType):
+            members = tuple((m.mname, self.typeref(m.mtype), self.options(m.options), self.loc(m.location))
+                            for m in t.members)
+            base = t.base_type.name if t.base_type is not None else None
+            return ('struct', t.name, self.loc(t.location), base, members)
+        else:
+            assert False
+
+    def run(self, tsys):
+        types = tuple(self.type_entry(t) for t in tsys.itertypes())
+        constants = tuple((name, value, self.loc(loc)) for name, value, loc in tsys.iterconsts())
+        configs = tuple((c.generator_name, self.options(c.options), self.loc(c.location))
+                        for c in tsys.itergenconfigs())
+        return FrozenSchema(tuple(self._locations), types, constants, configs)
+
+class _Thawer(object):
+    def __init__(self, schema):
+        self._schema = schema
+        self._locations = [SourceLocation(fn, lineno, is_import)
+                           for fn, lineno, is_import in schema.locations]
+
+    def loc(self, index):
+        return self._locations[index] if index >= 0 else None
+
+    def options(self, options):
+        return [RawNamedOption(name,
+                               [RawOptionParam(pname, value, self.loc(ploc)) for pname, value, ploc in params],
+                               self.loc(loc))
+                for name, params, loc in options]
+
+    def resolve(self, tsys, ref, loc):
+        if ref is None:
+            return VoidType.instance
+        elif isinstance(ref, str):
+            return tsys.lookup(ref)
+        elif ref[0] == 's':
+            return self.resolve(tsys, ref[1], loc).cstring_type(loc)
+        elif ref[0] == '*':
+            return self.resolve(tsys, ref[1], loc).pointer_type(loc)
+        else:
+            return self.resolve(tsys, ref[1], loc).array_type(ref[2], loc)
+
+    def run(self):
+        schema = self._schema
+        tsys = TypeSystem([])
+        loc = self.loc
+
+        # first pass creates all types so members can refer forward
+        for entry in schema.types:
+            kind, name = entry[0], entry[1]
+            if kind == 'prim':
+                tsys._add_primitive(RawDefPrimitive(name, entry[2], entry[3], None, loc(entry[4])))
+            elif kind == 'enum':
+                tsys._add_enum(RawEnumType(name, None, loc(entry[2])))
+                e = tsys.lookup(name)
+                env = e.constant_env()
+                for mname, value, mloc in entry[3]:
+                    env.define(loc(mloc), mname, value)
+                    e.add_member(EnumMember(mname, value, loc(mloc)))
+            else:
+                tsys._add_struct(RawStructType(name, None, None, loc(entry[2])))
+
+        # fill in bases before derived structs so they can share members
+        structs = dict((entry[1], entry) for entry in schema.types if entry[0] == 'struct')
+        done = set()
+        for entry in schema.types:
+            chain = []
+            while entry is not None and entry[0] == 'struct' and entry[1] not in done:
+                chain.append(entry)
+                entry = structs[entry[3]] if entry[3] is not None else None
+
+            for name, sloc, base_name, members in (e[1:] for e in reversed(chain)):
+                done.add(name)
+                t = tsys.lookup(name)
+                if base_name is not None:
+                    base = tsys.lookup(base_name)
+                    t.set_base_struct(base)
+                    t.inherit_members(base)
+                    members = members[len(base.members):]
+                for mname, ref, options, mloc in members:
+                    mloc = loc(mloc)
+                    t.add_member(StructMember(mname, self.resolve(tsys, ref, mloc), self.options(options), mloc))
+
+        for name, value, cloc in schema.constants:
+            tsys._global_env.define(loc(cloc), name, value)
+
+        for name, options, cloc in schema.configs:
+            tsys._generator_configs.append(GeneratorConfig(name, self.options(options), loc(cloc)))
+
+        tsys._analyze_structs()
+        return tsys
+
+def freeze_type_system(tsys):
+    return _Freezer().run(tsys)
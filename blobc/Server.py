@@ -0,0 +1,120 @@
+
+import os
+import sys
+import json
+import argparse
+import functools
+import traceback
+import SocketServer
+
+from cStringIO import StringIO
+
+from Parser import DefaultImportHandler
+from Session import SchemaSession
+import Driver
+
+class _StatImportHandler(DefaultImportHandler):
+    """DefaultImportHandler that only reads files again when their size,
+    modification time or inode changed"""
+
+    def __init__(self, dirs):
+        DefaultImportHandler.__init__(self, dirs)
+        self._contents = {}
+
+    def get_import_contents(self, fn):
+        st = os.stat(fn)
+        key = (st.st_mtime, st.st_size, st.st_ino)
+        cached = self._contents.get(fn)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        data = DefaultImportHandler.get_import_contents(self, fn)
+        self._contents[fn] = (key, data)
+        return data
+
+class _ParserExit(Exception):
+    def __init__(self, status):
+        Exception.__init__(self, status)
+        self.status = status
+
+class _RequestArgumentParser(argparse.ArgumentParser):
+    """Reports usage errors and help to a request's output instead of the
+    server's, and doesn't exit"""
+
+    def __init__(self, stdout, stderr, **kwargs):
+        argparse.ArgumentParser.__init__(self, **kwargs)
+        self._stdout = stdout
+        self._stderr = stderr
+
+    def _print_message(self, message, file=None):
+        if message:
+            (self._stdout if file is sys.stdout else self._stderr).write(message)
+
+    def exit(self, status=0, message=None):
+        if message:
+            self._stderr.write(message)
+        raise _ParserExit(status)
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.read())
+        cwd = request['cwd'].encode('utf-8')
+        argv = [arg.encode('utf-8') for arg in request['argv']]
+        status, out, err = self.server.compile(cwd, argv)
+        # generated text is passed through byte for byte
+        self.wfile.write(json.dumps({'status': status,
+                                     'stdout': out.decode('latin-1'),
+                                     'stderr': err.decode('latin-1')}))
+
+class CompileServer(SocketServer.UnixStreamServer):
+    """Runs blobc.py command lines sent by clients over a Unix socket.
+
+    Clients send {"cwd": ..., "argv": [...]} as JSON and close their end;
+    the server runs the command line in that directory, writing the output
+    files itself, and answers with {"status": ..., "stdout": ...,
+    "stderr": ...}.
+
+    Parse results and compiled types are kept between requests in one
+    SchemaSession per working directory and import path list, and files are
+    only read again when their size or modification time changed. Requests
+    are handled one at a time."""
+
+    def __init__(self, socket_path):
+        # a socket left behind by a server that was killed
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        SocketServer.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+        self.socket_path = socket_path
+        self._sessions = {}
+
+    def session(self, import_dirs):
+        key = (os.getcwd(), tuple(import_dirs))
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = SchemaSession(import_handler=_StatImportHandler(import_dirs))
+        return session
+
+    def compile(self, cwd, argv):
+        """Run one command line in cwd, returning (status, stdout, stderr)"""
+        out, err = StringIO(), StringIO()
+        old_cwd = os.getcwd()
+        try:
+            os.chdir(cwd)
+            status = Driver.main(argv, out, err,
+                                 parser_class=functools.partial(_RequestArgumentParser, out, err),
+                                 session_factory=self.session)
+        except _ParserExit as ex:
+            status = ex.status
+        except Exception:
+            # e.g. an unwritable output file; report it and keep serving
+            err.write(traceback.format_exc())
+            status = 1
+        finally:
+            os.chdir(old_cwd)
+        return status, out.getvalue(), err.getvalue()
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
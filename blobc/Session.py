@@ -0,0 +1,152 @@
+
+from ParseTree import *
+from Parser import ParseContext, DefaultImportHandler, ImportGraph
+from Typesys import TypeSystem
+
+def _expr_names(expr, out):
+    refs = []
+    expr.collect_names(refs)
+    for name, loc in refs:
+        # 'Enum.Member' depends on the enum type as a whole
+        out.add(name.split('.', 1)[0])
+
+def _type_names(t, out):
+    if isinstance(t, RawSimpleType):
+        out.add(t.name)
+    elif isinstance(t, RawPointerType):
+        _type_names(t.basetype, out)
+    elif isinstance(t, RawArrayType):
+        _type_names(t.basetype, out)
+        for dim in t.dims:
+            _expr_names(dim, out)
+
+def node_dependencies(p):
+    """Names of the types and constants a top-level parse node refers to"""
+    deps = set()
+    if isinstance(p, RawStructType):
+        for opt in p.get_options('base'):
+            deps.update(opt.pos_params)
+        for mem in p.members:
+            _type_names(mem.type, deps)
+    elif isinstance(p, RawEnumType):
+        for mem in p.members:
+            _expr_names(mem.expr, deps)
+    elif isinstance(p, RawConstant):
+        _expr_names(p.expr, deps)
+    return deps
+
+def _defined_name(p):
+    if isinstance(p, (RawStructType, RawEnumType, RawDefPrimitive, RawConstant)):
+        return p.name
+    return None
+
+class _FileEntry(object):
+    def __init__(self, digest, is_import, nodes):
+        self.digest = digest
+        self.is_import = is_import
+        self.nodes = nodes
+        self.names = set(n for n in (_defined_name(p) for p in nodes) if n is not None)
+
+class _SessionParseContext(ParseContext):
+    def __init__(self, session):
+        ParseContext.__init__(self, True, session._import_handler, session.import_graph)
+        self._session = session
+
+    def _parse_one(self, fn, is_import):
+        session = self._session
+        data = self._load_file(fn)
+        digest = self.files[-1][1]
+        entry = session._files.get(fn)
+        if entry is None or entry.digest != digest or entry.is_import != is_import:
+            nodes = self._parse_data(fn, data, is_import)
+            entry = session._files[fn] = _FileEntry(digest, is_import, nodes)
+            session.reparsed.append(fn)
+        return entry.nodes
+
+class SchemaSession(object):
+    """Keeps parse results and compiled types between compiles of the same
+    schema, for tools that recompile after every edit.
+
+    On each compile() every file in the import graph is read and hashed, but
+    only files whose content changed are parsed again. Types that are not
+    defined in a changed file and don't depend (directly or through other
+    types and constants) on anything that is, are carried over from the
+    previous TypeSystem unchanged. They keep their identity, and so their
+    memoized layouts and generated classes. After a compile, reparsed lists
+    the files that were parsed, recompiled names the types that were
+    compiled afresh and files lists every file that went into the compile,
+    the main file first."""
+
+    def __init__(self, import_dirs=None, import_handler=None):
+        if import_handler is None:
+            import_handler = DefaultImportHandler(import_dirs or ('.',))
+        self._import_handler = import_handler
+        self.import_graph = ImportGraph()
+        self._files = {}
+        # per file: ((digest, is_import), defined names) as of the last
+        # successful compile
+        self._compiled = {}
+        self._type_system = None
+        self.reparsed = []
+        self.recompiled = set()
+        self.files = []
+
+    def _dirty_names(self, parse_tree, changed_files):
+        dirty = set()
+        for fn in changed_files:
+            if fn in self._compiled:
+                dirty.update(self._compiled[fn][1])
+            entry = self._files.get(fn)
+            if entry is not None:
+                dirty.update(entry.names)
+
+        users = {}
+        for p in parse_tree:
+            name = _defined_name(p)
+            if name is None:
+                continue
+            for dep in node_dependencies(p):
+                users.setdefault(dep, []).append(name)
+
+        work = list(dirty)
+        while work:
+            for user in users.get(work.pop(), ()):
+                if user not in dirty:
+                    dirty.add(user)
+                    work.append(user)
+        return dirty
+
+    def compile(self, fn):
+        """Parse and compile fn and its imports, returning (parse_tree, type_system)"""
+        self.reparsed = []
+        # files may have come and gone since the last compile
+        invalidate = getattr(self._import_handler, 'invalidate', None)
+        if invalidate is not None:
+            invalidate()
+        ctx = _SessionParseContext(self)
+        parse_tree = ctx.parse(fn)
+
+        state = dict((f, (digest, self._files[f].is_import)) for f, digest in ctx.files)
+        # files dropped from the import graph count as changed, too
+        changed = set(self._compiled) - set(state)
+        for f, fstate in state.iteritems():
+            if f not in self._compiled or self._compiled[f][0] != fstate:
+                changed.add(f)
+
+        reuse = {}
+        old = self._type_system
+        if old is not None:
+            dirty = self._dirty_names(parse_tree, changed)
+            for t in old.itertypes():
+                if t.name not in dirty:
+                    reuse[t.name] = t
+
+        tsys = TypeSystem(parse_tree, reuse=reuse)
+
+        self._type_system = tsys
+        self._compiled = dict((f, (fstate, self._files[f].names)) for f, fstate in state.iteritems())
+        for f in set(self._files) - set(state):
+            del self._files[f]
+        self.recompiled = set(t.name for t in tsys.itertypes() if not tsys.is_reused(t.name))
+        self.files = [f for f, digest in ctx.files]
+        return parse_tree, tsys
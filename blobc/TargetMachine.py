@@ -1,3 +1,4 @@
+from Typesys import TypeSystemException
 
 class TargetMachine(object):
     def __init__(self, **kwargs):
@@ -5,16 +6,39 @@ class TargetMachine(object):
         self.pointer_align = kwargs.get('pointer_align', self.pointer_size)
         self.big_endian = 'big' == kwargs.get('endian', 'little')
         self._sizes = {}
+        self._layouts = {}
+        self._dtypes = {}
+
+    # The caches below are filled without locking. Results are immutable and
+    # deterministic, so when two threads race on the same type they compute
+    # equal values and setdefault() makes them agree on one object.
 
     def size_align(self, ntype):
         sz = self._sizes.get(ntype)
         if sz is None:
-            sz = self._sizes[ntype] = ntype.compute_size(self)
+            sz = self._sizes.setdefault(ntype, ntype.compute_size(self))
         return sz
 
+    def struct_layout(self, ntype):
+        layout = self._layouts.get(ntype)
+        if layout is None:
+            layout = self._layouts.setdefault(ntype, ntype.compute_layout(self))
+        return layout
+
+    def offsetof(self, ntype, member_name):
+        index = ntype.member_index(member_name)
+        if index is None:
+            raise TypeSystemException(ntype.location, "struct %s has no member %s" % (ntype.name, member_name))
+        return self.struct_layout(ntype).offsets[index]
+
     def sizeof(self, ntype):
         return self.size_align(ntype)[0]
 
     def alignof(self, ntype):
         return self.size_align(ntype)[1]
 
+    def numpy_dtype(self, ntype):
+        dt = self._dtypes.get(ntype)
+        if dt is None:
+            dt = self._dtypes.setdefault(ntype, ntype.numpy_dtype(self))
+        return dt
@@ -1,4 +1,6 @@
 
+import sys
+import array
 import types
 import struct
 
@@ -46,9 +48,51 @@ class Array(object):
     def __repr__(self): # pragma: no cover
         return "<%s>%s" % (str(self.item_type), repr(self.items))
 
+    def __len__(self):
+        return len(self.items)
+
     def __str__(self):
         return str(self.items)
 
+class PackedArray(Array):
+    """An array backed by a NumPy array, written to blobs in a single copy"""
+    def __init__(self, ntype, data):
+        self.item_type = ntype
+        self.data = data
+
+    def __repr__(self): # pragma: no cover
+        return "<%s>%s" % (str(self.item_type), repr(self.data))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __str__(self):
+        return str(self.data)
+
+    def pack(self, targmach):
+        dtype = targmach.numpy_dtype(self.item_type)
+        if self.data.dtype.names != dtype.names:
+            raise PythonMappingException("array fields %s do not match %s fields %s" %
+                    (self.data.dtype.names, str(self.item_type), dtype.names))
+        if self.data.dtype == dtype:
+            return self.data.tostring()
+        # convert into a zeroed array so padding doesn't leak garbage
+        converted = _import_numpy().zeros(self.data.shape, dtype)
+        converted[...] = self.data
+        return converted.tostring()
+
+def _is_ndarray(v):
+    # NumPy is optional; if it was never imported, v can't be an ndarray.
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and isinstance(v, numpy.ndarray)
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise PythonMappingException("NumPy is required for dtype support")
+    return numpy
+
 class String(Array):
     def __init__(self, char_type, text):
         Array.__init__(self, char_type, text + '\0')
@@ -70,6 +114,9 @@ class VoidType(BaseType):
     def compute_size(self, targmach):
         raise TypeSystemException(None, 'void type cannot be instantiated')
 
+    def numpy_dtype(self, targmach):
+        raise TypeSystemException(None, 'void type cannot be instantiated')
+
     def default_value(self):
         raise TypeSystemException(None, 'void type cannot be instantiated')
 
@@ -91,6 +138,9 @@ class PointerType(BaseType):
     def compute_size(self, targmach):
         return (targmach.pointer_size, targmach.pointer_align)
 
+    def numpy_dtype(self, targmach):
+        raise TypeSystemException(self.location, '%s: pointers have no NumPy dtype' % (self._str))
+
     def default_value(self):
         return None
 
@@ -110,6 +160,10 @@ class PointerType(BaseType):
         elif isinstance(v, list):
             return Array(self.base_type, v)
 
+        # Or to a NumPy array of data
+        elif _is_ndarray(v):
+            return PackedArray(self.base_type, v)
+
         # Or to an individual array element
         elif isinstance(v, tuple):
             if not isinstance(v[0], Array):
@@ -142,8 +196,8 @@ class PointerType(BaseType):
 
         if isinstance(v, Array):
             loc = serializer.divert()
-            if len(v.items) > 0:
-                v.item_type.array_type(len(v.items)).serialize(serializer, v)
+            if len(v) > 0:
+                v.item_type.array_type(len(v)).serialize(serializer, v)
             serializer.resume()
             serializer.write_ptr(loc)
 
@@ -184,22 +238,31 @@ class ArrayType(BaseType):
         self._str = '%s[%d]' % (str(self.base_type), dim)
 
     def compute_size(self, targmach):
-        size, align = self.base_type.compute_size(targmach)
+        size, align = targmach.size_align(self.base_type)
         size *= self.dim
         return (size, align)
 
+    def numpy_dtype(self, targmach):
+        numpy = _import_numpy()
+        return numpy.dtype((targmach.numpy_dtype(self.base_type), (self.dim,)))
+
     def default_value(self):
         return [self.base_type.default_value for x in xrange(0, self.dim)]
 
     def create_value(self, v):
         if len(v) != self.dim:
             raise PythonMappingException("expected list of length %d; got list of %d items" % (self.dim, len(v)))
+        if _is_ndarray(v):
+            return PackedArray(self.base_type, v)
         return Array(self.base_type, v)
 
     def serialize(self, serializer, datum):
         serializer.align(serializer.targmach.alignof(self.base_type))
         serializer.update_location(datum)
         assert isinstance(datum, Array)
+        if isinstance(datum, PackedArray):
+            serializer.write(datum.pack(serializer.targmach))
+            return
         for item in datum.items:
             self.base_type.serialize(serializer, item)
 
@@ -229,6 +292,10 @@ class EnumType(BaseType):
     def compute_size(self, targmach):
         return 4, 4
 
+    def numpy_dtype(self, targmach):
+        numpy = _import_numpy()
+        return numpy.dtype('>u4' if targmach.big_endian else '<u4')
+
     def default_value(self):
         return self.members[0].value
 
@@ -239,19 +306,28 @@ class EnumType(BaseType):
         fmt = '>I' if serializer.targmach.big_endian else '<I'
         serializer.write(struct.pack(fmt, v.value))
 
-class StructMember(object):
-    def __init__(self, raw_member, mtype):
+class StructMember(OptionContainer):
+    __slots__ = ('mtype', 'mname', 'location')
+
+    def __init__(self, mname, mtype, options, loc):
+        OptionContainer.__init__(self, options)
         self.mtype = mtype
-        self.parse_node = raw_member
-        self.mname = raw_member.name
-        self.location = raw_member.location
-        self.offset = -1 
+        self.mname = mname
+        self.location = loc
 
-    def has_option(self, name):
-        return self.parse_node.has_option(name)
+class StructLayout(object):
+    """Member offsets, sizes and alignments of a struct for one target machine.
 
-    def get_options(self, name):
-        return self.parse_node.get_options(name)
+    Layouts are computed once per (target, struct) and never modified
+    afterwards, so they can be shared freely between threads. end is the
+    offset just past the last member, before tail padding."""
+    __slots__ = ('size', 'align', 'end', 'offsets', 'sizes', 'aligns')
+
+    def __init__(self, size, align, end, offsets, sizes, aligns):
+        self.size, self.align, self.end = size, align, end
+        self.offsets = array.array('L', offsets)
+        self.sizes = array.array('L', sizes)
+        self.aligns = array.array('L', aligns)
 
 class ConstantEnv:
     def __init__(self, name = None, parent = None):
@@ -269,6 +345,12 @@ class ConstantEnv:
     def _add_child(self, name, child):
         self._children[name] = child
 
+    def adopt(self, name, child):
+        """Move an existing child environment under this one"""
+        child._parent = self
+        child._root = self._root
+        self._add_child(name, child)
+
     def _get_child(self, loc, name):
         ns = self._children.get(name)
         if ns is None:
@@ -294,15 +376,15 @@ class ConstantEnv:
         while e is not None:
             v = e._e.get(name)
             if v is None:
-                e = self._parent
+                e = e._parent
             else:
                 return v[1]
         raise TypeSystemException(loc, "undefined constant: '%s'" % (name))
 
     def define(self, loc, name, value):
         assert name.find('.') == -1
-        if self._e.has_key(name):
-            raise TypeSystemException(loc, "duplicate constant: '%s'")
+        if name in self._e:
+            raise TypeSystemException(loc, "duplicate constant: '%s'" % (name))
         self._order.append(name)
         self._e[name] = (loc, value)
 
@@ -311,6 +393,72 @@ class ConstantEnv:
             loc, value = self._e[name]
             yield name, value, loc
 
+class _GraphScope(object):
+    def __init__(self, graph, scope, position):
+        self._graph, self._scope, self._position = graph, scope, position
+
+    def lookup_value(self, loc, name):
+        graph = self._graph
+        return graph._values[graph._resolve(self._scope, self._position, loc, name)]
+
+class ConstantGraph(object):
+    """Integer constants and enum members, each evaluated once.
+
+    Nodes are keyed by qualified name, 'Name' for global constants and
+    'Enum.Member' for enum members, and are added in source order. An
+    expression may only refer to constants defined before it. Inside an
+    enum, plain names resolve to the enum's earlier members first and global
+    constants second, like in ConstantEnv."""
+
+    def __init__(self):
+        self._order = []
+        self._nodes = {} # qualified name -> (expr, enum scope, location)
+        self._positions = {} # qualified name -> index in source order
+        self._values = {}
+
+    def _define(self, qname):
+        self._positions[qname] = len(self._positions)
+
+    def add(self, loc, qname, expr, scope=None):
+        if qname in self._positions:
+            raise TypeSystemException(loc, "duplicate constant: '%s'" % (qname))
+        self._define(qname)
+        self._order.append(qname)
+        self._nodes[qname] = (expr, scope, loc)
+
+    def add_known(self, qname, value):
+        """Add a constant whose value is already known"""
+        self._define(qname)
+        self._values[qname] = value
+
+    def value(self, qname):
+        return self._values[qname]
+
+    def _resolve(self, scope, position, loc, name):
+        """Qualified name of the constant name refers to from an expression
+        at position in enum scope"""
+        if name.find('.') == -1 and scope is not None:
+            candidates = (scope + '.' + name, name)
+        else:
+            candidates = (name,)
+        positions = self._positions
+        for qname in candidates:
+            if positions.get(qname, position) < position:
+                return qname
+        for qname in candidates:
+            if qname in positions:
+                raise TypeSystemException(loc, "constant '%s' used before its definition" % (name))
+        if name.find('.') == -1:
+            raise TypeSystemException(loc, "undefined constant: '%s'" % (name))
+        raise TypeSystemException(loc, "unknown identifier '%s'" % (name))
+
+    def evaluate(self):
+        # everything an expression refers to comes before it
+        values, positions = self._values, self._positions
+        for qname in self._order:
+            expr, scope, loc = self._nodes[qname]
+            values[qname] = expr.eval(_GraphScope(self, scope, positions[qname]))
+
 class StructType(BaseType):
     def __init__(self, name, loc):
         BaseType.__init__(self)
@@ -318,58 +466,109 @@ class StructType(BaseType):
         self.location = loc
         self.members = []
         self._memhash = {}
+        self._memindex = {}
         self.base_type = None # struct type included in this type
         self.classobj = None
+        self._ancestors = None
         self._str = name
 
     def member_by_name(self, name):
         return self._memhash.get(name)
 
+    def member_index(self, name):
+        return self._memindex.get(name)
+
     def set_base_struct(self, t):
+        """Make t the base of this struct. The base's members must make up
+        the start of this struct's member list; see inherit_members()."""
         if self.base_type is not None:
             raise TypeSystemException(None, '%s already has a base' % (self.name))
         self.base_type = t
+        self._ancestors = None
+
+    def inherit_members(self, base):
+        """Start the member list with base's members, sharing the objects"""
+        assert not self.members
+        self.members = list(base.members)
+        self._memhash = dict(base._memhash)
+        self._memindex = dict(base._memindex)
+
+    def clear_members(self):
+        """Drop the members and base, e.g. after resolving them failed"""
+        self.members = []
+        self._memhash = {}
+        self._memindex = {}
+        self.base_type = None
+        self._ancestors = None
+
+    def ancestors(self):
+        """This struct and all of its bases, as a frozenset"""
+        if self._ancestors is None:
+            # fill in from the nearest base that already has its set
+            chain = []
+            t = self
+            while t is not None and t._ancestors is None:
+                chain.append(t)
+                t = t.base_type
+            result = t._ancestors if t is not None else frozenset()
+            for t in reversed(chain):
+                result = t._ancestors = result | frozenset((t,))
+        return self._ancestors
 
     def is_superset_of(self, other):
-        if self is other:
-            return True
-
-        if not isinstance(other, StructType):
-            return False
-        
-        # Check if the other type is a base of this type, recursively.
-        t = self
-        base = t.base_type
-        while base is not None:
-            if base is other:
-                return True
-            base = base.base_type
-
-        return False
+        return other is self or other in self.ancestors()
 
     def set_class_object(self, cls):
         self.classobj = cls
 
-    def compute_size(self, targmach):
-        off = 0
-        maxalign = 1
-        for mem in self.members:
+    def compute_layout(self, targmach):
+        base = self.base_type
+        if base is not None:
+            # inherited members come first and sit where they do in the base
+            prefix = targmach.struct_layout(base)
+            off, maxalign = prefix.end, prefix.align
+            offsets = array.array('L', prefix.offsets)
+            sizes = array.array('L', prefix.sizes)
+            aligns = array.array('L', prefix.aligns)
+            members = self.members[len(base.members):]
+        else:
+            off, maxalign = 0, 1
+            offsets, sizes, aligns = [], [], []
+            members = self.members
+
+        for mem in members:
             t = mem.mtype
             tsize, align = targmach.size_align(t)
             off = (off + align - 1) & ~(align - 1)
-            mem.offset = off
+            offsets.append(off)
+            sizes.append(tsize)
+            aligns.append(align)
             off += tsize
             maxalign = max(align, maxalign)
 
         size = (off + (maxalign - 1)) & ~(maxalign - 1)
-        alignment = maxalign
 
-        return (size, alignment)
+        return StructLayout(size, maxalign, off, offsets, sizes, aligns)
+
+    def compute_size(self, targmach):
+        layout = targmach.struct_layout(self)
+        return (layout.size, layout.align)
+
+    def numpy_dtype(self, targmach):
+        """Structured dtype matching this struct's layout; pointer-free structs only"""
+        numpy = _import_numpy()
+        layout = targmach.struct_layout(self)
+        return numpy.dtype({
+            'names': [m.mname for m in self.members],
+            'formats': [targmach.numpy_dtype(m.mtype) for m in self.members],
+            'offsets': list(layout.offsets),
+            'itemsize': layout.size })
 
     def add_member(self, mem):
-        if self._memhash.has_key(mem.mname):
+        if mem.mname in self._memhash:
             raise TypeSystemException(mem.location, "duplicate struct member %s" % (mem.mname))
         self._memhash[mem.mname] = mem
+        self._memindex[mem.mname] = len(self.members)
         self.members.append(mem)
 
     def get_field_type(self, name):
@@ -418,6 +617,10 @@ class PrimitiveType(BaseType):
     def compute_size(self, targmach):
         return self.size, self.size
 
+    def numpy_dtype(self, targmach):
+        numpy = _import_numpy()
+        return numpy.dtype('%s%s%d' % ('>' if targmach.big_endian else '<', self.NUMPY_KIND, self.size))
+
     def __repr__(self): # pragma: no cover
         return self.name
 
@@ -425,6 +628,8 @@ class PrimitiveType(BaseType):
         return self.name
 
 class IntegerType(PrimitiveType):
+    NUMPY_KIND = 'i'
+
     def __init__(self, name, size, loc, min, max):
         PrimitiveType.__init__(self, name, size, loc)
         self.min = min
@@ -467,10 +672,18 @@ class SignedIntType(IntegerType):
         serializer.write(data)
 
 class CharacterType(PrimitiveType):
+    NUMPY_KIND = 'u'
+
     def __init__(self, name, size, loc):
         PrimitiveType.__init__(self, name, size, loc)
         self._nil = '\0'
 
+    def numpy_dtype(self, targmach):
+        if self.size == 1:
+            # keep one-char strings as the element value, like create_value()
+            return _import_numpy().dtype('S1')
+        return PrimitiveType.numpy_dtype(self, targmach)
+
     def default_value(self):
         return self._nil
 
@@ -486,6 +699,8 @@ class CharacterType(PrimitiveType):
         serializer.write(datum)
 
 class UnsignedIntType(IntegerType):
+    NUMPY_KIND = 'u'
+
     def __init__(self, name, size, loc):
         fmt = int_format_codes['u%d' % (size)]
         self._fmt_le = '<' + fmt
@@ -501,6 +716,8 @@ class UnsignedIntType(IntegerType):
         serializer.write(data)
 
 class FloatingType(PrimitiveType):
+    NUMPY_KIND = 'f'
+
     def __init__(self, name, size, loc):
         PrimitiveType.__init__(self, name, size, loc)
         if 4 == size:
@@ -529,72 +746,181 @@ class IntegerConstant(object):
         self.name, self.value = name, value
 
 class TypeSystem(object):
-    def __init__(self, raw_data):
+    def __init__(self, raw_data, reuse=None, lazy=False):
+        """Compile raw_data into types.
+
+        reuse optionally maps type names to already compiled types from an
+        earlier TypeSystem. Those are taken over as-is instead of being
+        compiled again; the caller must guarantee that their definitions and
+        everything they depend on are unchanged.
+
+        With lazy set, struct members are not resolved up front. Looking up
+        a struct resolves it and every struct reachable from it, so errors
+        in struct definitions only surface once they are used. Iterating
+        over all types, or asking questions about the whole system, resolves
+        everything that is left."""
         object.__init__(self)
+        self._reuse = reuse or {}
+        self._reused = set()
         self._types = {}
         self._typeorder = []
         self._structs = []
         self._enums = []
         self._raw_types = {}
         self._bases_applies = {}
+        self._dim_values = {}
+        self._members_done = set()
+        self._generator_configs = []
         self._global_env = ConstantEnv()
-
+        self._pending = {}
+        self._struct_edges_map = {}
+        self._struct_order = []
+        self._has_pointers = {}
+        self._component = {}
+        self._components = []
+        self._reachable = {}
+        self._index = None
+        self._raw_structs = []
+        self._raw_values = []
+
+        self._compile(raw_data, lazy)
+
+    # pass 1 handlers by raw node type; anything not listed is an error
+    _pass1_dispatch = {
+        RawDefPrimitive: '_add_primitive',
+        RawStructType: '_add_struct',
+        RawEnumType: '_add_enum',
+        RawImportStmt: '_reject_import',
+        GeneratorConfig: '_add_generator_config',
+        RawConstant: '_add_constant',
+    }
+
+    def _compile(self, raw_data, lazy):
+        # pass 1: add primitives & struct shells so we can resolve all named
+        # types, and sort the rest out for the later passes
+        dispatch = self._pass1_dispatch
         for p in raw_data:
-            if isinstance(p, RawStructType):
-                self._raw_types[p.name] = p
-
-        # pass 1: add primitives & struct shells so we can resolve all named types
-        for p in raw_data:
-            if isinstance(p, RawDefPrimitive):
-                self._add_primitive(p)
-            elif isinstance(p, RawStructType):
-                self._add_struct(p)
-            elif isinstance(p, RawEnumType):
-                self._add_enum(p)
-            elif isinstance(p, RawImportStmt):
-                raise TypeSystemException(p.location, "unresolved import statements present")
-            elif isinstance(p, GeneratorConfig):
-                continue
-            elif isinstance(p, RawConstant):
-                continue
-            else:
-                assert False
+            handler = dispatch.get(type(p))
+            if handler is None:
+                for cls, name in dispatch.iteritems():
+                    if isinstance(p, cls):
+                        handler = name
+                        break
+                else:
+                    assert False
+            getattr(self, handler)(p)
 
         # pass 2: evaluate all integer constants and enums
-        for p in raw_data:
+        graph = ConstantGraph()
+        for p in self._raw_values:
+            if isinstance(p, RawEnumType):
+                self._add_enum_constants(graph, p)
+            else:
+                graph.add(p.location, p.name, p.expr)
+        graph.evaluate()
+        for p in self._raw_values:
             if isinstance(p, RawEnumType):
-                self._add_enum_members(p)
-            elif isinstance(p, RawConstant):
-                self._add_constant(p)
+                self._add_enum_members(graph, p)
+            else:
+                self._global_env.define(p.location, p.name, graph.value(p.name))
 
-        # pass 3: resolve all struct member types
-        for p in raw_data:
-            if isinstance(p, RawStructType):
+        if lazy:
+            # passes 3 and 4 run per struct closure, see _resolve_pending()
+            for p in self._raw_structs:
+                self._pending[p.name] = p
+        else:
+            # pass 3: resolve all struct member types
+            for p in self._raw_structs:
                 self._add_struct_members(p)
 
-        # pass 4: check non-recursive struct definitions
-        self._check_structs()
+            # pass 4: check non-recursive struct definitions, order structs
+            self._analyze_structs()
 
-    def _add_constant(self, c):
-        expr = c.expr
-        value = expr.eval(self._global_env)
-        self._global_env.define(c.location, c.name, value)
+        self._raw_structs = []
+        self._raw_values = []
+        self._reuse = {}
 
     def itertypes(self):
+        self._resolve_all()
         for name in self._typeorder:
             yield self._types[name]
 
     def iterconsts(self):
         return self._global_env.iter()
 
+    def itergenconfigs(self):
+        return iter(self._generator_configs)
+
+    def freeze(self):
+        """Return an immutable, picklable FrozenSchema of this type system"""
+        from Schema import freeze_type_system
+        return freeze_type_system(self)
+
     def lookup(self, name):
-        return self._types[name]
+        t = self._types[name]
+        if self._pending and isinstance(t, StructType):
+            self._resolve_pending(t)
+        return t
+
+    def _resolve_pending(self, root):
+        """Resolve the members of root and of every unresolved struct
+        reachable from it, then check the new structs"""
+        new = []
+        order_len = len(self._struct_order)
+        components_len = len(self._components)
+        try:
+            work = [root]
+            while work:
+                p = self._pending.get(work.pop().name)
+                if p is None:
+                    continue
+                start = len(new)
+                self._add_struct_members(p, new)
+                for s in new[start:]:
+                    del self._pending[s.name]
+                    for mem in s.members:
+                        t = mem.mtype
+                        while isinstance(t, (PointerType, ArrayType)):
+                            t = t.base_type
+                        if isinstance(t, StructType) and t.name in self._pending:
+                            work.append(t)
+            if new:
+                self._analyze_structs(new)
+        except TypeSystemException:
+            # put everything back so that later lookups fail the same way
+            for s in new:
+                self._members_done.discard(s.name)
+                self._pending[s.name] = self._raw_types[s.name]
+                self._struct_edges_map.pop(s, None)
+                self._has_pointers.pop(s, None)
+                self._component.pop(s, None)
+                if s.name not in self._reused:
+                    s.clear_members()
+            del self._struct_order[order_len:]
+            del self._components[components_len:]
+            raise
+
+    def _resolve_all(self):
+        while self._pending:
+            name = next(iter(self._pending))
+            self._resolve_pending(self._types[name])
 
     def _add_type(self, name, type_obj):
         assert isinstance(name, str)
         assert isinstance(type_obj, BaseType)
         self._typeorder.append(name)
         self._types[name] = type_obj 
+        self._index = None
+
+    def _take_reused(self, name):
+        t = self._reuse.get(name)
+        if t is not None:
+            self._reused.add(name)
+        return t
+
+    def is_reused(self, name):
+        """True if the named type was taken over from an earlier TypeSystem"""
+        return name in self._reused
 
     def _add_primitive(self, p):
         name = p.name
@@ -602,10 +928,14 @@ class TypeSystem(object):
         pclass = p.pclass
         loc = p.location
 
-        if self._types.has_key(name):
+        if name in self._types:
             raise TypeSystemException(loc, "duplicate type name %s" % (name))
 
-        o = None
+        o = self._take_reused(name)
+        if o is not None:
+            self._add_type(name, o)
+            return
+
         if 'uint' == pclass:
             o = UnsignedIntType(name, size, loc)
         elif 'sint' == pclass:
@@ -622,115 +952,384 @@ class TypeSystem(object):
     def _add_struct(self, p):
         name = p.name
         loc = p.location
-        if self._types.has_key(name):
+        if name in self._types:
             raise TypeSystemException(loc, "duplicate type name %s" % (name))
-        t = StructType(name, loc)
+        t = self._take_reused(name) or StructType(name, loc)
         self._add_type(name, t)
         self._structs.append(t)
+        self._raw_types[name] = p
+        self._raw_structs.append(p)
 
     def _add_enum(self, p):
         loc = p.location
         name = p.name
-        if self._types.has_key(name):
+        if name in self._types:
             raise TypeSystemException(loc, "duplicate type name %s" % (name))
 
-        t = EnumType(name, loc, self._global_env)
+        t = self._take_reused(name)
+        if t is not None:
+            self._global_env.adopt(name, t.constant_env())
+        else:
+            t = EnumType(name, loc, self._global_env)
         self._add_type(name, t)
         self._enums.append(t)
+        self._raw_values.append(p)
+
+    def _add_constant(self, p):
+        self._raw_values.append(p)
 
-    def _add_enum_members(self, p):
+    def _add_generator_config(self, p):
+        self._generator_configs.append(p)
+
+    def _reject_import(self, p):
+        raise TypeSystemException(p.location, "unresolved import statements present")
+
+    def _add_enum_constants(self, graph, p):
+        enum_name = p.name
+        if enum_name in self._reused:
+            for m in self._types[enum_name].members:
+                graph.add_known(enum_name + '.' + m.name, m.value)
+        else:
+            for m in p.members:
+                graph.add(m.location, enum_name + '.' + m.name, m.expr, enum_name)
+
+    def _add_enum_members(self, graph, p):
         enum_name = p.name
+        if enum_name in self._reused:
+            return
         e = self._types[enum_name]
         env = e.constant_env()
 
         for m in p.members:
             name = m.name
-            expr = m.expr
-            value = expr.eval(env)
+            value = graph.value(enum_name + '.' + name)
             env.define(m.location, name, value)
             e.add_member(EnumMember(name, value, p.location))
 
-    def _resolve_type(self, t):
-        loc = t.location
-        if isinstance(t, RawSimpleType):
-            res = self._types.get(t.name)
-            if res is None:
-                raise TypeSystemException(loc, "undefined type '%s'" % (t.name))
-            return res
-        elif isinstance(t, RawPointerType):
-            if t.is_cstring:
-                return self._resolve_type(t.basetype).cstring_type(loc)
-            else:
-                return self._resolve_type(t.basetype).pointer_type(loc)
-        elif isinstance(t, RawArrayType):
-            at = self._resolve_type(t.basetype)
-            for dim in t.dims:
-                dim_int = dim.eval(self._global_env)
-                at = at.array_type(dim_int, loc)
-            return at
-        elif t is RawVoidType.instance:
-            return VoidType.instance
+    def _eval_dim(self, dim):
+        value = self._dim_values.get(dim)
+        if value is None:
+            value = self._dim_values[dim] = dim.eval(self._global_env)
+        return value
+
+    def _resolve_simple(self, t):
+        res = self._types.get(t.name)
+        if res is None:
+            raise TypeSystemException(t.location, "undefined type '%s'" % (t.name))
+        return res
+
+    def _resolve_pointer(self, t):
+        if t.is_cstring:
+            return self._resolve_type(t.basetype).cstring_type(t.location)
         else:
-            assert False
+            return self._resolve_type(t.basetype).pointer_type(t.location)
+
+    def _resolve_array(self, t):
+        at = self._resolve_type(t.basetype)
+        for dim in t.dims:
+            dim_int = self._eval_dim(dim)
+            at = at.array_type(dim_int, t.location)
+        return at
+
+    def _resolve_void(self, t):
+        return VoidType.instance
+
+    _resolve_dispatch = {
+        RawSimpleType: _resolve_simple,
+        RawPointerType: _resolve_pointer,
+        RawArrayType: _resolve_array,
+        RawVoidType: _resolve_void,
+    }
+
+    def _resolve_type(self, t):
+        return self._resolve_dispatch[type(t)](self, t)
+
+    def _raw_base(self, srcelem):
+        """Return the raw struct named in srcelem's 'base' option, or None"""
+        opts = srcelem.get_options('base')
+        if not opts:
+            return None
 
-    def _apply_struct_base(self, target, srcelem, depth=0):
-        first = True
         loc = srcelem.location
-        for opt in srcelem.get_options('base'):
-            # Check that base is only given once.
-            if not first:
-                raise TypeSystemException(loc, "'base' can only be specified once")
-            first = False
-
-            if len(opt.pos_params) != 1:
-                raise TypeSystemException(loc,
-                        "'base' option must have a single "\
-                        "positional parameter, the base struct")
-
-            base_name = opt.pos_params[0]
-            raw_base = self._raw_types.get(base_name)
-            if raw_base is None:
-                raise TypeSystemException(loc, "'base' struct %s is undefined" % (base_name))
-
-            if 0 == depth:
-                target.set_base_struct(self._types[base_name])
-
-            # apply bases recursively
-            self._apply_struct_base(target, raw_base, depth+1)
-
-            # add all inherited members
-            for mem in raw_base.members:
-                t = self._resolve_type(mem.type)
-                target.add_member(StructMember(mem, t))
-
-    def _add_struct_members(self, p):
-        struct = self._types[p.name]
-
-        # make sure all base structs are in place
-        self._apply_struct_base(struct, p)
-
-        # add all regular members
-        for mem in p.members:
-            t = self._resolve_type(mem.type)
-            struct.add_member(StructMember(mem, t))
-
-    def _check_struct(self, s):
-        self._tstack.append(s)
+        # Check that base is only given once.
+        if len(opts) > 1:
+            raise TypeSystemException(loc, "'base' can only be specified once")
+
+        opt = opts[0]
+        if len(opt.pos_params) != 1:
+            raise TypeSystemException(loc,
+                    "'base' option must have a single "\
+                    "positional parameter, the base struct")
+
+        base_name = opt.pos_params[0]
+        raw_base = self._raw_types.get(base_name)
+        if raw_base is None:
+            raise TypeSystemException(loc, "'base' struct %s is undefined" % (base_name))
+        return raw_base
+
+    def _add_struct_members(self, p, done=None):
+        # Bases must be complete before the structs deriving from them, so
+        # walk up to the first finished base and then fill in downwards.
+        # Each struct resolves only its own members and shares the member
+        # objects of its base. Appends the structs it starts on to done,
+        # before resolving their members, and returns done.
+        chain, in_chain = [], set()
+        while p is not None and p.name not in self._members_done:
+            if p.name in in_chain:
+                raise TypeSystemException(p.location, "struct %s is its own base" % (p.name))
+            raw_base = self._raw_base(p)
+            chain.append((p, raw_base))
+            in_chain.add(p.name)
+            p = raw_base
+
+        if done is None:
+            done = []
+        resolve = self._resolve_type
+        for p, raw_base in reversed(chain):
+            self._members_done.add(p.name)
+            struct = self._types[p.name]
+            done.append(struct)
+            if p.name in self._reused:
+                continue
+            if raw_base is not None:
+                base = self._types[raw_base.name]
+                struct.set_base_struct(base)
+                struct.inherit_members(base)
+
+            for mem in p.members:
+                t = resolve(mem.type)
+                struct.add_member(StructMember(mem.name, t, mem.options, mem.location))
+        return done
+
+    def _struct_edges(self, s):
+        """Return ([(struct, member)] embedded by value, [struct] pointed to,
+        has pointer members) for the direct members of s"""
+        value_deps, pointer_deps, has_pointers = [], [], False
         for mem in s.members:
             t = mem.mtype
+            # drop all array types to get to Foo in e.g. Foo[2, 3]
+            while isinstance(t, ArrayType):
+                t = t.base_type
             if isinstance(t, StructType):
-                if t in self._tstack:
-                    raise TypeSystemException(mem.location, "recursive structure not allowed")
-                self._check_struct(t)
-        self._tstack.pop()
-
-    def _check_structs(self):
-        self._tstack = []
-        for s in self._structs:
-            self._check_struct(s)
-        del self._tstack
-
-def compile_types(raw_data):
-    return TypeSystem(raw_data)
+                value_deps.append((t, mem))
+            elif isinstance(t, PointerType):
+                has_pointers = True
+                while isinstance(t, (PointerType, ArrayType)):
+                    t = t.base_type
+                if isinstance(t, StructType) and t not in pointer_deps:
+                    pointer_deps.append(t)
+        return value_deps, pointer_deps, has_pointers
+
+    def _analyze_structs(self, structs=None):
+        """Check for recursive structs and compute the by-value dependency
+        order and pointer flags, all in one depth-first pass, then group the
+        structs for reachable_structs() in a second one.
+
+        Without structs everything is analysed afresh. Otherwise only the
+        given structs are added to the results; everything they embed by
+        value or point to must be among them or analysed already."""
+        if structs is None:
+            structs = self._structs
+            edges, order, has_pointers = {}, [], {}
+            self._component, self._components, self._reachable = {}, [], {}
+        else:
+            edges, order, has_pointers = self._struct_edges_map, self._struct_order, self._has_pointers
+
+        for s in structs:
+            edges[s] = self._struct_edges(s)
+
+        on_stack = set()
+        for root in structs:
+            if root in has_pointers:
+                continue
+            on_stack.add(root)
+            stack = [(root, iter(edges[root][0]))]
+            while stack:
+                s, deps = stack[-1]
+                for t, mem in deps:
+                    if t in on_stack:
+                        raise TypeSystemException(mem.location, "recursive structure not allowed")
+                    if t not in has_pointers:
+                        on_stack.add(t)
+                        stack.append((t, iter(edges[t][0])))
+                        break
+                else:
+                    stack.pop()
+                    on_stack.discard(s)
+                    value_deps = edges[s][0]
+                    has_pointers[s] = edges[s][2] or any(has_pointers[t] for t, mem in value_deps)
+                    order.append(s)
+
+        self._struct_edges_map = edges
+        self._struct_order = order
+        self._has_pointers = has_pointers
+        self._find_components(structs)
+        self._index = None
+
+    def _find_components(self, structs):
+        # Tarjan's algorithm over by-value and pointer edges, iteratively.
+        # Components are numbered as they complete, so every component
+        # comes after all components it reaches.
+        edges, component, components = self._struct_edges_map, self._component, self._components
+        def successors(s):
+            value_deps, pointer_deps, has_pointers = edges[s]
+            return [t for t, mem in value_deps] + pointer_deps
+
+        index, low, stack, on_stack = {}, {}, [], set()
+        for root in structs:
+            if root in component or root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(successors(root)))]
+            while work:
+                s, succ = work[-1]
+                for t in succ:
+                    if t in component:
+                        continue
+                    if t not in index:
+                        index[t] = low[t] = len(index)
+                        stack.append(t)
+                        on_stack.add(t)
+                        work.append((t, iter(successors(t))))
+                        break
+                    if t in on_stack:
+                        low[s] = min(low[s], index[t])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[s])
+                    if low[s] != index[s]:
+                        continue
+                    members = []
+                    while True:
+                        t = stack.pop()
+                        on_stack.discard(t)
+                        members.append(t)
+                        if t is s:
+                            break
+                    number = len(components)
+                    for t in members:
+                        component[t] = number
+                    targets = set()
+                    for t in members:
+                        targets.update(successors(t))
+                    cyclic = len(members) > 1 or s in targets
+                    succ_components = set(component[t] for t in targets)
+                    succ_components.discard(number)
+                    components.append((members, sorted(succ_components), cyclic))
+
+    def struct_order(self):
+        """All structs, each one after every struct it embeds by value"""
+        self._resolve_all()
+        return self._struct_order
+
+    def value_dependencies(self, s):
+        """Structs embedded by value (directly or in arrays) in s"""
+        self._resolve_pending(s)
+        return [t for t, mem in self._struct_edges_map[s][0]]
+
+    def pointer_dependencies(self, s):
+        """Structs that members of s point to directly"""
+        self._resolve_pending(s)
+        return self._struct_edges_map[s][1]
+
+    def has_pointers(self, s):
+        """True if s or anything it embeds by value contains a pointer"""
+        self._resolve_pending(s)
+        return self._has_pointers[s]
+
+    def reachable_structs(self, s):
+        """All structs a value of s can lead to, by value or through pointers.
+        s itself is included only if it can reach itself through a pointer."""
+        self._resolve_pending(s)
+        reachable = self._reachable
+        number = self._component[s]
+        result = reachable.get(number)
+        if result is not None:
+            return result
+
+        # Structs in one component reach the same structs, so sets are kept
+        # per component and built from those of the components they reach,
+        # on first use; building them all up front takes memory quadratic
+        # in the length of chains of structs.
+        components = self._components
+        todo, work = set([number]), [number]
+        while work:
+            for c in components[work.pop()][1]:
+                if c not in todo and c not in reachable:
+                    todo.add(c)
+                    work.append(c)
+        for c in sorted(todo):
+            members, succ_components, cyclic = components[c]
+            result = set(members) if cyclic else set()
+            for d in succ_components:
+                result.update(components[d][0])
+                result.update(reachable[d])
+            reachable[c] = frozenset(result)
+        return reachable[number]
+
+    def _query_index(self):
+        # Built on first use and dropped whenever types are added or the
+        # structs are analysed again.
+        self._resolve_all()
+        index = self._index
+        if index is None:
+            index = self._index = _TypeIndex(self)
+        return index
+
+    def referencing_structs(self, t):
+        """Structs with a member whose type mentions t, by value, in an array
+        or through a pointer; in declaration order"""
+        return self._query_index().referenced_by.get(t, ())
+
+    def derived_structs(self, s):
+        """All structs deriving from s, directly or through other bases. A
+        pointer to s can point to s and to any of these."""
+        return self._query_index().derived(s)
+
+    def pointer_structs(self):
+        """All structs for which has_pointers() is true, in declaration order"""
+        return self._query_index().pointer_structs
+
+class _TypeIndex(object):
+    def __init__(self, tsys):
+        referenced_by = {}
+        children = {}
+        for s in tsys._structs:
+            seen = set()
+            for mem in s.members:
+                t = mem.mtype
+                while True:
+                    if t not in seen:
+                        seen.add(t)
+                        referenced_by.setdefault(t, []).append(s)
+                    if not isinstance(t, (PointerType, ArrayType)):
+                        break
+                    t = t.base_type
+            if s.base_type is not None:
+                children.setdefault(s.base_type, []).append(s)
+
+        self.referenced_by = dict((t, tuple(l)) for t, l in referenced_by.iteritems())
+        self.pointer_structs = tuple(s for s in tsys._structs if tsys.has_pointers(s))
+        self._children = children
+        self._derived = {}
+
+    def derived(self, s):
+        result = self._derived.get(s)
+        if result is None:
+            found = []
+            work = list(reversed(self._children.get(s, ())))
+            while work:
+                t = work.pop()
+                found.append(t)
+                work.extend(reversed(self._children.get(t, ())))
+            result = self._derived[s] = tuple(found)
+        return result
+
+def compile_types(raw_data, lazy=False):
+    return TypeSystem(raw_data, lazy=lazy)
 
 
@@ -2,5 +2,9 @@
 from Parser import parse_file, parse_string, ParseError
 from Typesys import compile_types
 from TargetMachine import TargetMachine
-from ClassGen import generate_classes
+from ClassGen import generate_classes, lazy_classes
 from Layout import layout
+from CTypesGen import generate_ctypes_classes, validate_ctypes_layout
+from Schema import FrozenSchema
+from Cache import compile_file
+from Session import SchemaSession
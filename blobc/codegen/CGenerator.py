@@ -3,6 +3,198 @@ import blobc.Typesys
 from . import GeneratorBase, GeneratorException
 import md5
 
+# Helper functions in generated headers are static inline, in any dialect
+_inline_decl = '''#ifndef BLOBC_INLINE
+#if defined(_MSC_VER)
+#define BLOBC_INLINE static __inline
+#elif defined(__GNUC__)
+#define BLOBC_INLINE static __inline__
+#elif defined(__STDC_VERSION__) && __STDC_VERSION__ >= 199901L
+#define BLOBC_INLINE static inline
+#else
+#define BLOBC_INLINE static
+#endif
+#endif
+'''
+
+# Declarations shared by all headers generated with type_descriptors, for
+# tools that walk blobs generically. Struct members can be looked up by name
+# through an open addressing table of member index + 1 (0 marks an empty
+# slot), hashed with 32-bit FNV-1a.
+_descriptor_decls = '''#ifndef BLOBC_TYPE_DESCRIPTORS
+#define BLOBC_TYPE_DESCRIPTORS
+
+#include <string.h>
+
+enum {
+	BCT_VOID,
+	BCT_STRUCT,
+	BCT_PRIMITIVE,
+	BCT_ENUM,
+	BCT_POINTER,
+	BCT_CSTRING,
+	BCT_ARRAY
+};
+
+enum {
+	BCT_NONE,
+	BCT_UNSIGNED,
+	BCT_SIGNED,
+	BCT_FLOAT,
+	BCT_CHAR
+};
+
+typedef struct bct_member_tag bct_member_t;
+
+typedef struct bct_typenode_tag {
+	uint8_t metatype;
+	uint8_t primitive_class;
+	uint8_t primitive_size; /* in blobs */
+	uint32_t native_size;
+	uint32_t native_align;
+	uint32_t count; /* members of a struct, dimension of an array */
+	const bct_member_t *members;
+	const struct bct_typenode_tag *subtype; /* pointee, element or base struct */
+	const char *name;
+	const uint32_t *member_hash;
+	uint32_t member_hash_size; /* a power of two */
+} bct_typenode_t;
+
+struct bct_member_tag {
+	const bct_typenode_t *type;
+	uint32_t native_offset;
+	uint32_t name_hash;
+	const char *name;
+};
+
+BLOBC_INLINE uint32_t bct_hash_name(const char *name)
+{
+	uint32_t h = 2166136261u;
+	while (*name)
+		h = (h ^ (uint8_t) *name++) * 16777619u;
+	return h;
+}
+
+BLOBC_INLINE const bct_member_t *bct_find_member(const bct_typenode_t *type, const char *name)
+{
+	uint32_t h, i, mask, slot;
+	if (type->member_hash_size == 0)
+		return NULL;
+	h = bct_hash_name(name);
+	mask = type->member_hash_size - 1;
+	for (i = h & mask; (slot = type->member_hash[i]) != 0; i = (i + 1) & mask) {
+		const bct_member_t *m = &type->members[slot - 1];
+		if (m->name_hash == h && 0 == strcmp(m->name, name))
+			return m;
+	}
+	return NULL;
+}
+
+#endif
+'''
+
+# Pointer fixup for blobs loaded into memory, shared by all headers generated
+# with fixup_routine. Layout.layout() returns the blob with every pointer
+# stored as an offset from the start of the blob, and a relocation table of
+# 32-bit offsets to those pointers; both in the target's byte order, which
+# must be this machine's. Pointers aren't necessarily aligned in the blob,
+# so they are accessed through memcpy, which compilers turn into plain
+# loads and stores where alignment doesn't matter.
+_fixup_decls = '''#ifndef BLOBC_FIXUP
+#define BLOBC_FIXUP
+
+#include <stddef.h>
+#include <string.h>
+
+#if defined(_MSC_VER) || defined(__GNUC__)
+#define BLOBC_RESTRICT __restrict
+#elif defined(__STDC_VERSION__) && __STDC_VERSION__ >= 199901L
+#define BLOBC_RESTRICT restrict
+#else
+#define BLOBC_RESTRICT
+#endif
+
+#define BLOBC_FIXUP_ONE(type, index) \\
+	do { \\
+		uint32_t off_; \\
+		type ptr_; \\
+		memcpy(&off_, r + 4 * (index), 4); \\
+		memcpy(&ptr_, base + off_, sizeof(type)); \\
+		ptr_ += delta; \\
+		memcpy(base + off_, &ptr_, sizeof(type)); \\
+	} while (0)
+
+#define BLOBC_FIXUP_LOOP(type) \\
+	size_t i; \\
+	for (i = 0; i + 4 <= count; i += 4) { \\
+		BLOBC_FIXUP_ONE(type, i); \\
+		BLOBC_FIXUP_ONE(type, i + 1); \\
+		BLOBC_FIXUP_ONE(type, i + 2); \\
+		BLOBC_FIXUP_ONE(type, i + 3); \\
+	} \\
+	for (; i < count; ++i) \\
+		BLOBC_FIXUP_ONE(type, i)
+
+/* Fix up a blob laid out for 4-byte pointers */
+BLOBC_INLINE void blobc_fixup32(void *blob, const void *relocs, size_t count)
+{
+	unsigned char *BLOBC_RESTRICT base = (unsigned char *) blob;
+	const unsigned char *BLOBC_RESTRICT r = (const unsigned char *) relocs;
+	uint32_t delta = (uint32_t) (uintptr_t) blob;
+	BLOBC_FIXUP_LOOP(uint32_t);
+}
+
+/* Fix up a blob laid out for 8-byte pointers */
+BLOBC_INLINE void blobc_fixup64(void *blob, const void *relocs, size_t count)
+{
+	unsigned char *BLOBC_RESTRICT base = (unsigned char *) blob;
+	const unsigned char *BLOBC_RESTRICT r = (const unsigned char *) relocs;
+	uint64_t delta = (uint64_t) (uintptr_t) blob;
+	BLOBC_FIXUP_LOOP(uint64_t);
+}
+
+/* Turn the count offsets in a blob laid out for this machine into pointers */
+BLOBC_INLINE void blobc_fixup(void *blob, const void *relocs, size_t count)
+{
+	if (sizeof(void *) == 8)
+		blobc_fixup64(blob, relocs, count);
+	else
+		blobc_fixup32(blob, relocs, count);
+}
+
+#endif
+'''
+
+def fnv1a(name):
+    """32-bit FNV-1a hash of a name, as computed by bct_hash_name()"""
+    h = 2166136261
+    for c in name:
+        h = ((h ^ ord(c)) * 16777619) & 0xffffffff
+    return h
+
+def member_hash_table(names):
+    """Open addressing table of index + 1 for each name, as searched by
+    bct_find_member()"""
+    if not names:
+        return []
+    size = 1
+    while size < 2 * len(names):
+        size *= 2
+    table = [0] * size
+    for index, name in enumerate(names):
+        i = fnv1a(name) & (size - 1)
+        while table[i]:
+            i = (i + 1) & (size - 1)
+        table[i] = index + 1
+    return table
+
+_primitive_classes = (
+    (blobc.Typesys.UnsignedIntType, 'BCT_UNSIGNED'),
+    (blobc.Typesys.SignedIntType, 'BCT_SIGNED'),
+    (blobc.Typesys.FloatingType, 'BCT_FLOAT'),
+    (blobc.Typesys.CharacterType, 'BCT_CHAR'),
+)
+
 class CGenerator(GeneratorBase):
     MNEMONIC = 'c'
 
@@ -25,7 +217,6 @@ class CGenerator(GeneratorBase):
         self._primitives = []
         self._structs = []
         self._constants = []
-        self._struct_order = {}
         self._struct_order_list = [] # in nested dependency order, least complex first
         self._indent = '\t'
         self._obrace = ' {\n'
@@ -35,6 +226,9 @@ class CGenerator(GeneratorBase):
         self._print_guard = True
         self._print_inttypes = True
         self._print_includes = True
+        self._type_descriptors = False
+        self._fixup_routine = False
+        self._descriptor_names = {}
         m = md5.new()
         m.update(self.filename)
         self.guard = 'BLOBC_%s' % (m.hexdigest())
@@ -95,6 +289,14 @@ class CGenerator(GeneratorBase):
     def configure_no_inttypes(self, loc):
         self._print_inttypes = False
 
+    def configure_type_descriptors(self, loc):
+        if not self.aux_fh:
+            raise GeneratorException('needs an auxiliary output file for the tables')
+        self._type_descriptors = True
+
+    def configure_fixup_routine(self, loc):
+        self._fixup_routine = True
+
     def configure_brace_style(self, loc, style):
         if style == 'k&r':
             self._obrace = ' {\n'
@@ -162,20 +364,18 @@ class CGenerator(GeneratorBase):
         if not t.location.is_import:
             self._structs.append(t)
 
-    def _visit_struct(self, t):
-        if self._struct_order.has_key(t):
-            return
-        for m in t.members:
-            ptype = m.mtype
-            # drop all array types to get to Foo in e.g. Foo[2, 3]
-            # note that this applies only to by-value arrays
-            while isinstance(ptype, blobc.Typesys.ArrayType):
-                ptype = ptype.base_type
-            if isinstance(ptype, blobc.Typesys.StructType):
-                self._visit_struct(ptype)
-        if not self._struct_order.has_key(t):
-            self._struct_order[t] = True
-            self._struct_order_list.append(t)
+    def _order_structs(self):
+        # our structs and everything they embed by value, in the type
+        # system's dependency order so later structs can embed earlier ones
+        tsys = self.type_system
+        needed = set(self._structs)
+        work = list(self._structs)
+        while work:
+            for dep in tsys.value_dependencies(work.pop()):
+                if dep not in needed:
+                    needed.add(dep)
+                    work.append(dep)
+        self._struct_order_list = [t for t in tsys.struct_order() if t in needed]
 
     def _separator(self, tag):
         if self._print_separators:
@@ -272,10 +472,122 @@ class CGenerator(GeneratorBase):
                 self.fh.write(';\n');
             self.fh.write('} %s;\n' % (t.name))
 
-    def finish(self):
-        # Sort structs in complexity order so later structs can embed eariler structs.
+    def _emit_inline_decl(self):
+        if self._type_descriptors or self._fixup_routine:
+            self.fh.write('\n')
+            self.fh.write(_inline_decl)
+
+    def _emit_fixup_routine(self):
+        if not self._fixup_routine:
+            return
+        self._separator('pointer fixup')
+        self.fh.write(_fixup_decls.replace('\t', self._indent))
+
+    def _emit_descriptor_decls(self):
+        if not self._type_descriptors:
+            return
+        self._separator('type descriptors')
+        self.fh.write(_descriptor_decls.replace('\t', self._indent))
+        if self._structs:
+            self.fh.write('\n')
+        for t in self._structs:
+            self.fh.write('extern const bct_typenode_t bct_descriptor_%s;\n' % (t.name))
+
+    def _descriptor_name(self, t):
+        if isinstance(t, blobc.Typesys.StructType):
+            return 'bct_descriptor_%s' % (t.name)
+        return self._descriptor_names[t]
+
+    def _collect_descriptors(self, t, out):
+        # element types in the order they must be defined, subtypes first;
+        # struct descriptors are all declared in headers
+        if isinstance(t, blobc.Typesys.StructType) or t in self._descriptor_names:
+            return
+        if isinstance(t, (blobc.Typesys.PointerType, blobc.Typesys.ArrayType)):
+            self._collect_descriptors(t.base_type, out)
+        self._descriptor_names[t] = 'bct_type_%d_' % (len(out))
+        out.append(t)
+
+    def _blob_type_name(self, t):
+        if isinstance(t, blobc.Typesys.ArrayType):
+            return '%s[%d]' % (self._blob_type_name(t.base_type), t.dim)
+        elif isinstance(t, blobc.Typesys.PointerType):
+            return self._blob_type_name(t.base_type) + '*'
+        elif t is blobc.Typesys.VoidType.instance:
+            return 'void'
+        else:
+            return t.name
+
+    def _descriptor(self, t):
+        # (metatype, class, blob size, native size, native align, count, subtype)
+        Typesys = blobc.Typesys
+        if isinstance(t, Typesys.PrimitiveType):
+            for cls, pclass in _primitive_classes:
+                if isinstance(t, cls):
+                    break
+            ctype = self.ctypename(t)
+            return ('BCT_PRIMITIVE', pclass, t.size, 'sizeof(%s)' % (ctype),
+                    'ALIGNOF(%s)' % (ctype), 0, 'NULL')
+        elif isinstance(t, Typesys.EnumType):
+            return ('BCT_ENUM', 'BCT_UNSIGNED', 4, 'sizeof(%s)' % (t.name),
+                    'ALIGNOF(%s)' % (t.name), 0, 'NULL')
+        elif t is Typesys.VoidType.instance:
+            return ('BCT_VOID', 'BCT_NONE', 0, 0, 0, 0, 'NULL')
+
+        ctype = self.vardef(t, '')
+        subtype = '&' + self._descriptor_name(t.base_type)
+        if isinstance(t, Typesys.ArrayType):
+            # as in the type system, u16[2,3] is 3 of u16[2] (declared [2][3] in C)
+            metatype, count = 'BCT_ARRAY', t.dim
+        elif isinstance(t, Typesys.CStringType):
+            metatype, count = 'BCT_CSTRING', 0
+        else:
+            metatype, count = 'BCT_POINTER', 0
+        return (metatype, 'BCT_NONE', 0, 'sizeof(%s)' % (ctype), 'ALIGNOF(%s)' % (ctype),
+                count, subtype)
+
+    def _write_descriptor(self, decl, name, desc, members='NULL', hash_table='NULL', hash_size=0):
+        fields = list(desc[:6]) + [members, desc[6], '"%s"' % (name), hash_table, hash_size]
+        self.aux_fh.write('%s = { %s };\n' % (decl, ', '.join(str(f) for f in fields)))
+
+    def _emit_descriptor_tables(self):
+        aux = self.aux_fh
+        aux.write('\n#include <stddef.h>\n\n')
+
+        elements = []
         for t in self._structs:
-            self._visit_struct(t)
+            for m in t.members:
+                self._collect_descriptors(m.mtype, elements)
+
+        for t in elements:
+            self._write_descriptor('static const bct_typenode_t %s' % (self._descriptor_name(t)),
+                                   self._blob_type_name(t), self._descriptor(t))
+
+        for t in self._structs:
+            name = t.name
+            members, hash_table = 'NULL', 'NULL'
+            table = member_hash_table([m.mname for m in t.members])
+            if t.members:
+                members = 'bct_members_%s_' % (name)
+                aux.write('static const bct_member_t %s[] = {\n' % (members))
+                for m in t.members:
+                    aux.write('%s{ &%s, offsetof(%s, %s), %du, "%s" },\n' % (
+                        self._indent, self._descriptor_name(m.mtype), name, m.mname,
+                        fnv1a(m.mname), m.mname))
+                aux.write('};\n\n')
+                hash_table = 'bct_member_hash_%s_' % (name)
+                aux.write('static const uint32_t %s[] = { %s };\n' % (
+                    hash_table, ', '.join(str(i) for i in table)))
+
+            base = '&' + self._descriptor_name(t.base_type) if t.base_type is not None else 'NULL'
+            aux.write('\n')
+            desc = ('BCT_STRUCT', 'BCT_NONE', 0, 'sizeof(%s)' % (name), 'ALIGNOF(%s)' % (name),
+                    len(t.members), base)
+            self._write_descriptor('const bct_typenode_t bct_descriptor_%s' % (name), name, desc,
+                                   members, hash_table, len(table))
+
+    def finish(self):
+        self._order_structs()
 
         self.fh.write('\n')
 
@@ -286,6 +598,9 @@ class CGenerator(GeneratorBase):
         self._emit_user_literals()
         self._emit_enums()
         self._emit_structs()
+        self._emit_inline_decl()
+        self._emit_fixup_routine()
+        self._emit_descriptor_decls()
 
         if self._print_guard:
             self.fh.write('\n#endif\n')
@@ -305,6 +620,9 @@ class CGenerator(GeneratorBase):
                     (name, size, name, align))
             aux.write('-1];\n')
 
+        if self._type_descriptors:
+            self._emit_descriptor_tables()
+
     def visit_constant(self, name, value, is_import):
         if not is_import:
             self._constants.append((name, value))
@@ -6,6 +6,7 @@ class GeneratorException(Exception):
 class GeneratorBase(object):
     def __init__(self):
         self._curr_option = None
+        self.type_system = None
 
     def bad_option(self, msg):
         o = self._curr_option
@@ -35,6 +36,7 @@ class GeneratorBase(object):
             for option in line.options:
                 self.apply_option(option)
 
+        self.type_system = type_system
         self.start()
 
         imports = []
@@ -52,22 +54,31 @@ class GeneratorBase(object):
             for name, value, loc in type_system.iterconsts():
                 visit_loc(loc)
         else:
-            # override import flag to pretend everything was local
+            # override import flag to pretend everything was local; the
+            # type system may be reused afterwards, so restore it when done.
+            # Locations are shared by everything on a line, so each type gets
+            # a local copy of its own rather than having the shared one changed
+            overridden = [(t, t.location) for t in type_system.itertypes() if t.location.is_import]
+            for t, loc in overridden:
+                t.location = blobc.ParseTree.SourceLocation(loc.filename, loc.lineno, False)
+
+        try:
             for t in type_system.itertypes():
-                t.location.is_import = False
-        
-        for t in type_system.itertypes():
-            if isinstance(t, blobc.Typesys.StructType):
-                self.visit_struct(t)
-            elif isinstance(t, blobc.Typesys.EnumType):
-                self.visit_enum(t)
-            elif isinstance(t, blobc.Typesys.PrimitiveType):
-                self.visit_primitive(t)
-
-        for name, value, location in type_system.iterconsts():
-            self.visit_constant(name, value, location.is_import)
-
-        self.finish()
+                if isinstance(t, blobc.Typesys.StructType):
+                    self.visit_struct(t)
+                elif isinstance(t, blobc.Typesys.EnumType):
+                    self.visit_enum(t)
+                elif isinstance(t, blobc.Typesys.PrimitiveType):
+                    self.visit_primitive(t)
+
+            for name, value, location in type_system.iterconsts():
+                self.visit_constant(name, value, location.is_import)
+
+            self.finish()
+        finally:
+            if merge_imports:
+                for t, loc in overridden:
+                    t.location = loc
 
     def start(self):
         pass
@@ -78,16 +78,17 @@ class M68kGenerator(GeneratorBase):
         if t.location.is_import:
             return 
         sname = t.name
-        sz, align = self._targmach.size_align(t)
+        layout = self._targmach.struct_layout(t)
+        sz, align = layout.size, layout.align
         if self._print_comments:
             self.fh.write('\n; struct: %s (size: %d, align: %d)\n' % (t.name, sz, align))
-        for m in t.members:
+        for m, offset in zip(t.members, layout.offsets):
             name_opt = m.get_options('m68k_name')
             if len(name_opt) > 0:
                 name = str(name_opt[0].pos_params[0])
             else:
                 name = sname + '_' + m.mname
-            self.print_equ(name, m.offset)
+            self.print_equ(name, offset)
         self.print_equ(sname + self._sizeof_suffix, sz)
         self.print_equ(sname + self._alignof_suffix, align)
 
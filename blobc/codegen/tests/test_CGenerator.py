@@ -1,9 +1,16 @@
+import os
+import sys
+import shutil
+import struct
+import tempfile
 import unittest
+import subprocess
 import blobc
 from blobc.codegen.tests.util import *
 from blobc.Typesys import TypeSystemException
 from blobc.codegen import CGenerator
 from cStringIO import StringIO
+from distutils.spawn import find_executable
 
 stock_primitives = '''
     defprimitive u8 uint 1; defprimitive u16 uint 2; defprimitive u32 uint 4;
@@ -373,3 +380,281 @@ class TestCodeGen_C(unittest.TestCase):
     def test_no_wide_char_yet(self):
         with self.assertRaises(blobc.codegen.GeneratorException):
             self._compile('defprimitive fisk character 2;', no_primitives=True, inttypes=True)
+
+    def test_fnv1a(self):
+        from blobc.codegen.CGenerator import fnv1a
+        self.assertEqual(fnv1a(''), 0x811c9dc5)
+        self.assertEqual(fnv1a('a'), 0xe40c292c)
+        self.assertEqual(fnv1a('foobar'), 0xbf9cf968)
+
+    def test_member_hash_table(self):
+        from blobc.codegen.CGenerator import fnv1a, member_hash_table
+        names = ['a%d' % i for i in xrange(20)]
+        table = member_hash_table(names)
+        self.assertEqual(len(table), 64)
+        self.assertEqual(sorted(x for x in table if x), range(1, 21))
+        # every name is found by probing from its hash
+        for index, name in enumerate(names):
+            i = fnv1a(name) & 63
+            while table[i] != index + 1:
+                self.assertNotEqual(table[i], 0)
+                i = (i + 1) & 63
+        self.assertEqual(member_hash_table([]), [])
+
+    def test_type_descriptors(self):
+        d = type(self)._driver.run('''
+            generator c : type_descriptors;
+            struct Foo { u32 Bar; Foo* Next; u8[3] Baz; }
+            struct Empty { }
+        ''', {})
+        self.assertTrue('typedef struct bct_typenode_tag {' in d.output)
+        self.assertTrue('extern const bct_typenode_t bct_descriptor_Foo;' in d.output)
+        self.assertTrue('extern const bct_typenode_t bct_descriptor_Empty;' in d.output)
+        aux = d.aux_output
+        self.assertTrue('static const bct_typenode_t bct_type_0_ = { BCT_PRIMITIVE, BCT_UNSIGNED, 4, '
+                        'sizeof(u32), ALIGNOF(u32), 0, NULL, NULL, "u32", NULL, 0 };' in aux)
+        self.assertTrue('{ BCT_POINTER, BCT_NONE, 0, sizeof(struct Foo_TAG *), ALIGNOF(struct Foo_TAG *), '
+                        '0, NULL, &bct_descriptor_Foo, "Foo*", NULL, 0 };' in aux)
+        self.assertTrue('{ BCT_ARRAY, BCT_NONE, 0, sizeof(u8[3]), ALIGNOF(u8[3]), 3, NULL, &bct_type_2_, '
+                        '"u8[3]", NULL, 0 };' in aux)
+        self.assertTrue('{ &bct_type_0_, offsetof(Foo, Bar), 3686563258u, "Bar" },' in aux)
+        self.assertTrue('const bct_typenode_t bct_descriptor_Foo = { BCT_STRUCT, BCT_NONE, 0, sizeof(Foo), '
+                        'ALIGNOF(Foo), 3, bct_members_Foo_, NULL, "Foo", bct_member_hash_Foo_, 8 };' in aux)
+        self.assertTrue('const bct_typenode_t bct_descriptor_Empty = { BCT_STRUCT, BCT_NONE, 0, sizeof(Empty), '
+                        'ALIGNOF(Empty), 0, NULL, NULL, "Empty", NULL, 0 };' in aux)
+
+    def test_type_descriptors_need_aux(self):
+        pt = blobc.parse_string(stock_primitives + 'generator c : type_descriptors;')
+        gen = CGenerator(StringIO(), 'input.blob', None, 'output.h')
+        with self.assertRaises(blobc.ParseError):
+            gen.generate_code(pt, blobc.compile_types(pt))
+
+def reference_fixup(blob, relocs, base, targmach):
+    """Add base to every pointer in a blob, as blobc_fixup() does"""
+    pfx = '>' if targmach.big_endian else '<'
+    fmt = pfx + ('I' if targmach.pointer_size == 4 else 'Q')
+    mask = (1 << (8 * targmach.pointer_size)) - 1
+    data = bytearray(blob)
+    for i in xrange(0, len(relocs), 4):
+        off, = struct.unpack_from(pfx + 'I', relocs, i)
+        ptr, = struct.unpack_from(fmt, data, off)
+        struct.pack_into(fmt, data, off, (ptr + base) & mask)
+    return str(data)
+
+fixup_harness = r'''
+#include <stdio.h>
+#include <stdlib.h>
+#include "fixup.h"
+
+static size_t slurp(const char *fn, unsigned char **data)
+{
+    FILE *f = fopen(fn, "rb");
+    size_t size;
+    fseek(f, 0, SEEK_END);
+    size = (size_t) ftell(f);
+    fseek(f, 0, SEEK_SET);
+    *data = (unsigned char *) malloc(size + 1);
+    size = fread(*data, 1, size, f);
+    fclose(f);
+    return size;
+}
+
+int main(int argc, char *argv[])
+{
+    unsigned char *blob, *relocs;
+    size_t size = slurp(argv[1], &blob);
+    size_t count = slurp(argv[2], &relocs) / 4;
+    FILE *f;
+    if (argv[3][0] == '4')
+        blobc_fixup32(blob, relocs, count);
+    else
+        blobc_fixup64(blob, relocs, count);
+    f = fopen(argv[4], "wb");
+    fwrite(blob, 1, size, f);
+    fclose(f);
+    printf("%llu\n", (unsigned long long) (uintptr_t) blob);
+    return 0;
+}
+'''
+
+class TestFixupRoutine(unittest.TestCase):
+    src = stock_primitives + '''
+        generator c : fixup_routine;
+        struct Node { Node* Next; Node* Leaf; u32 Tag; u32 Value; }
+    '''
+
+    def setUp(self):
+        self.cc = find_executable('cc')
+        if self.cc is None:
+            self.skipTest('no C compiler')
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, fn):
+        return os.path.join(self.tmpdir, fn)
+
+    def _write(self, fn, data):
+        with open(self._path(fn), 'wb') as f:
+            f.write(data)
+
+    def _build(self, std):
+        pt = blobc.parse_string(self.src)
+        out_fh = StringIO()
+        CGenerator(out_fh, 'fixup.blob', None, None).generate_code(pt, blobc.compile_types(pt))
+        self._write('fixup.h', out_fh.getvalue())
+        self._write('harness.c', fixup_harness)
+        exe = self._path('harness')
+        subprocess.check_call([self.cc, '-std=' + std, '-O2', '-o', exe, self._path('harness.c')])
+        return exe
+
+    def _blob(self, targmach):
+        classes = {}
+        blobc.generate_classes(blobc.compile_types(blobc.parse_string(self.src)), classes)
+        Node = classes['Node']
+        head = None
+        for i in range(7):
+            head = Node(Tag=i, Next=head, Value=i * 1000, Leaf=Node(Tag=100 + i, Value=i))
+        return blobc.layout(head, targmach)
+
+    def _check(self, std):
+        exe = self._build(std)
+        endian = 'little' if sys.byteorder == 'little' else 'big'
+        for pointer_size in (4, 8):
+            tm = blobc.TargetMachine(pointer_size=pointer_size, endian=endian)
+            blob, relocs = self._blob(tm)
+            # more than one unrolled iteration, with a remainder
+            self.assertTrue(len(relocs) / 4 > 4 and len(relocs) / 4 % 4 != 0)
+            self._write('blob', blob)
+            self._write('relocs', relocs)
+            base = int(subprocess.check_output([exe, self._path('blob'), self._path('relocs'),
+                                                str(pointer_size), self._path('fixed')]))
+            with open(self._path('fixed'), 'rb') as f:
+                fixed = f.read()
+            self.assertEqual(fixed, reference_fixup(blob, relocs, base, tm))
+            self.assertNotEqual(fixed, blob)
+
+    def test_c89(self):
+        self._check('c89')
+
+    def test_c99(self):
+        self._check('c99')
+
+descriptor_harness = r'''
+#include <stdio.h>
+#include "descriptors.h"
+
+static void dump_type(const char *what, const bct_typenode_t *t)
+{
+    printf("%s %s %d %u %u %u %s\n", what, t->name, t->metatype, (unsigned) t->native_size,
+           (unsigned) t->native_align, (unsigned) t->count, t->subtype ? t->subtype->name : "-");
+}
+
+static void dump_struct(const bct_typenode_t *t)
+{
+    uint32_t i;
+    dump_type("struct", t);
+    for (i = 0; i < t->count; ++i) {
+        const bct_member_t *m = bct_find_member(t, t->members[i].name);
+        if (m != &t->members[i])
+            printf("lookup failed %s\n", t->members[i].name);
+        printf("member %s %u\n", m->name, (unsigned) m->native_offset);
+        dump_type("type", m->type);
+        if (m->type->subtype)
+            dump_type("subtype", m->type->subtype);
+    }
+    if (bct_find_member(t, "nonesuch") != NULL)
+        printf("lookup failed nonesuch\n");
+}
+
+int main(void)
+{
+    dump_struct(&bct_descriptor_Inner);
+    dump_struct(&bct_descriptor_Outer);
+    return 0;
+}
+'''
+
+class TestTypeDescriptors(unittest.TestCase):
+    src = stock_primitives + '''
+        generator c : type_descriptors;
+        struct Inner { u8 Tag; u32 Value; }
+        struct Outer {
+            u8 Flag;
+            Inner Nested;
+            u16[3] Counts;
+            Inner[2] Pair;
+            Outer* Next;
+            u16[2,3] Grid;
+        }
+    '''
+
+    def setUp(self):
+        self.cc = find_executable('cc')
+        if self.cc is None:
+            self.skipTest('no C compiler')
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, fn):
+        return os.path.join(self.tmpdir, fn)
+
+    def _write(self, fn, data):
+        with open(self._path(fn), 'wb') as f:
+            f.write(data)
+
+    def _dump(self, pt, tsys):
+        """Compile the header, tables and descriptor_harness; parse what it prints"""
+        out_fh, aux_fh = StringIO(), StringIO()
+        CGenerator(out_fh, 'descriptors.blob', aux_fh, 'descriptors.h').generate_code(pt, tsys)
+        self._write('descriptors.h', out_fh.getvalue())
+        self._write('descriptors.c', aux_fh.getvalue())
+        self._write('harness.c', descriptor_harness)
+        exe = self._path('harness')
+        subprocess.check_call([self.cc, '-std=c89', '-Wall', '-o', exe,
+                               self._path('harness.c'), self._path('descriptors.c')])
+        structs = {}
+        for line in subprocess.check_output([exe]).splitlines():
+            words = line.split()
+            if words[0] == 'struct':
+                members = structs[words[1]] = {}
+            elif words[0] == 'member':
+                member = members[words[1]] = {'offset': int(words[2])}
+            elif words[0] in ('type', 'subtype'):
+                member[words[0]] = (words[1],) + tuple(int(w) for w in words[2:6]) + (words[6],)
+            else:
+                self.fail(line)
+        return structs, out_fh.getvalue()
+
+    def test_layout_matches_target_machine(self):
+        pt = blobc.parse_string(self.src)
+        tsys = blobc.compile_types(pt)
+        structs, header = self._dump(pt, tsys)
+        tm = blobc.TargetMachine(pointer_size=struct.calcsize('P'))
+        for name in ('Inner', 'Outer'):
+            t = tsys.lookup(name)
+            self.assertEqual(sorted(structs[name]), sorted(m.mname for m in t.members))
+            for m in t.members:
+                found = structs[name][m.mname]
+                self.assertEqual(found['offset'], tm.offsetof(t, m.mname))
+                self.assertEqual(found['type'][2:4], tm.size_align(m.mtype))
+        outer = structs['Outer']
+        self.assertEqual(outer['Nested']['type'][:2], ('Inner', 1))
+        self.assertEqual(outer['Pair']['type'][4:], (2, 'Inner'))
+        self.assertEqual(outer['Counts']['type'][4:], (3, 'u16'))
+
+    def test_multidimensional_array(self):
+        # u16[2,3] is three u16[2]; the C declaration puts the dimensions
+        # the other way round but occupies the same bytes
+        pt = blobc.parse_string(self.src)
+        tsys = blobc.compile_types(pt)
+        structs, header = self._dump(pt, tsys)
+        self.assertTrue('u16 Grid[2][3];' in header)
+        grid = structs['Outer']['Grid']
+        self.assertEqual(grid['type'], ('u16[2][3]', 6, 12, 2, 3, 'u16[2]'))
+        self.assertEqual(grid['subtype'], ('u16[2]', 6, 4, 2, 2, 'u16'))
+        self.assertEqual(tsys.lookup('Outer').members[-1].mtype.dim, 3)
+
@@ -1,6 +1,50 @@
-
 import unittest
+import blobc
 from blobc.codegen import GeneratorBase
+from blobc.codegen.tests.util import InMemoryImportHandler
+
+class RecordingGenerator(GeneratorBase):
+    MNEMONIC = 'recording'
+
+    def __init__(self):
+        GeneratorBase.__init__(self)
+        self.imports, self.structs, self.constants = [], [], []
+
+    def visit_import(self, fn):
+        self.imports.append(fn)
+
+    def visit_struct(self, t):
+        self.structs.append((t.name, t.location.is_import))
+
+    def visit_constant(self, name, value, is_import):
+        self.constants.append((name, is_import))
 
 class TestGeneratorBase(unittest.TestCase):
-    pass
+    files = {
+        'prims.blob': 'defprimitive u32 uint 4;\n',
+        # one line, so the struct and the constant share their location
+        'shared.blob': 'import "prims.blob" struct shared { u32 a; } iconst K = 1;\n',
+        'main.blob': 'import "shared.blob"\nstruct main { shared s; }\n',
+    }
+
+    def _compile(self):
+        pt = blobc.parse_file('main.blob', import_handler=InMemoryImportHandler(self.files))
+        return pt, blobc.compile_types(pt)
+
+    def test_merge_imports(self):
+        pt, tsys = self._compile()
+        shared = tsys.lookup('shared')
+        loc = shared.location
+        gen = RecordingGenerator()
+        gen.generate_code(pt, tsys, merge_imports=True)
+        self.assertEqual(gen.imports, [])
+        self.assertEqual(gen.structs, [('shared', False), ('main', False)])
+        # only the type is taken as local, not what shares its line
+        self.assertEqual(gen.constants, [('K', True)])
+        self.assertIs(shared.location, loc)
+        self.assertTrue(loc.is_import)
+
+        gen = RecordingGenerator()
+        gen.generate_code(pt, tsys)
+        self.assertEqual(gen.imports, ['prims.blob', 'shared.blob'])
+        self.assertEqual(gen.structs, [('shared', True), ('main', False)])
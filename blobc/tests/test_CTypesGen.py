@@ -0,0 +1,139 @@
+
+import blobc
+import ctypes
+import unittest
+
+from struct import pack
+
+class TestCTypesGen(unittest.TestCase):
+
+    def _setup(self, src, targmach):
+        pt = blobc.parse_string(src)
+        tsys = blobc.compile_types(pt)
+        classes = {}
+        blobc.generate_ctypes_classes(tsys, targmach, classes)
+        return classes
+
+    def test_padding(self):
+        tm = blobc.TargetMachine(endian='big', pointer_size=4)
+        c = self._setup("""
+            defprimitive ubyte uint 1;
+            defprimitive ulong uint 4;
+            struct foo {
+                ubyte a;
+                ulong b;
+                ubyte c;
+            }
+        """, tm)
+        cls = c['foo']
+        self.assertEqual(ctypes.sizeof(cls), 12)
+        self.assertEqual(cls.a.offset, 0)
+        self.assertEqual(cls.b.offset, 4)
+        self.assertEqual(cls.c.offset, 8)
+        data = cls(a=1, b=2, c=3)
+        self.assertEqual(data.native_bytes(), pack('>B3xIB3x', 1, 2, 3))
+
+    def test_little_endian(self):
+        tm = blobc.TargetMachine(endian='little', pointer_size=4)
+        c = self._setup("""
+            defprimitive u16 uint 2;
+            defprimitive s32 sint 4;
+            struct foo {
+                u16 a;
+                s32 b;
+            }
+        """, tm)
+        data = c['foo'](a=0x1234, b=-2)
+        self.assertEqual(data.native_bytes(), pack('<H2xi', 0x1234, -2))
+
+    def test_pointers_as_offsets(self):
+        src = """
+            defprimitive u32 uint 4;
+            struct foo {
+                u32 a;
+                u32* b;
+                u32 c;
+            }
+        """
+        c4 = self._setup(src, blobc.TargetMachine(pointer_size=4))
+        self.assertEqual(ctypes.sizeof(c4['foo']), 12)
+        self.assertEqual(c4['foo'].b.size, 4)
+
+        c8 = self._setup(src, blobc.TargetMachine(pointer_size=8, pointer_align=4))
+        self.assertEqual(ctypes.sizeof(c8['foo']), 16)
+        self.assertEqual(c8['foo'].b.size, 8)
+        self.assertEqual(c8['foo'].c.offset, 12)
+
+        c8a = self._setup(src, blobc.TargetMachine(pointer_size=8, pointer_align=8))
+        self.assertEqual(ctypes.sizeof(c8a['foo']), 24)
+        self.assertEqual(c8a['foo'].b.offset, 8)
+        self.assertEqual(c8a['foo'].c.offset, 16)
+
+    def test_nested_arrays(self):
+        tm = blobc.TargetMachine(endian='big', pointer_size=4)
+        c = self._setup("""
+            defprimitive ubyte uint 1;
+            defprimitive u16 uint 2;
+            enum meh { A, B }
+            struct inner {
+                u16 x;
+                ubyte y;
+            }
+            struct outer {
+                ubyte a;
+                inner[2] items;
+                meh e;
+            }
+        """, tm)
+        outer = c['outer']
+        self.assertEqual(ctypes.sizeof(outer), 16)
+        self.assertEqual(outer.items.offset, 2)
+        self.assertEqual(outer.e.offset, 12)
+        data = outer(a=9, e=1)
+        data.items[1].x = 0x102
+        self.assertEqual(data.native_bytes(),
+                pack('>BxHBxHBx2xI', 9, 0, 0, 0x102, 0, 1))
+
+    def test_matches_serializer(self):
+        src = """
+            defprimitive ubyte uint 1;
+            defprimitive u16 uint 2;
+            defprimitive f64 float 8;
+            struct foo {
+                u16 a;
+                ubyte[3] b;
+                f64 c;
+            }
+        """
+        tm = blobc.TargetMachine(endian='little', pointer_size=8)
+        pt = blobc.parse_string(src)
+        tsys = blobc.compile_types(pt)
+        classes, native = {}, {}
+        blobc.generate_classes(tsys, classes)
+        blobc.generate_ctypes_classes(tsys, tm, native)
+
+        blob, relocs = blobc.layout(classes['foo'](a=5, b=[1, 2, 3], c=0.5), tm)
+        data = native['foo'](a=5, c=0.5)
+        data.b[:] = [1, 2, 3]
+
+        # the serializer fills padding with 0xfd, the native buffer with zero
+        self.assertEqual(len(blob), len(data.native_bytes()))
+        self.assertEqual(blob.replace('\xfd', '\0'), data.native_bytes())
+
+    def test_validate(self):
+        tm = blobc.TargetMachine(pointer_size=4)
+        c = self._setup("""
+            defprimitive u32 uint 4;
+            struct foo {
+                u32 a;
+            }
+        """, tm)
+        blobc.validate_ctypes_layout(c['foo'])
+
+        class bad(ctypes.LittleEndianStructure, blobc.CTypesGen.NativeStructBase):
+            _fields_ = [('a', ctypes.c_uint16)]
+            srctype = c['foo'].srctype
+            targmach = tm
+
+        with self.assertRaises(blobc.Typesys.TypeSystemException):
+            blobc.validate_ctypes_layout(bad)
@@ -0,0 +1,181 @@
+
+import os
+import blobc
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+from blobc.Parser import ParseContext
+
+class TestSchemaCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.inc_dir = os.path.join(self.tmpdir, 'inc')
+        os.mkdir(self.inc_dir)
+        self._write('inc/prims.blob', 'defprimitive u32 uint 4;\n')
+        self._write('inc/shared.blob', 'import "prims.blob"\nstruct shared { u32 a; }\n')
+        self._write('main.blob', 'import "shared.blob"\ngenerator c : no_separators;\n'
+                                 'struct main { shared s; u32 b; }\n')
+        self._parses = []
+        self._orig_parse = ParseContext.parse
+        parses = self._parses
+        orig_parse = self._orig_parse
+        def counting_parse(ctx, fn, is_import=False):
+            parses.append(fn)
+            return orig_parse(ctx, fn, is_import)
+        ParseContext.parse = counting_parse
+
+    def tearDown(self):
+        ParseContext.parse = self._orig_parse
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, fn, text):
+        with open(os.path.join(self.tmpdir, fn), 'w') as f:
+            f.write(text)
+
+    def _compile(self):
+        del self._parses[:]
+        return blobc.compile_file(os.path.join(self.tmpdir, 'main.blob'),
+                import_dirs=[self.inc_dir], cache_dir=self.cache_dir)
+
+    def test_hit(self):
+        pt1, tsys1 = self._compile()
+        self.assertEqual(len(self._parses), 3)
+
+        pt2, tsys2 = self._compile()
+        self.assertEqual(self._parses, [])
+        self.assertEqual(tsys2.freeze(), tsys1.freeze())
+        self.assertEqual([c.generator_name for c in pt2], ['c'])
+
+    def test_load_entry(self):
+        self._compile()
+        main_fn = os.path.join(self.tmpdir, 'main.blob')
+        with open(main_fn) as f:
+            data = f.read()
+        cache = blobc.Cache.SchemaCache(self.cache_dir)
+        handler = blobc.Parser.DefaultImportHandler([self.inc_dir])
+        deps, schema = cache.load_entry(main_fn, data, handler, self.inc_dir)
+        self.assertEqual([os.path.basename(fn) for fn, digest in deps],
+                         ['main.blob', 'shared.blob', 'prims.blob'])
+        self.assertEqual(cache.load(main_fn, data, handler, self.inc_dir), schema)
+        self.assertIsNone(cache.load_entry(main_fn, data + ' ', handler, self.inc_dir))
+
+    def test_imported_file_change_invalidates(self):
+        self._compile()
+        self._write('inc/prims.blob', 'defprimitive u32 uint 2;\n')
+        pt, tsys = self._compile()
+        self.assertEqual(len(self._parses), 3)
+        self.assertEqual(blobc.TargetMachine().sizeof(tsys.lookup('main')), 4)
+
+    def test_main_file_change_invalidates(self):
+        self._compile()
+        self._write('main.blob', 'import "shared.blob"\nstruct main { u32 b; }\n')
+        pt, tsys = self._compile()
+        self.assertEqual(len(self._parses), 3)
+        self.assertEqual(len(tsys.lookup('main').members), 1)
+
+    def test_corrupt_entry(self):
+        self._compile()
+        for fn in os.listdir(self.cache_dir):
+            with open(os.path.join(self.cache_dir, fn), 'w') as f:
+                f.write('garbage')
+        pt, tsys = self._compile()
+        self.assertEqual(len(self._parses), 3)
+        self.assertIsNotNone(tsys.lookup('main'))
+
+    def test_shadowing_import_invalidates(self):
+        first_dir = os.path.join(self.tmpdir, 'first')
+        os.mkdir(first_dir)
+        def compile():
+            return blobc.compile_file(os.path.join(self.tmpdir, 'main.blob'),
+                    import_dirs=[first_dir, self.inc_dir], cache_dir=self.cache_dir)
+        compile()
+        self._write('first/shared.blob', 'import "prims.blob"\nstruct shared { u32 a; u32 b; }\n')
+        pt, tsys = compile()
+        self.assertEqual(len(tsys.lookup('shared').members), 2)
+
+    def test_unpicklable_entry(self):
+        cache = blobc.Cache.SchemaCache(self.cache_dir)
+        with self.assertRaises(Exception):
+            cache.store('x', 'data', [], lambda: None)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_no_cache_dir(self):
+        pt, tsys = blobc.compile_file(os.path.join(self.tmpdir, 'main.blob'), import_dirs=[self.inc_dir])
+        self.assertFalse(os.path.exists(self.cache_dir))
+        self.assertIsNotNone(tsys.lookup('shared'))
+
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self._write('prims.blob', 'defprimitive u32 uint 4;\n')
+        self._write('shared.blob', 'import "prims.blob"\nstruct shared { u32 a; void* p; }\n')
+        self._write('one.blob', 'import "shared.blob"\nstruct one { shared s; }\n')
+        self._write('two.blob', 'import "shared.blob"\nstruct two { u32[2] b; }\n')
+        self._parsed = []
+        self._orig_parse_data = ParseContext._parse_data
+        parsed = self._parsed
+        orig = self._orig_parse_data
+        def counting_parse_data(ctx, fn, data, is_import):
+            parsed.append(os.path.basename(fn))
+            return orig(ctx, fn, data, is_import)
+        ParseContext._parse_data = counting_parse_data
+
+    def tearDown(self):
+        ParseContext._parse_data = self._orig_parse_data
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, fn, text):
+        with open(os.path.join(self.tmpdir, fn), 'w') as f:
+            f.write(text)
+
+    def _compile(self, fn):
+        del self._parsed[:]
+        return blobc.compile_file(os.path.join(self.tmpdir, fn),
+                import_dirs=[self.tmpdir], cache_dir=self.cache_dir)
+
+    def test_imports_shared_between_files(self):
+        self._compile('one.blob')
+        self.assertEqual(self._parsed, ['one.blob', 'shared.blob', 'prims.blob'])
+        pt, tsys = self._compile('two.blob')
+        self.assertEqual(self._parsed, ['two.blob'])
+        self.assertEqual(blobc.TargetMachine().sizeof(tsys.lookup('two')), 8)
+        self.assertTrue(tsys.lookup('shared').members[0].location.is_import)
+
+    def test_changed_import_is_reparsed(self):
+        self._compile('one.blob')
+        self._write('prims.blob', 'defprimitive u32 uint 2;\n')
+        pt, tsys = self._compile('two.blob')
+        self.assertEqual(self._parsed, ['two.blob', 'prims.blob'])
+        self.assertEqual(blobc.TargetMachine().sizeof(tsys.lookup('two')), 4)
+
+    def test_cached_files_not_parsed_in_pool(self):
+        self._compile('one.blob')
+        pools = []
+        orig_pool = multiprocessing.Pool
+        def counting_pool(*args):
+            pools.append(args)
+            return orig_pool(*args)
+        multiprocessing.Pool = counting_pool
+        try:
+            del self._parsed[:]
+            pt, tsys = blobc.compile_file(os.path.join(self.tmpdir, 'two.blob'),
+                    import_dirs=[self.tmpdir], cache_dir=self.cache_dir, jobs=3)
+        finally:
+            multiprocessing.Pool = orig_pool
+        self.assertEqual(pools, [])
+        self.assertEqual(self._parsed, ['two.blob'])
+        self.assertEqual(blobc.TargetMachine().sizeof(tsys.lookup('two')), 8)
+
+    def test_void_type_identity(self):
+        cache = blobc.Cache.ParseCache(self.cache_dir)
+        nodes = blobc.parse_string('struct foo { void* p; }')
+        cache.store('x', 'digest', False, nodes)
+        loaded = cache.load('x', 'digest', False)
+        self.assertIs(loaded[0].members[0].type.basetype, blobc.ParseTree.RawVoidType.instance)
+        self.assertIsNone(cache.load('x', 'digest', True))
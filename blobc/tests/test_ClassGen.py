@@ -99,3 +99,42 @@ class TestClassGen(unittest.TestCase):
             data = bar(test=foo_base(a=1))
 
 
+
+class TestLazyClasses(unittest.TestCase):
+    src = """
+        defprimitive u32 uint 4;
+        enum Kind { A, B }
+        struct inner { u32 x; }
+        struct outer { inner i; outer* next; }
+        struct unused { missing m; }
+    """
+
+    def _setup(self, src):
+        tsys = blobc.compile_types(blobc.parse_string(src), lazy=True)
+        return tsys, blobc.lazy_classes(tsys)
+
+    def test_on_demand(self):
+        tsys, c = self._setup(self.src)
+        self.assertEqual(c._classes, {})
+        obj = c.outer(next=None)
+        self.assertEqual(sorted(c._classes), ['inner', 'outer'])
+        self.assertIsInstance(obj.i, c['inner'])
+        self.assertIs(c['outer'], c.outer)
+        self.assertEqual(c.Kind.B.value, 1)
+        self.assertIn('outer', c)
+        self.assertNotIn('u32', c)
+        self.assertNotIn('nothere', c)
+        with self.assertRaises(AttributeError):
+            c.nothere
+
+    def test_pointer_target(self):
+        tsys, c = self._setup(self.src)
+        a = c.outer()
+        b = c.outer(next=a)
+        self.assertIs(b.next[0], a)
+
+    def test_errors_deferred(self):
+        tsys, c = self._setup(self.src)
+        c.outer
+        with self.assertRaises(TypeSystemException):
+            c.unused
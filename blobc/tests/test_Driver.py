@@ -0,0 +1,217 @@
+
+import blobc
+import blobc.Driver
+import os
+import argparse
+import shutil
+import tempfile
+import unittest
+
+from blobc.Driver import BatchEntry, BatchError, read_manifest, generate, compile_batch, \
+        write_output, main
+from blobc.Parser import ParseContext
+from blobc.codegen import CGenerator
+
+class _UsageErrorParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise ValueError(message)
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self._write('prims.blob', 'defprimitive u32 uint 4;\n')
+        self._write('shared.blob', 'import "prims.blob"\nstruct shared { u32 a; }\n')
+        self._write('a.blob', 'import "shared.blob"\nstruct a { shared s; }\n')
+        self._write('b.blob', 'import "shared.blob"\nstruct b { shared* s; u32 n; }\n')
+
+        self._parsed = []
+        self._orig_parse_data = ParseContext._parse_data
+        parsed = self._parsed
+        orig = self._orig_parse_data
+        def counting_parse_data(ctx, fn, data, is_import):
+            parsed.append(os.path.basename(fn))
+            return orig(ctx, fn, data, is_import)
+        ParseContext._parse_data = counting_parse_data
+
+    def tearDown(self):
+        ParseContext._parse_data = self._orig_parse_data
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, fn):
+        return os.path.join(self.tmpdir, fn)
+
+    def _write(self, fn, text):
+        with open(self._path(fn), 'w') as f:
+            f.write(text)
+
+    def _read(self, fn):
+        with open(self._path(fn)) as f:
+            return f.read()
+
+    def _entries(self):
+        return [BatchEntry(self._path(n + '.blob'), self._path(n + '.h'), self._path(n + '.c'))
+                for n in ('a', 'b')]
+
+    def test_shares_imports(self):
+        session = compile_batch(self._entries(), CGenerator, import_dirs=[self.tmpdir])
+        self.assertEqual(sorted(self._parsed), ['a.blob', 'b.blob', 'prims.blob', 'shared.blob'])
+        self.assertEqual(session.recompiled, set(['b']))
+
+    def test_matches_single_compiles(self):
+        compile_batch(self._entries(), CGenerator, import_dirs=[self.tmpdir])
+        for n in ('a', 'b'):
+            pt, tsys = blobc.compile_file(self._path(n + '.blob'), import_dirs=[self.tmpdir])
+            generate(CGenerator, pt, tsys, self._path(n + '.blob'),
+                     self._path(n + '1.h'), self._path(n + '1.c'))
+            self.assertEqual(self._read(n + '1.h'), self._read(n + '.h'))
+            self.assertEqual(self._read(n + '1.c').replace(n + '1.h', n + '.h'), self._read(n + '.c'))
+
+    def test_parallel(self):
+        for n in 'cdef':
+            self._write(n + '.blob', 'import "shared.blob"\nstruct %s { shared* s; }\n' % (n))
+        names = 'abcdef'
+        entries = [BatchEntry(self._path(n + '.blob'), self._path(n + '.h'), self._path(n + '.c'))
+                   for n in names]
+        compile_batch(entries, CGenerator, import_dirs=[self.tmpdir], jobs=3)
+        outputs = [(self._read(n + '.h'), self._read(n + '.c')) for n in names]
+
+        compile_batch(entries, CGenerator, import_dirs=[self.tmpdir])
+        self.assertEqual(outputs, [(self._read(n + '.h'), self._read(n + '.c')) for n in names])
+        self.assertFalse([fn for fn in os.listdir(self.tmpdir) if fn.endswith('.tmp')])
+
+    def test_parallel_errors(self):
+        self._write('c.blob', 'struct c { nonesuch x; }\n')
+        self._write('d.blob', 'import "shared.blob"\nstruct d { shared s; }\n')
+        self._write('e.blob', 'struct e { }}\n')
+        entries = [BatchEntry(self._path(n + '.blob'), self._path(n + '.h')) for n in 'acde']
+        with self.assertRaises(BatchError) as cm:
+            compile_batch(entries, CGenerator, import_dirs=[self.tmpdir], jobs=2)
+        self.assertEqual(len(cm.exception.messages), 2)
+        self.assertIn('nonesuch', cm.exception.messages[0])
+        self.assertIn('e.blob', cm.exception.messages[1])
+        # the good inputs were still compiled
+        self.assertTrue(os.path.exists(self._path('d.h')))
+
+        # also when the first input, compiled before the others, fails
+        for fn in ('a.h', 'd.h'):
+            os.remove(self._path(fn))
+        with self.assertRaises(BatchError) as cm:
+            compile_batch(entries[::-1], CGenerator, import_dirs=[self.tmpdir], jobs=2)
+        self.assertEqual(len(cm.exception.messages), 2)
+        self.assertIn('e.blob', cm.exception.messages[0])
+        self.assertIn('nonesuch', cm.exception.messages[1])
+        self.assertTrue(os.path.exists(self._path('a.h')))
+        self.assertTrue(os.path.exists(self._path('d.h')))
+
+    def test_parallel_without_fork(self):
+        self._write('c.blob', 'struct c { nonesuch x; }\n')
+        entries = [BatchEntry(self._path(n + '.blob'), self._path(n + '.h')) for n in 'acb']
+        can_fork = blobc.Driver._can_fork
+        blobc.Driver._can_fork = False
+        try:
+            with self.assertRaises(BatchError) as cm:
+                compile_batch(entries, CGenerator, import_dirs=[self.tmpdir], jobs=2)
+        finally:
+            blobc.Driver._can_fork = can_fork
+        self.assertEqual(len(cm.exception.messages), 1)
+        self.assertTrue(os.path.exists(self._path('b.h')))
+
+    def test_single_input_options(self):
+        p = self._path
+        for extra in (['--cache-dir', p('cache')], ['--parse-jobs', '2']):
+            with self.assertRaises(ValueError) as cm:
+                main(['-l', 'c', '-I', self.tmpdir, '-b', p('a.blob'), p('a.h')] + extra,
+                     parser_class=_UsageErrorParser)
+            self.assertIn('%s cannot be combined with --batch' % (extra[0]), str(cm.exception))
+        self.assertFalse(os.path.exists(p('a.h')))
+        self.assertFalse(os.path.exists(p('cache')))
+
+    def test_failed_generate_keeps_output(self):
+        self._write('a.h', 'old')
+        self._write('a.blob', 'import "shared.blob"\ngenerator c : bogus_option;\nstruct a { shared s; }\n')
+        with self.assertRaises(blobc.ParseError):
+            compile_batch(self._entries()[:1], CGenerator, import_dirs=[self.tmpdir])
+        self.assertEqual(self._read('a.h'), 'old')
+
+    def test_unchanged_outputs_kept(self):
+        entries = self._entries()
+        compile_batch(entries, CGenerator, import_dirs=[self.tmpdir])
+        for n in ('a.h', 'a.c', 'b.h', 'b.c'):
+            os.utime(self._path(n), (1000000, 1000000))
+
+        self._write('b.blob', 'import "shared.blob"\nstruct b { shared* s; u32 n; u32 m; }\n')
+        compile_batch(entries, CGenerator, import_dirs=[self.tmpdir])
+        mtimes = dict((n, os.stat(self._path(n)).st_mtime) for n in ('a.h', 'a.c', 'b.h', 'b.c'))
+        self.assertEqual((mtimes['a.h'], mtimes['a.c']), (1000000, 1000000))
+        self.assertNotEqual(mtimes['b.h'], 1000000)
+        self.assertIn(' m;', self._read('b.h'))
+
+    def test_write_output(self):
+        fn = self._path('out')
+        self.assertTrue(write_output(fn, 'abc'))
+        self.assertFalse(write_output(fn, 'abc'))
+        self.assertTrue(write_output(fn, 'abd'))
+        self.assertTrue(write_output(fn, 'abcd'))
+        self.assertEqual(self._read('out'), 'abcd')
+
+    def test_depfile(self):
+        p = self._path
+        status = main(['-l', 'c', '-I', self.tmpdir, p('a.blob'), '-o', p('a.h'), '-a', p('a.c'),
+                       '-MD', '-MP'])
+        self.assertEqual(status, 0)
+        self.assertEqual(self._read('a.h.d'),
+                '%s %s: %s \\\n  %s \\\n  %s\n\n%s:\n\n%s:\n' % (
+                    p('a.h'), p('a.c'), p('a.blob'), p('shared.blob'), p('prims.blob'),
+                    p('shared.blob'), p('prims.blob')))
+
+    def test_batch_depfiles(self):
+        p = self._path
+        status = main(['-l', 'c', '-I', self.tmpdir, '-MD',
+                       '-b', p('a.blob'), p('a.h'), '-b', p('prims.blob'), p('prims.h')])
+        self.assertEqual(status, 0)
+        self.assertEqual(self._read('a.h.d'), '%s: %s \\\n  %s \\\n  %s\n' % (
+            p('a.h'), p('a.blob'), p('shared.blob'), p('prims.blob')))
+        self.assertEqual(self._read('prims.h.d'), '%s: %s\n' % (p('prims.h'), p('prims.blob')))
+
+    def _languages(self, out_dir, extra):
+        p = self._path
+        os.mkdir(p(out_dir))
+        os.chdir(p(out_dir))
+        status = main(['-I', self.tmpdir, p('b.blob'), '-m',
+                       '-l', 'c', '-o', 'b.h', '-a', 'b.c', '-l', 'csharp', '-o', 'b.cs',
+                       '-l', 'm68k', '-o', 'b.i'] + extra)
+        self.assertEqual(status, 0)
+        return [self._read(os.path.join(out_dir, fn)) for fn in ('b.h', 'b.c', 'b.cs', 'b.i')]
+
+    def test_several_languages(self):
+        cwd = os.getcwd()
+        try:
+            serial = self._languages('serial', [])
+            parallel = self._languages('parallel', ['-j', '3'])
+
+            os.mkdir(self._path('single'))
+            os.chdir(self._path('single'))
+            for args in (['-l', 'c', '-o', 'b.h', '-a', 'b.c'], ['-o', 'b.cs', '-l', 'csharp'],
+                         ['-l', 'm68k', '-o', 'b.i']):
+                self.assertEqual(main(['-I', self.tmpdir, self._path('b.blob'), '-m'] + args), 0)
+        finally:
+            os.chdir(cwd)
+
+        # one parse for all languages
+        self.assertEqual(self._parsed.count('b.blob'), 5)
+        self.assertEqual(serial, parallel)
+        self.assertEqual(serial, [self._read(os.path.join('single', fn))
+                                  for fn in ('b.h', 'b.c', 'b.cs', 'b.i')])
+
+    def test_manifest(self):
+        self._write('list', '# inputs\n\na.blob a.h a.c\nb.blob   b.h\n')
+        entries = read_manifest(self._path('list'))
+        self.assertEqual([(e.input_fn, e.output_fn, e.aux_fn) for e in entries],
+                         [('a.blob', 'a.h', 'a.c'), ('b.blob', 'b.h', None)])
+
+    def test_manifest_error(self):
+        self._write('list', 'a.blob a.h\nb.blob\n')
+        with self.assertRaises(blobc.ParseError) as cm:
+            read_manifest(self._path('list'))
+        self.assertEqual(cm.exception.lineno, 2)
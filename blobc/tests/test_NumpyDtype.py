@@ -0,0 +1,117 @@
+
+import blobc
+import unittest
+
+from struct import pack
+from blobc.Typesys import TypeSystemException
+
+try:
+    import numpy
+except ImportError: # pragma: no cover
+    numpy = None
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class TestNumpyDtype(unittest.TestCase):
+
+    def _setup(self, src):
+        pt = blobc.parse_string(src)
+        tsys = blobc.compile_types(pt)
+        classes = {}
+        blobc.generate_classes(tsys, classes)
+        return tsys, classes
+
+    points = """
+        defprimitive u8 uint 1;
+        defprimitive s16 sint 2;
+        defprimitive f32 float 4;
+        struct point {
+            u8 tag;
+            s16[2] xy;
+            f32 w;
+        }
+    """
+
+    def test_dtype(self):
+        tsys, c = self._setup(self.points)
+        tm = blobc.TargetMachine(endian='big')
+        dt = tm.numpy_dtype(tsys.lookup('point'))
+        self.assertEqual(dt.itemsize, 12)
+        self.assertEqual(dt.names, ('tag', 'xy', 'w'))
+        self.assertEqual(dt.fields['xy'][1], 2)
+        self.assertEqual(dt.fields['w'][1], 8)
+        self.assertEqual(dt.fields['xy'][0], numpy.dtype(('>i2', (2,))))
+        self.assertEqual(dt.fields['w'][0], numpy.dtype('>f4'))
+        self.assertIs(tm.numpy_dtype(tsys.lookup('point')), dt)
+
+    def test_dtype_endian(self):
+        tsys, c = self._setup(self.points)
+        dt = blobc.TargetMachine(endian='little').numpy_dtype(tsys.lookup('point'))
+        self.assertEqual(dt.fields['w'][0], numpy.dtype('<f4'))
+
+    def test_pointer_struct_has_no_dtype(self):
+        tsys, c = self._setup("""
+            defprimitive u32 uint 4;
+            struct foo {
+                u32* a;
+            }
+        """)
+        with self.assertRaises(TypeSystemException):
+            blobc.TargetMachine().numpy_dtype(tsys.lookup('foo'))
+
+    def test_bulk_pointer_array(self):
+        tsys, c = self._setup(self.points + """
+            defprimitive u32 uint 4;
+            struct root {
+                u32 count;
+                point* points;
+            }
+        """)
+        tm = blobc.TargetMachine(endian='big', pointer_size=4)
+        arr = numpy.zeros(2, dtype=tm.numpy_dtype(tsys.lookup('point')))
+        arr['tag'] = [1, 2]
+        arr['xy'] = [[3, 4], [5, 6]]
+        arr['w'] = [0.5, 1.5]
+
+        blob, relocs = blobc.layout(c['root'](count=2, points=arr), tm)
+
+        objs = [c['point'](tag=1, xy=[3, 4], w=0.5), c['point'](tag=2, xy=[5, 6], w=1.5)]
+        expected, expected_relocs = blobc.layout(c['root'](count=2, points=objs), tm)
+
+        # padding is written verbatim from the array, not as 0xfd filler
+        self.assertEqual(blob[:8], expected[:8])
+        self.assertEqual(blob[8:], pack('>B x 2h 2x f B x 2h 2x f', 1, 3, 4, 0.5, 2, 5, 6, 1.5))
+        self.assertEqual(relocs, expected_relocs)
+
+    def test_bulk_fixed_array_converts_endian(self):
+        tsys, c = self._setup(self.points + """
+            struct root {
+                point[2] points;
+            }
+        """)
+        tm = blobc.TargetMachine(endian='big')
+        native = blobc.TargetMachine(endian='little').numpy_dtype(tsys.lookup('point'))
+        arr = numpy.zeros(2, dtype=native)
+        arr['xy'] = [[1, 2], [3, 4]]
+
+        blob, relocs = blobc.layout(c['root'](points=arr), tm)
+        self.assertEqual(blob, pack('>x x 2h 2x 4x x x 2h 2x 4x', 1, 2, 3, 4))
+
+    def test_bulk_fixed_array_length(self):
+        tsys, c = self._setup(self.points + """
+            struct root {
+                point[2] points;
+            }
+        """)
+        dt = blobc.TargetMachine().numpy_dtype(tsys.lookup('point'))
+        with self.assertRaises(blobc.Typesys.PythonMappingException):
+            c['root'](points=numpy.zeros(3, dtype=dt))
+
+    def test_bulk_field_mismatch(self):
+        tsys, c = self._setup(self.points + """
+            struct root {
+                point* points;
+            }
+        """)
+        arr = numpy.zeros(2, dtype=[('a', 'u1')])
+        with self.assertRaises(blobc.Typesys.PythonMappingException):
+            blobc.layout(c['root'](points=arr), blobc.TargetMachine())
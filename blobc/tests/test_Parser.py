@@ -1,7 +1,12 @@
+import os
+import pickle
 import blobc
+import shutil
+import tempfile
 import unittest
 from blobc.ParseTree import *
-from blobc.Parser import ParseError
+from blobc.Parser import ParseContext, DefaultImportHandler, ImportGraph
+from blobc.Parser import ParseError, Tokenizer, TOK_EOF, TOK_WORD, TOK_INT, TOK_PUNCT, TOK_STRING
 from blobc.Typesys import TypeSystemException
 
 class TestParser(unittest.TestCase):
@@ -327,3 +332,195 @@ class TestParser(unittest.TestCase):
         self.assertIsInstance(p[0].expr.rhs.rhs.rhs.rhs, RawNamedConstantExpr)
         self.assertEqual(p[0].expr.rhs.rhs.rhs.rhs.name, 'b')
 
+
+class TestTokenizer(unittest.TestCase):
+    src = 'struct foo // comment\n{\n  u8[0x10] a; """x\ny""" "s"\n\n}\n'
+
+    def _tokens(self, src):
+        tok = Tokenizer('<test>', src, False)
+        result = []
+        while True:
+            t, v = tok.peek()
+            result.append((t, v, tok.lineno))
+            if t == TOK_EOF:
+                return result
+            tok.next()
+
+    def test_tokens(self):
+        expected = [
+            (TOK_WORD, 'struct', 1), (TOK_WORD, 'foo', 1), (TOK_PUNCT, '{', 2),
+            (TOK_WORD, 'u8', 3), (TOK_PUNCT, '[', 3), (TOK_INT, 16, 3), (TOK_PUNCT, ']', 3),
+            (TOK_WORD, 'a', 3), (TOK_PUNCT, ';', 3), (TOK_STRING, 'x\ny', 3),
+            (TOK_STRING, 's', 4), (TOK_PUNCT, '}', 6), (TOK_EOF, None, 7),
+        ]
+        self.assertEqual(self._tokens(self.src), expected)
+
+    def test_bad_char_line(self):
+        tok = Tokenizer('<test>', 'a\nb\n  $', False)
+        tok.next()
+        with self.assertRaises(ParseError) as cm:
+            tok.next()
+        self.assertEqual(cm.exception.lineno, 3)
+
+    def test_error_line(self):
+        with self.assertRaises(ParseError) as cm:
+            blobc.parse_string('struct foo {\n  u8 a;\n  u8\n  ;\n}\n')
+        self.assertEqual(cm.exception.lineno, 4)
+
+    def test_shared_locations(self):
+        pt = blobc.parse_string('struct foo { u8 a; u8 b; }\nstruct bar {\n}\n')
+        foo, bar = pt
+        self.assertIs(foo.members[0].location, foo.members[1].location)
+        self.assertEqual(foo.members[1].location.lineno, 1)
+        self.assertEqual(bar.location.lineno, 2)
+
+class TestImportResolution(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp())
+        os.mkdir(os.path.join(self.tmpdir, 'inc'))
+        os.symlink(os.path.join(self.tmpdir, 'inc'), os.path.join(self.tmpdir, 'alias'))
+        self._write('inc/a.blob', 'defprimitive u8 uint 1;\n')
+        self._write('inc/b.blob', 'import "a.blob"\nstruct b { u8 x; }\n')
+        self._write('main.blob', 'import "a.blob"\nimport "alias/a.blob"\nimport "b.blob"\n')
+        self.handler = DefaultImportHandler([os.path.join(self.tmpdir, 'inc'), self.tmpdir])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, fn, text):
+        with open(os.path.join(self.tmpdir, fn), 'w') as f:
+            f.write(text)
+
+    def test_same_file_through_different_dirs(self):
+        ctx = ParseContext(True, self.handler)
+        pt = ctx.parse(os.path.join(self.tmpdir, 'main.blob'))
+        self.assertEqual([p.name for p in pt], ['u8', 'b'])
+        self.assertEqual(len(ctx.files), 3)
+
+    def test_listing_cache(self):
+        inc = os.path.join(self.tmpdir, 'inc')
+        self.assertEqual(self.handler.find_imported_file('a.blob'), os.path.join(inc, 'a.blob'))
+        self.assertIsNone(self.handler.find_imported_file('c.blob'))
+        self._write('inc/c.blob', '')
+        self.assertIsNone(self.handler.find_imported_file('c.blob'))
+        self.handler.invalidate()
+        self.assertEqual(self.handler.find_imported_file('c.blob'), os.path.join(inc, 'c.blob'))
+
+    def test_case_insensitive_fs(self):
+        inc = os.path.join(self.tmpdir, 'inc')
+        real_exists = os.path.exists
+        files = set(os.path.join(inc, fn).lower() for fn in os.listdir(inc))
+        os.path.exists = lambda path: path.lower() in files
+        try:
+            self.assertEqual(self.handler.find_imported_file('A.blob'), os.path.join(inc, 'A.blob'))
+            self.assertIsNone(self.handler.find_imported_file('C.blob'))
+        finally:
+            os.path.exists = real_exists
+        # a case-sensitive file system
+        self.handler.invalidate()
+        self.assertIsNone(self.handler.find_imported_file('A.blob'))
+
+    def test_import_graph(self):
+        graph = ImportGraph()
+        main = os.path.join(self.tmpdir, 'main.blob')
+        ParseContext(True, self.handler, graph).parse(main)
+        a = os.path.join(self.tmpdir, 'inc', 'a.blob')
+        b = os.path.join(self.tmpdir, 'inc', 'b.blob')
+        alias_a = os.path.join(self.tmpdir, 'alias', 'a.blob')
+        self.assertEqual(graph.imports(main), [a, alias_a, b])
+        self.assertEqual(graph.imports(b), [a])
+        self.assertIsNone(graph.imports(alias_a))
+        self.assertEqual(graph.closure(main), [main, a, alias_a, b])
+
+class TestCompactNodes(unittest.TestCase):
+
+    def test_no_instance_dicts(self):
+        pt = blobc.parse_string('defprimitive u8 uint 1;\nstruct foo { u8[2+3]* a : opt(x=1); }\n'
+                                'enum e { A = -1 }\niconst C = 1 << 2;\n')
+        work = list(pt)
+        seen = 0
+        while work:
+            o = work.pop()
+            if isinstance(o, (list, tuple)):
+                work.extend(o)
+            elif type(o).__module__.startswith('blobc'):
+                self.assertFalse(hasattr(o, '__dict__'), type(o).__name__)
+                seen += 1
+                for cls in type(o).__mro__:
+                    for slot in cls.__dict__.get('__slots__', ()):
+                        work.append(getattr(o, slot))
+        self.assertGreater(seen, 10)
+
+    def test_empty_options_shared(self):
+        pt = blobc.parse_string('struct foo { u8 a; u8 b; }')
+        a, b = pt[0].members
+        self.assertEqual(a.options, ())
+        self.assertIs(a.options, b.options)
+        self.assertEqual(a.get_options('x'), [])
+
+class TestParallelParse(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self._write('prims.blob', 'defprimitive u8 uint 1;\ndefprimitive u32 uint 4;\n')
+        self._write('a.blob', 'import "prims.blob"\nstruct a { u8 x; }\n')
+        self._write('b.blob', '// import "nothere.blob"\nimport "prims.blob"\nimport "a.blob"\n'
+                              'struct b { a y; }\n')
+        self._write('c.blob', 'struct c { u32 z; } import "b.blob"\n')
+        self._write('main.blob', 'import "c.blob"\nimport "a.blob"\nstruct main { c m; }\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, fn, text):
+        with open(os.path.join(self.tmpdir, fn), 'w') as f:
+            f.write(text)
+
+    def _parse(self, jobs):
+        ctx = ParseContext(True, DefaultImportHandler([self.tmpdir]))
+        ctx.jobs = jobs
+        pt = ctx.parse(os.path.join(self.tmpdir, 'main.blob'))
+        return [(p.name, p.location.filename, p.location.lineno, p.location.is_import) for p in pt], ctx.files
+
+    def test_same_as_serial(self):
+        serial = self._parse(1)
+        self.assertEqual([n[0] for n in serial[0]], ['c', 'u8', 'u32', 'a', 'b', 'main'])
+        self.assertEqual(self._parse(3), serial)
+
+    def test_no_imports(self):
+        ctx = ParseContext(True, DefaultImportHandler([self.tmpdir]))
+        ctx.jobs = 3
+        pt = ctx.parse(os.path.join(self.tmpdir, 'prims.blob'))
+        self.assertEqual([p.name for p in pt], ['u8', 'u32'])
+
+    def test_error_in_import(self):
+        self._write('a.blob', 'import "prims.blob"\nstruct a {\n  u8 ;\n}\n')
+        for jobs in (1, 3):
+            with self.assertRaises(ParseError) as cm:
+                self._parse(jobs)
+            self.assertEqual((os.path.basename(cm.exception.filename), cm.exception.lineno), ('a.blob', 3))
+
+class RawTaggedType(RawSimpleType):
+    __slots__ = ('tag',)
+
+class TestPickle(unittest.TestCase):
+
+    def test_roundtrip(self):
+        pt = blobc.parse_string('''
+            defprimitive u32 uint 4;
+            iconst N = 2 * (3 + 1);
+            struct foo : base(bar) { u32[N] x; void* p; }
+        ''')
+        data = pickle.dumps(pt, pickle.HIGHEST_PROTOCOL)
+        loaded = pickle.loads(data)
+        self.assertEqual(pickle.dumps(loaded, pickle.HIGHEST_PROTOCOL), data)
+        self.assertEqual(loaded[1].expr.eval(None), 8)
+        self.assertEqual(loaded[2].get_options('base')[0].pos_params, ['bar'])
+        self.assertIs(loaded[2].members[1].type.basetype, RawVoidType.instance)
+
+    def test_subclass(self):
+        t = RawTaggedType('x', SourceLocation('a.blob', 3, False))
+        t.tag = 'y'
+        loaded = pickle.loads(pickle.dumps(t, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual((loaded.name, loaded.tag, loaded.location.lineno), ('x', 'y', 3))
@@ -0,0 +1,108 @@
+
+import blobc
+import pickle
+import unittest
+
+from cStringIO import StringIO
+from blobc.codegen import CGenerator, M68kGenerator
+
+schema_src = """
+    defprimitive u8 uint 1;
+    defprimitive u32 uint 4;
+    defprimitive s16 sint 2;
+    defprimitive f32 float 4;
+    defprimitive char character 1;
+    generator c : struct_suffix(_S);
+    iconst Count = 3;
+    enum Color { RED, GREEN = 7, BLUE }
+    struct node_base {
+        u32 id;
+    }
+    struct node : base(node_base) {
+        Color color;
+        node* next : c_decl("struct node_S *next");
+        s16[Count, 2] grid;
+        __cstring<char> name;
+        void* user;
+        f32 weight : m68k_name(NodeWeight);
+    }
+    struct tree {
+        node root;
+        node*[2] children;
+        u32 flags;
+    }
+"""
+
+class TestSchema(unittest.TestCase):
+
+    def _setup(self, src):
+        pt = blobc.parse_string(src)
+        return pt, blobc.compile_types(pt)
+
+    def _generate(self, gencls, parse_tree, tsys):
+        fh = StringIO()
+        gen = gencls(fh, 'input.blob', None, None)
+        gen.generate_code(parse_tree, tsys)
+        return fh.getvalue()
+
+    def test_pickle_roundtrip(self):
+        pt, tsys = self._setup(schema_src)
+        schema = tsys.freeze()
+        data = pickle.dumps(schema, pickle.HIGHEST_PROTOCOL)
+        self.assertEqual(pickle.loads(data), schema)
+
+    def test_immutable(self):
+        pt, tsys = self._setup(schema_src)
+        schema = tsys.freeze()
+        with self.assertRaises(AttributeError):
+            schema.types = ()
+
+    def test_thaw(self):
+        pt, tsys = self._setup(schema_src)
+        thawed = pickle.loads(pickle.dumps(tsys.freeze(), 2)).thaw()
+
+        self.assertEqual([t.name for t in thawed.itertypes()], [t.name for t in tsys.itertypes()])
+        self.assertEqual([(n, v) for n, v, l in thawed.iterconsts()], [('Count', 3)])
+
+        node = thawed.lookup('node')
+        self.assertIs(node.base_type, thawed.lookup('node_base'))
+        self.assertIs(node.members[0], node.base_type.members[0])
+        self.assertEqual([m.mname for m in node.members],
+                ['id', 'color', 'next', 'grid', 'name', 'user', 'weight'])
+        self.assertIs(node.members[2].mtype.base_type, node)
+        self.assertEqual(str(node.members[3].mtype), 's16[3][2]')
+        self.assertIsInstance(node.members[4].mtype, blobc.Typesys.CStringType)
+        self.assertEqual(thawed.lookup('Color').members[2].value, 8)
+        self.assertEqual(node.members[6].get_options('m68k_name')[0].pos_params, ['NodeWeight'])
+
+        for ptr_size in (4, 8):
+            tm1 = blobc.TargetMachine(pointer_size=ptr_size)
+            tm2 = blobc.TargetMachine(pointer_size=ptr_size)
+            for name in ('node', 'tree'):
+                l1 = tm1.struct_layout(tsys.lookup(name))
+                l2 = tm2.struct_layout(thawed.lookup(name))
+                self.assertEqual((l1.size, l1.align, l1.offsets), (l2.size, l2.align, l2.offsets))
+
+    def test_generated_code_matches(self):
+        pt, tsys = self._setup(schema_src)
+        thawed = tsys.freeze().thaw()
+        configs = list(thawed.itergenconfigs())
+        for gencls in (CGenerator, M68kGenerator):
+            self.assertEqual(self._generate(gencls, configs, thawed),
+                             self._generate(gencls, pt, tsys))
+
+    def test_thawed_classes(self):
+        pt, tsys = self._setup(schema_src)
+        thawed = tsys.freeze().thaw()
+        c1, c2 = {}, {}
+        blobc.generate_classes(tsys, c1)
+        blobc.generate_classes(thawed, c2)
+        tm = blobc.TargetMachine(endian='big')
+
+        def build(c):
+            n = c['node'](id=1, color=c['Color'].BLUE, name='hello', weight=2.5,
+                             grid=[[1, 2, 3], [4, 5, 6]])
+            n.next = n
+            return c['tree'](root=n, children=[n, None], flags=3)
+
+        self.assertEqual(blobc.layout(build(c2), tm), blobc.layout(build(c1), tm))
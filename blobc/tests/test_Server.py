@@ -0,0 +1,99 @@
+
+import os
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from blobc.Driver import main
+from blobc.Parser import ParseContext
+from blobc.Server import CompileServer
+
+class TestCompileServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self._write('prims.blob', 'defprimitive u32 uint 4;\n')
+        self._write('a.blob', 'import "prims.blob"\nstruct a { u32 x; }\n')
+
+        self.server = CompileServer(os.path.join(self.tmpdir, 'sock'))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+        self._parsed = []
+        self._orig_parse_data = ParseContext._parse_data
+        parsed = self._parsed
+        orig = self._orig_parse_data
+        def counting_parse_data(ctx, fn, data, is_import):
+            parsed.append(os.path.basename(fn))
+            return orig(ctx, fn, data, is_import)
+        ParseContext._parse_data = counting_parse_data
+
+    def tearDown(self):
+        ParseContext._parse_data = self._orig_parse_data
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, fn, text):
+        with open(os.path.join(self.tmpdir, fn), 'w') as f:
+            f.write(text)
+
+    def _read(self, fn):
+        with open(os.path.join(self.tmpdir, fn)) as f:
+            return f.read()
+
+    def _request(self, argv):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(self.server.socket_path)
+        s.sendall(json.dumps({'cwd': self.tmpdir, 'argv': argv}))
+        s.shutdown(socket.SHUT_WR)
+        reply = s.makefile().read()
+        s.close()
+        return json.loads(reply)
+
+    def test_compile(self):
+        reply = self._request(['-l', 'c', 'a.blob', '-o', 'a.h', '-a', 'a.c'])
+        self.assertEqual(reply['status'], 0)
+
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            self.assertEqual(main(['-l', 'c', 'a.blob', '-o', 'b.h', '-a', 'b.c']), 0)
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(self._read('a.h'), self._read('b.h'))
+        self.assertEqual(self._read('a.c').replace('a.h', 'b.h'), self._read('b.c'))
+
+    def test_keeps_parsed_files(self):
+        self.assertEqual(self._request(['-l', 'c', 'a.blob'])['status'], 0)
+        self.assertEqual(sorted(self._parsed), ['a.blob', 'prims.blob'])
+
+        reply = self._request(['-l', 'c', 'a.blob'])
+        self.assertEqual(sorted(self._parsed), ['a.blob', 'prims.blob'])
+
+        self._write('a.blob', 'import "prims.blob"\nstruct a { u32 x; u32 renamed; }\n')
+        reply2 = self._request(['-l', 'c', 'a.blob'])
+        self.assertEqual(sorted(self._parsed), ['a.blob', 'a.blob', 'prims.blob'])
+        self.assertIn('renamed', reply2['stdout'])
+        self.assertNotIn('renamed', reply['stdout'])
+
+    def test_diagnostics(self):
+        self._write('bad.blob', 'struct a { u32 x; }\n')
+        reply = self._request(['-l', 'c', 'bad.blob'])
+        self.assertEqual(reply['status'], 1)
+        self.assertIn('u32', reply['stderr'])
+
+        reply = self._request(['-l', 'nonesuch', 'a.blob'])
+        self.assertEqual(reply['status'], 2)
+        self.assertIn('usage:', reply['stderr'])
+
+        reply = self._request(['-l', 'c', 'a.blob', '--parse-jobs', '2'])
+        self.assertEqual(reply['status'], 2)
+        self.assertIn('--parse-jobs cannot be combined with a compile server', reply['stderr'])
+
+        # still serving
+        self.assertEqual(self._request(['-l', 'c', 'a.blob'])['status'], 0)
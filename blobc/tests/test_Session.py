@@ -0,0 +1,86 @@
+
+import blobc
+import unittest
+
+from blobc.Typesys import TypeSystemException
+
+class MutableImportHandler:
+    """Import handler over a dictionary that tests can edit between compiles"""
+    def __init__(self, files):
+        self.files = files
+    def get_import_contents(self, fn):
+        return self.files[fn]
+    def find_imported_file(self, fn):
+        return fn if self.files.has_key(fn) else None
+
+class TestSchemaSession(unittest.TestCase):
+
+    def setUp(self):
+        self.files = {
+            'prims': 'defprimitive u32 uint 4; defprimitive u8 uint 1;',
+            'consts': 'import "prims" iconst N = 2;',
+            'shapes': '''import "consts"
+                enum kind { A, B = N }
+                struct point { u32 x; u32 y; }
+                struct poly { point[N] pts; kind k; }''',
+            'main': '''import "shapes"
+                struct scene { poly* polys; point origin; u8 flags; }
+                struct misc { u32 z; }''',
+        }
+        self.session = blobc.SchemaSession(import_handler=MutableImportHandler(self.files))
+
+    def test_first_compile(self):
+        pt, tsys = self.session.compile('main')
+        self.assertEqual(sorted(self.session.reparsed), ['consts', 'main', 'prims', 'shapes'])
+        self.assertEqual(self.session.recompiled,
+                set(['u32', 'u8', 'kind', 'point', 'poly', 'scene', 'misc']))
+
+    def test_unchanged(self):
+        pt1, tsys1 = self.session.compile('main')
+        pt2, tsys2 = self.session.compile('main')
+        self.assertEqual(self.session.reparsed, [])
+        self.assertEqual(self.session.recompiled, set())
+        for t in tsys1.itertypes():
+            self.assertIs(tsys2.lookup(t.name), t)
+
+    def test_constant_change(self):
+        pt1, tsys1 = self.session.compile('main')
+        tm = blobc.TargetMachine()
+        self.assertEqual(tm.sizeof(tsys1.lookup('poly')), 20)
+
+        self.files['consts'] = 'import "prims" iconst N = 3;'
+        pt2, tsys2 = self.session.compile('main')
+        self.assertEqual(self.session.reparsed, ['consts'])
+        self.assertEqual(self.session.recompiled, set(['kind', 'poly', 'scene']))
+        self.assertIs(tsys2.lookup('point'), tsys1.lookup('point'))
+        self.assertIs(tsys2.lookup('misc'), tsys1.lookup('misc'))
+        self.assertEqual(tm.sizeof(tsys2.lookup('poly')), 28)
+        self.assertEqual(tsys2.lookup('kind').members[1].value, 3)
+        self.assertEqual([(n, v) for n, v, l in tsys2.iterconsts()], [('N', 3)])
+
+    def test_reused_enum_constants(self):
+        self.files['main'] += ' iconst K = kind.B + 1;'
+        self.session.compile('main')
+        self.files['main'] += ' struct extra { u8 e; }'
+        pt, tsys = self.session.compile('main')
+        self.assertEqual(self.session.recompiled, set(['scene', 'misc', 'extra']))
+        self.assertEqual(dict((n, v) for n, v, l in tsys.iterconsts())['K'], 3)
+
+    def test_removed_type(self):
+        self.session.compile('main')
+        self.files['shapes'] = 'import "consts" struct poly { u32 n; }'
+        with self.assertRaises(TypeSystemException):
+            self.session.compile('main')
+
+        # a failed compile must not hide the change from the next one
+        self.files['main'] = 'import "shapes" struct scene { poly* polys; }'
+        pt, tsys = self.session.compile('main')
+        self.assertEqual(self.session.recompiled, set(['poly', 'scene']))
+        self.assertEqual(len(tsys.lookup('poly').members), 1)
+
+    def test_dropped_import(self):
+        self.session.compile('main')
+        self.files['main'] = 'struct misc { misc* next; }'
+        pt, tsys = self.session.compile('main')
+        self.assertEqual([t.name for t in tsys.itertypes()], ['misc'])
+        self.assertEqual(self.session.recompiled, set(['misc']))
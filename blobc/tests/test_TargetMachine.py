@@ -0,0 +1,89 @@
+
+import blobc
+import threading
+import unittest
+
+class TestTargetMachine(unittest.TestCase):
+
+    def _setup(self, src):
+        pt = blobc.parse_string(src)
+        return blobc.compile_types(pt)
+
+    src = """
+        defprimitive u8 uint 1;
+        defprimitive u32 uint 4;
+        struct inner {
+            u8 a;
+            void* p;
+        }
+        struct outer {
+            u8 x;
+            inner[2] items;
+            u32 y;
+        }
+    """
+
+    def test_layout(self):
+        tsys = self._setup(self.src)
+        tm = blobc.TargetMachine(pointer_size=8)
+        layout = tm.struct_layout(tsys.lookup('outer'))
+        self.assertEqual((layout.size, layout.align), (48, 8))
+        self.assertEqual(list(layout.offsets), [0, 8, 40])
+        self.assertEqual(list(layout.sizes), [1, 32, 4])
+        self.assertEqual(list(layout.aligns), [1, 8, 4])
+        self.assertIs(tm.struct_layout(tsys.lookup('outer')), layout)
+
+    def test_targets_do_not_interfere(self):
+        tsys = self._setup(self.src)
+        outer = tsys.lookup('outer')
+        tm4 = blobc.TargetMachine(pointer_size=4)
+        tm8 = blobc.TargetMachine(pointer_size=8)
+        self.assertEqual(tm4.offsetof(outer, 'y'), 20)
+        self.assertEqual(tm8.offsetof(outer, 'y'), 40)
+        self.assertEqual(tm4.offsetof(outer, 'y'), 20)
+        self.assertEqual(tm4.sizeof(outer), 24)
+        self.assertEqual(tm8.sizeof(outer), 48)
+
+    def test_offsetof_unknown_member(self):
+        outer = self._setup(self.src).lookup('outer')
+        with self.assertRaises(blobc.Typesys.TypeSystemException) as cm:
+            blobc.TargetMachine().offsetof(outer, 'nonesuch')
+        self.assertIn('outer has no member nonesuch', str(cm.exception))
+
+    def test_threads(self):
+        tsys = self._setup(self.src)
+        outer = tsys.lookup('outer')
+        targets = [blobc.TargetMachine(pointer_size=ps, pointer_align=pa)
+                   for ps in (4, 8) for pa in (4, 8)]
+        results = {}
+
+        def work(index):
+            tm = targets[index % len(targets)]
+            results[index] = (tm.sizeof(outer), tm.offsetof(outer, 'y'), tm.struct_layout(outer))
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in xrange(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for index, (size, yoff, layout) in results.iteritems():
+            tm = targets[index % len(targets)]
+            self.assertIs(layout, tm.struct_layout(outer))
+            self.assertEqual(size, layout.size)
+            self.assertEqual(yoff, layout.offsets[2])
+
+    def test_base_layout_prefix(self):
+        tsys = self._setup("""
+            defprimitive u8 uint 1;
+            defprimitive u32 uint 4;
+            struct base_s { u32 a; u8 b; }
+            struct derived : base(base_s) { u8 c; void* p; }
+        """)
+        tm = blobc.TargetMachine(pointer_size=8)
+        base_layout = tm.struct_layout(tsys.lookup('base_s'))
+        layout = tm.struct_layout(tsys.lookup('derived'))
+        self.assertEqual((base_layout.size, base_layout.end), (8, 5))
+        self.assertEqual(list(layout.offsets), [0, 4, 5, 8])
+        self.assertEqual(list(layout.sizes), [4, 1, 1, 8])
+        self.assertEqual((layout.size, layout.align, layout.end), (16, 8, 16))
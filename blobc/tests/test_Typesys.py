@@ -154,3 +154,278 @@ class TestTypeSystem(unittest.TestCase):
         self._check_eval_expr(-17, 17, '-', -34)
         self._check_eval_expr(-17, -17, '-', 0)
         
+
+    def test_forward_constant(self):
+        for src, line in (("iconst C = D;\niconst D = 2;", 1),
+                          ("enum e { X = 1 }\niconst a = 1;\niconst b = a + f.Y;\nenum f { Y }", 3),
+                          ("enum e { X = Y, Y = 2 }", 1)):
+            with self.assertRaises(TypeSystemException) as cm:
+                self._setup(src)
+            self.assertIn('(%d): constant ' % (line), str(cm.exception))
+            self.assertIn('used before its definition', str(cm.exception))
+
+    def test_constants_in_source_order(self):
+        tsys = self._setup("""
+            iconst c = 3;
+            enum e { X = c, Y }
+            iconst b = e.Y + 1;
+            iconst a = b * 2;
+        """)
+        consts = [(name, value) for name, value, loc in tsys.iterconsts()]
+        self.assertEqual(consts, [('c', 3), ('b', 5), ('a', 10)])
+        self.assertEqual([m.value for m in tsys.lookup('e').members], [3, 4])
+
+    def test_enum_scope_only_earlier_members(self):
+        tsys = self._setup("iconst B = 10; enum E { A = B + 1, B = 3 }")
+        self.assertEqual([m.value for m in tsys.lookup('E').members], [11, 3])
+        tsys = self._setup("iconst X = 5; enum E { A = X, X }")
+        self.assertEqual([m.value for m in tsys.lookup('E').members], [5, 6])
+
+    def test_enum_scope_shadows_global(self):
+        tsys = self._setup("""
+            iconst A = 100;
+            enum e { A = 1, B = A + 1 }
+            iconst C = A + e.B;
+        """)
+        self.assertEqual([m.value for m in tsys.lookup('e').members], [1, 2])
+        self.assertEqual(dict((n, v) for n, v, l in tsys.iterconsts())['C'], 102)
+
+    def test_constant_self_reference(self):
+        with self.assertRaises(TypeSystemException) as cm:
+            self._setup("""
+                iconst a = 1;
+                iconst b = b + a;
+            """)
+        self.assertIn("(3): constant 'b' used before its definition", str(cm.exception))
+
+    def test_undefined_constant(self):
+        with self.assertRaises(TypeSystemException) as cm:
+            self._setup("""
+                enum e { A, B = nope }
+            """)
+        self.assertIn("(2): undefined constant: 'nope'", str(cm.exception))
+
+    def test_duplicate_constant(self):
+        with self.assertRaises(TypeSystemException):
+            self._setup("iconst a = 1; iconst a = 2;")
+
+    def test_long_enum_chain(self):
+        count = 5000
+        members = ', '.join('M%d' % (x) for x in xrange(count))
+        tsys = self._setup("enum e { %s } iconst last = e.M%d;" % (members, count - 1))
+        self.assertEqual(tsys.lookup('e').members[-1].value, count - 1)
+        self.assertEqual(list(tsys.iterconsts())[0][1], count - 1)
+
+    def test_array_dims_shared_by_bases(self):
+        tsys = self._setup("""
+            defprimitive u8 uint 1;
+            iconst N = 4 * 2;
+            struct a { u8[N] x; }
+            struct b : base(a) { u8[N] y; }
+            struct c : base(b) { }
+        """)
+        c = tsys.lookup('c')
+        self.assertEqual([m.mtype.dim for m in c.members], [8, 8])
+        self.assertIs(c.members[0].mtype, tsys.lookup('a').members[0].mtype)
+
+    def test_struct_order(self):
+        tsys = self._setup("""
+            defprimitive u8 uint 1;
+            struct top { mid[2] m; leaf l; }
+            struct mid { leaf[3] l; other* o; }
+            struct leaf { u8 x; }
+            struct other { top* t; }
+        """)
+        names = [t.name for t in tsys.struct_order()]
+        self.assertEqual(names, ['leaf', 'mid', 'top', 'other'])
+        top, mid, leaf, other = [tsys.lookup(n) for n in ('top', 'mid', 'leaf', 'other')]
+        self.assertEqual(tsys.value_dependencies(top), [mid, leaf])
+        self.assertEqual(tsys.pointer_dependencies(mid), [other])
+        self.assertTrue(tsys.has_pointers(top))
+        self.assertTrue(tsys.has_pointers(mid))
+        self.assertFalse(tsys.has_pointers(leaf))
+        self.assertEqual(tsys.reachable_structs(leaf), frozenset())
+        self.assertEqual(tsys.reachable_structs(mid), frozenset([leaf, mid, other, top]))
+
+    def test_recursive_struct(self):
+        with self.assertRaises(TypeSystemException) as cm:
+            self._setup("""
+                struct a { b x; }
+                struct b { c[2] y; }
+                struct c {
+                    a z;
+                }
+            """)
+        self.assertIn('(5): recursive structure not allowed', str(cm.exception))
+
+    def test_pointer_recursion_allowed(self):
+        tsys = self._setup("struct a { a* next; }")
+        a = tsys.lookup('a')
+        self.assertEqual(tsys.reachable_structs(a), frozenset([a]))
+
+    def test_reachable_structs(self):
+        src = """
+            defprimitive u8 uint 1;
+            struct a { b x; d* p; }
+            struct b { c* p; u8 y; }
+            struct c { b*[2] q; e z; }
+            struct d { a* back; }
+            struct e { u8 w; }
+            struct f { f* self; c* other; }
+            struct g { e v; }
+        """
+        reach = {'a': 'abcde', 'b': 'bce', 'c': 'bce', 'd': 'abcde', 'e': '', 'f': 'bcef', 'g': 'e'}
+        for lazy in (False, True):
+            tsys = blobc.compile_types(blobc.parse_string(src), lazy=lazy)
+            for name in 'gfedcba':
+                self.assertEqual(sorted(t.name for t in tsys.reachable_structs(tsys.lookup(name))),
+                                 list(reach[name]))
+
+    def test_deep_struct_chain(self):
+        count = 3000
+        src = ['defprimitive u8 uint 1; struct s0 { u8 x; }']
+        for x in xrange(1, count):
+            src.append('struct s%d { s%d inner; }' % (x, x - 1))
+        src.reverse()
+        tsys = self._setup('\n'.join(src))
+        order = tsys.struct_order()
+        self.assertEqual(order[0].name, 's0')
+        self.assertEqual(order[-1].name, 's%d' % (count - 1))
+
+    def test_struct_base_shares_members(self):
+        tsys = self._setup("""
+            defprimitive u32 uint 4;
+            struct leaf1 : base(mid) { u32 c; }
+            struct mid : base(root) { u32 b; }
+            struct root { u32 a; }
+            struct leaf2 : base(mid) { }
+        """)
+        root, mid, leaf1, leaf2 = [tsys.lookup(n) for n in ('root', 'mid', 'leaf1', 'leaf2')]
+        self.assertEqual([m.mname for m in leaf1.members], ['a', 'b', 'c'])
+        self.assertIs(leaf1.members[0], root.members[0])
+        self.assertIs(leaf1.members[1], mid.members[1])
+        self.assertIs(leaf2.members[1], mid.members[1])
+        self.assertIs(leaf1.base_type, mid)
+        self.assertIs(mid.base_type, root)
+        self.assertIs(leaf1.member_by_name('a'), root.members[0])
+        self.assertEqual(leaf1.member_index('c'), 2)
+        self.assertEqual(len(mid.members), 2)
+
+    def test_struct_base_cycle(self):
+        with self.assertRaises(TypeSystemException):
+            self._setup("""
+                defprimitive u32 uint 4;
+                struct a : base(b) { u32 x; }
+                struct b : base(a) { u32 y; }
+            """)
+
+    def test_struct_base_duplicate_member(self):
+        with self.assertRaises(TypeSystemException):
+            self._setup("""
+                defprimitive u32 uint 4;
+                struct a { u32 x; }
+                struct b : base(a) { u32 x; }
+            """)
+
+    index_src = """
+        defprimitive u32 uint 4;
+        struct root { u32 a; }
+        struct mid : base(root) { u32 b; }
+        struct leaf : base(mid) { u32 c; }
+        struct other : base(root) { }
+        struct holder { root* r; mid[2] m; }
+        struct plain { u32 x; }
+        struct outer { holder h; plain p; }
+    """
+
+    def test_referencing_structs(self):
+        tsys = self._setup(self.index_src)
+        names = lambda ts: [t.name for t in ts]
+        self.assertEqual(names(tsys.referencing_structs(tsys.lookup('root'))), ['holder'])
+        self.assertEqual(names(tsys.referencing_structs(tsys.lookup('mid'))), ['holder'])
+        self.assertEqual(names(tsys.referencing_structs(tsys.lookup('holder'))), ['outer'])
+        self.assertEqual(names(tsys.referencing_structs(tsys.lookup('u32'))),
+                         ['root', 'mid', 'leaf', 'other', 'plain'])
+        self.assertEqual(tsys.referencing_structs(tsys.lookup('outer')), ())
+
+    def test_derived_structs(self):
+        tsys = self._setup(self.index_src)
+        names = lambda ts: sorted(t.name for t in ts)
+        self.assertEqual(names(tsys.derived_structs(tsys.lookup('root'))), ['leaf', 'mid', 'other'])
+        self.assertEqual(names(tsys.derived_structs(tsys.lookup('mid'))), ['leaf'])
+        self.assertEqual(tsys.derived_structs(tsys.lookup('leaf')), ())
+
+        root, mid, leaf = [tsys.lookup(n) for n in ('root', 'mid', 'leaf')]
+        self.assertEqual(leaf.ancestors(), frozenset([root, mid, leaf]))
+        self.assertTrue(leaf.is_superset_of(root))
+        self.assertFalse(root.is_superset_of(leaf))
+        self.assertFalse(tsys.lookup('other').is_superset_of(mid))
+
+    def test_pointer_structs(self):
+        tsys = self._setup(self.index_src)
+        self.assertEqual([t.name for t in tsys.pointer_structs()], ['holder', 'outer'])
+
+    def test_index_invalidated(self):
+        tsys = self._setup(self.index_src)
+        plain = tsys.lookup('plain')
+        self.assertEqual(tsys.referencing_structs(plain), (tsys.lookup('outer'),))
+
+        extra = blobc.Typesys.StructType('extra', None)
+        extra.add_member(blobc.Typesys.StructMember('p', plain.pointer_type(None), None, None))
+        tsys._add_type('extra', extra)
+        tsys._structs.append(extra)
+        tsys._analyze_structs()
+        self.assertEqual(tsys.referencing_structs(plain), (tsys.lookup('outer'), extra))
+        self.assertIn(extra, tsys.pointer_structs())
+
+    def test_lazy_resolves_reachable(self):
+        tsys = blobc.compile_types(blobc.parse_string("""
+            defprimitive u32 uint 4;
+            struct a { u32 x; }
+            struct b : base(a) { c* p; }
+            struct c { u32[2] y; }
+            struct d { u32 z; }
+        """), lazy=True)
+        self.assertEqual(sorted(tsys._pending), ['a', 'b', 'c', 'd'])
+        b = tsys.lookup('b')
+        self.assertEqual(sorted(tsys._pending), ['d'])
+        self.assertEqual([m.mname for m in b.members], ['x', 'p'])
+        self.assertEqual(tsys.lookup('c').members[0].mtype.dim, 2)
+        self.assertTrue(tsys.has_pointers(b))
+        order = [t.name for t in tsys.struct_order()]
+        self.assertEqual(sorted(order), ['a', 'b', 'c', 'd'])
+        self.assertEqual(tsys._pending, {})
+
+    def test_lazy_recursion(self):
+        tsys = blobc.compile_types(blobc.parse_string("""
+            defprimitive u32 uint 4;
+            struct a { b x; }
+            struct b { a y; }
+            struct ok { u32 z; }
+        """), lazy=True)
+        self.assertEqual(tsys.lookup('ok').members[0].mname, 'z')
+        for i in range(2):
+            with self.assertRaises(TypeSystemException) as cm:
+                tsys.lookup('a')
+            self.assertIn('recursive structure', str(cm.exception))
+        self.assertEqual(sorted(tsys._pending), ['a', 'b'])
+        with self.assertRaises(TypeSystemException):
+            tsys.struct_order()
+        with self.assertRaises(TypeSystemException):
+            list(tsys.itertypes())
+
+    def test_lazy_undefined_type(self):
+        tsys = blobc.compile_types(blobc.parse_string("""
+            defprimitive u32 uint 4;
+            struct a { u32 x; }
+            struct b : base(a) { c* p; }
+            struct c { nonesuch y; }
+        """), lazy=True)
+        for i in range(2):
+            with self.assertRaises(TypeSystemException) as cm:
+                tsys.lookup('b')
+            self.assertIn('nonesuch', str(cm.exception))
+        with self.assertRaises(TypeSystemException):
+            list(tsys.itertypes())
+        # structs outside the failed closure still resolve
+        self.assertEqual([m.mname for m in tsys.lookup('a').members], ['x'])
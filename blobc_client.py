@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+
+# Thin client for a compile server started with "blobc.py --serve <socket>".
+#
+# Takes the same arguments as blobc.py. The command line is sent to the
+# server listening on the Unix socket named by $BLOBC_SERVER; when that isn't
+# set or the server can't be reached, the compile runs in this process.
+# Only the standard library is imported until then, so a request costs
+# little more than starting the interpreter.
+
+import os
+import sys
+import json
+import socket
+
+def request(socket_path, argv):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(socket_path)
+        s.sendall(json.dumps({'cwd': os.getcwd(), 'argv': argv}))
+        s.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        s.close()
+    return json.loads(''.join(chunks))
+
+def main(argv):
+    socket_path = os.environ.get('BLOBC_SERVER')
+    if socket_path:
+        try:
+            reply = request(socket_path, argv)
+        except (socket.error, ValueError):
+            # no server, or it went away mid-request
+            pass
+        else:
+            sys.stdout.write(reply['stdout'].encode('latin-1'))
+            sys.stderr.write(reply['stderr'].encode('latin-1'))
+            return reply['status']
+
+    from blobc.Driver import main as local_main
+    return local_main(argv)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -10,6 +10,7 @@ local environment = require "tundra.environment"
 
 local _mt_multi = nodegen.create_eval_subclass {}
 local _mt_merge = nodegen.create_eval_subclass {}
+local _mt_batch = nodegen.create_eval_subclass {}
 
 -- Utility function to compute a suitable filename under $(SRCGENDIR) to
 -- generate a file from a given source file.
@@ -69,28 +70,38 @@ function _mt_merge:create_dag(env, args, deps)
     }
 end
 
-function _mt_multi:create_dag(env, args, deps)
-    -- Implicitly generate output names, don't merge inputs.
+-- Output file name and, for languages that have one, auxiliary output file
+-- name generated for a source file.
+local function generated_outputs(env, language, src_fn)
     local ext, aux_ext
-    if args.Language == "c" then
+    if language == "c" then
         ext = ".h"
         aux_ext = ".c"
-    elseif args.Language == "csharp" then
+    elseif language == "csharp" then
         ext = ".cs"
-    elseif args.Language == "m68k" then
+    elseif language == "m68k" then
         ext = ".i"
     else
-        error("unsupported language " .. args.Language)
+        error("unsupported language " .. language)
+    end
+
+    local aux_fn
+    if aux_ext then
+        aux_fn = make_generated_filename(env, src_fn, aux_ext)
     end
+    return make_generated_filename(env, src_fn, ext), aux_fn
+end
 
+function _mt_multi:create_dag(env, args, deps)
+    -- Implicitly generate output names, don't merge inputs.
     if #args.Sources > 1 then
-        error("BlobCt supports a single source file only")
+        error("BlobCt supports a single source file only; use BlobCtBatch for several")
     end
 
-    local outputs = { make_generated_filename(env, args.Sources[1], ext) }
+    local out_fn, aux_fn = generated_outputs(env, args.Language, args.Sources[1])
+    local outputs = { out_fn }
     local aux_str = ''
-    if aux_ext then
-        local aux_fn = make_generated_filename(env, args.Sources[1], aux_ext)
+    if aux_fn then
         outputs[2] = aux_fn
         aux_str = ' -a ' .. aux_fn
     end
@@ -105,6 +116,31 @@ function _mt_multi:create_dag(env, args, deps)
     }
 end
 
+function _mt_batch:create_dag(env, args, deps)
+    -- Like BlobCt, but compile all sources in a single blobc process so
+    -- shared imports are only parsed and compiled once.
+    local outputs = {}
+    local batch_str = ''
+    for _, src_fn in ipairs(args.Sources) do
+        local out_fn, aux_fn = generated_outputs(env, args.Language, src_fn)
+        outputs[#outputs + 1] = out_fn
+        batch_str = batch_str .. ' -b ' .. src_fn .. ' ' .. out_fn
+        if aux_fn then
+            outputs[#outputs + 1] = aux_fn
+            batch_str = batch_str .. ' ' .. aux_fn
+        end
+    end
+    return env:make_node {
+        Label = "BlobC batch $(@:[1])",
+        Action = "$(BLOBC) $(BLOBPATH:p-I) -l " .. args.Language .. batch_str,
+        Pass = args.Pass,
+        Dependencies = deps,
+        InputFiles = args.Sources,
+        OutputFiles = outputs,
+        Scanner = get_scanner(env),
+    }
+end
+
 local blueprint_multi = {
     Sources = { Type = "source_list", Required = true, ExtensionKey = "BLOBCEXTS" },
     Language = { Type = "string", Required = true },
@@ -119,8 +155,11 @@ local blueprint_merge = {
 
 nodegen.add_evaluator("BlobCt", _mt_multi, blueprint_multi)
 nodegen.add_evaluator("BlobCtMerge", _mt_merge, blueprint_merge)
+nodegen.add_evaluator("BlobCtBatch", _mt_batch, blueprint_multi)
 
 environment.add_global_setup(function(env)
+    -- Set BLOBC to blobc_client.py to send compiles to a server started with
+    -- "blobc.py --serve" (socket named by $BLOBC_SERVER).
     env:set_default('BLOBC', 'blobc.py')
     env:set_default('BLOBCEXTS', '.blob')
     env:set_default('BLOBGENDIR', '$(OBJECTDIR)/_blobgen')